@@ -0,0 +1,138 @@
+"""
+Wall collisions of agents with the windtunnel.
+
+An agent that ends up past a wall is teleported back inside, a small distance from that wall, and the velocity
+component normal to the wall is scaled by a factor that depends on the collision type:
+
+    elastic         -1
+    part_elastic    -restitution_coeff
+    crash           0
+
+With mode='reflect', agents are mirrored across the wall instead of teleported. A straight step from x0 to x past a
+wall hits it at time t_c = (wall - x0) / v; flying the rest of the step, dt - t_c = (x - wall) / v, with the
+post-collision velocity -e * v ends at
+
+    wall - e * (x - wall)
+
+where e is the restitution (1, restitution_coeff or 0). This is exact for any step length, so unlike teleporting by a
+fixed distance it doesn't tie the collision geometry to dt. Steps long enough to cross the tunnel are reflected again
+until they end up inside, at most MAX_REFLECTIONS times. Whatever is still outside after that (only possible for steps
+many tunnel widths long, or infinite ones) is stopped at the wall it went through.
+
+All six walls are checked at once with masked array operations, for one agent or a whole ensemble.
+"""
+__author__ = 'richard'
+
+import numpy as np
+
+# walls in the order of WallCollider.crash_counts: (lower, upper) wall of x, y and z
+WALL_NAMES = (('downwind', 'upwind'),
+              ('left', 'right'),
+              ('floor', 'ceiling'))
+
+MAX_REFLECTIONS = 100  # reflection passes per collide() call in 'reflect' mode
+
+
+class WallCollider(object):
+    def __init__(self, walls, collision_type, restitution_coeff=None, teleport_distance=0.005, mode='teleport'):
+        """
+        Parameters
+        ----------
+        walls
+            environment.Walls
+        collision_type
+            'elastic', 'part_elastic' or 'crash'
+        restitution_coeff
+            fraction of the normal velocity kept (and reversed) in a part_elastic collision
+        teleport_distance
+            how far inside the wall agents are put back. this is arbitrary
+        mode
+            'teleport' puts agents teleport_distance inside the wall, 'reflect' reflects the rest of their step off
+            the wall
+        """
+        self.lower = np.array([walls.downwind, walls.left, walls.floor])
+        self.upper = np.array([walls.upwind, walls.right, walls.ceiling])
+        self.teleport_distance = teleport_distance
+
+        if collision_type == 'elastic':
+            self.velocity_factor = -1.
+        elif collision_type == 'part_elastic':
+            self.velocity_factor = -restitution_coeff
+        elif collision_type == 'crash':
+            self.velocity_factor = 0.
+        else:
+            raise ValueError("unknown collision type {}".format(collision_type))
+        self.collision_type = collision_type
+
+        if mode not in ('teleport', 'reflect'):
+            raise ValueError("unknown wall collision mode {}".format(mode))
+        self.mode = mode
+
+        self.crash_counts = np.zeros((3, 2), dtype=np.int64)  # [dimension, lower/upper wall], see WALL_NAMES
+
+    def collide(self, positions, velocities):
+        """
+        Parameters
+        ----------
+        positions, velocities
+            candidate [x, y, z] of one agent, or (N, 3) arrays for an ensemble
+
+        Returns
+        -------
+        positions, velocities
+            after resolving collisions. the inputs are returned untouched if nobody hit a wall, and never modified
+        """
+        too_low = positions < self.lower
+        too_high = positions > self.upper
+        hit = too_low | too_high
+        if not hit.any():
+            return positions, velocities
+
+        if self.mode == 'reflect':
+            return self._reflect(positions, velocities, too_low, too_high)
+
+        self._count(too_low, too_high)
+
+        positions = np.where(too_low, self.lower + self.teleport_distance, positions)  # teleport back inside
+        positions = np.where(too_high, self.upper - self.teleport_distance, positions)
+        velocities = np.where(hit, velocities * self.velocity_factor, velocities)
+
+        return positions, velocities
+
+    def _reflect(self, positions, velocities, too_low, too_high):
+        restitution = -self.velocity_factor
+        # without restitution the reflection is the wall itself, which is where the clip below puts agents anyway
+        for _ in range(MAX_REFLECTIONS if restitution > 0 else 0):
+            self._count(too_low, too_high)
+
+            positions = np.where(too_low, self.lower + restitution * (self.lower - positions), positions)
+            positions = np.where(too_high, self.upper - restitution * (positions - self.upper), positions)
+            velocities = np.where(too_low | too_high, velocities * self.velocity_factor, velocities)
+
+            # a long step may have been reflected right through the opposite wall
+            too_low = positions < self.lower
+            too_high = positions > self.upper
+            if not (too_low | too_high).any():
+                return positions, velocities
+
+        self._count(too_low, too_high)
+        positions = np.clip(positions, self.lower, self.upper)
+        velocities = np.where(too_low | too_high, velocities * self.velocity_factor, velocities)
+
+        return positions, velocities
+
+    def _count(self, too_low, too_high):
+        if too_low.ndim == 1:
+            self.crash_counts[:, 0] += too_low
+            self.crash_counts[:, 1] += too_high
+        else:
+            self.crash_counts[:, 0] += too_low.sum(axis=0)
+            self.crash_counts[:, 1] += too_high.sum(axis=0)
+
+    def crash_count_dict(self):
+        """number of collisions with every wall since the last reset_diagnostics()"""
+        return {name: int(self.crash_counts[dim, side])
+                for dim, names in enumerate(WALL_NAMES) for side, name in enumerate(names)}
+
+    def reset_diagnostics(self):
+        self.crash_counts[:] = 0
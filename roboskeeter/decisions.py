@@ -1,14 +1,38 @@
+import numpy as np
+
+# decisions and plume signals are stored as int8 codes into these tuples
+DECISIONS = ('search', 'ignore', 'surge', 'cast_l', 'cast_r', 'ga')
+PLUME_SIGNALS = ('out', 'in', 'exit_l', 'exit_r', 'none', 'gradient')
+DECISION_CODES = {decision: code for code, decision in enumerate(DECISIONS)}
+PLUME_SIGNAL_CODES = {signal: code for code, signal in enumerate(PLUME_SIGNALS)}
+
+
+def plume_signal_code(plume_signal):
+    """map a plume signal returned by make_decision() (or the gradient looked up for it) to its code"""
+    if isinstance(plume_signal, np.ndarray):
+        return PLUME_SIGNAL_CODES['gradient']
+    elif isinstance(plume_signal, str):
+        return PLUME_SIGNAL_CODES[plume_signal]
+    else:  # the ignore policy returns 0
+        return PLUME_SIGNAL_CODES['none']
+
 
 class Decisions:
     def __init__(self, decision_policy, stimulus_memory_n_timesteps):
         self.decision_policy = decision_policy
 
         self.stimulus_memory_n_timesteps = stimulus_memory_n_timesteps
-        self.plume_sighted_ago = 10000000  # a long time ago
+        self.never_sighted = 10000000  # a long time ago
+        self.plume_sighted_ago = self.never_sighted
         self.last_plume_side_exited = None
 
         self.make_decision = self._set_decision_policy()
+        self.ignores_plume = self.make_decision == self._ignore_plume
+        self.needs_gradient = self.make_decision == self._gradient_decisions  # the plume gradient drives the agent
 
+        # per-agent policy state of an ensemble, see reset() and update()
+        self.agent_sighted_ago = None
+        self.agent_last_exit_left = None
 
     def _set_decision_policy(self):
         if 'cast' in self.decision_policy:
@@ -23,6 +47,124 @@ class Decisions:
             raise ValueError('unk decision policy {}'.format(self.decision_policy))
         return policy
 
+    def reset(self, n_agents):
+        """start an ensemble of n_agents that have never seen the plume"""
+        self.agent_sighted_ago = np.full(n_agents, self.never_sighted, dtype=np.int64)
+        self.agent_last_exit_left = np.zeros(n_agents, dtype=bool)
+
+    def update(self, in_plume, crosswind_velocity, agents=None):
+        """
+        One timestep of the decision policy for a whole ensemble (see reset()), the array version of make_decision().
+
+        Parameters
+        ----------
+        in_plume
+            (n,) boolean array
+        crosswind_velocity
+            (n,) array of y velocities
+        agents
+            (n,) indices of the agents these rows belong to, or None if they are the whole ensemble in order
+
+        Returns
+        -------
+        decisions, plume_signals
+            (n,) int8 arrays of codes into DECISIONS and PLUME_SIGNALS. for the gradient policy the plume signal is
+            'gradient', and the caller looks the gradient up
+        """
+        in_plume = np.asarray(in_plume, dtype=bool)
+        n_rows = len(in_plume)
+
+        if self.ignores_plume:
+            return np.full(n_rows, DECISION_CODES['ignore'], dtype=np.int8), \
+                   np.full(n_rows, PLUME_SIGNAL_CODES['none'], dtype=np.int8)
+        elif self.needs_gradient:
+            return np.full(n_rows, DECISION_CODES['ga'], dtype=np.int8), \
+                   np.full(n_rows, PLUME_SIGNAL_CODES['gradient'], dtype=np.int8)
+
+        if agents is None:
+            agents = slice(None)
+
+        plume_sighted_ago = np.where(in_plume, 0, self.agent_sighted_ago[agents] + 1)
+        self.agent_sighted_ago[agents] = plume_sighted_ago
+
+        exited_left = np.asarray(crosswind_velocity) < 0
+        last_exit_left = np.where(plume_sighted_ago == 1, exited_left, self.agent_last_exit_left[agents])
+        self.agent_last_exit_left[agents] = last_exit_left
+
+        return self._boolean_codes(in_plume, plume_sighted_ago, exited_left, last_exit_left)
+
+    def scan(self, in_plume, crosswind_velocity, trajectory_nums):
+        """
+        Run the decision policy over whole trajectories at once, e.g. to annotate experimental data.
+
+        Gives the same decisions as calling make_decision() row by row with a fresh Decisions object for every
+        trajectory, but without the Python loop: the policy state at each row (timesteps since the plume was last
+        sighted, side the plume was last exited on) is solved for with cumulative maxima over each trajectory.
+
+        Parameters
+        ----------
+        in_plume
+            (R,) boolean array
+        crosswind_velocity
+            (R,) array of y velocities
+        trajectory_nums
+            (R,) array. rows of a trajectory must be contiguous and in time order
+
+        Returns
+        -------
+        decisions, plume_signals
+            (R,) int8 arrays of codes into DECISIONS and PLUME_SIGNALS
+        """
+        in_plume = np.asarray(in_plume, dtype=bool)
+        crosswind_velocity = np.asarray(crosswind_velocity)
+        trajectory_nums = np.asarray(trajectory_nums)
+        n_rows = len(in_plume)
+
+        if self.ignores_plume:
+            return np.full(n_rows, DECISION_CODES['ignore'], dtype=np.int8), \
+                   np.full(n_rows, PLUME_SIGNAL_CODES['none'], dtype=np.int8)
+        elif self.needs_gradient:
+            return np.full(n_rows, DECISION_CODES['ga'], dtype=np.int8), \
+                   np.full(n_rows, PLUME_SIGNAL_CODES['gradient'], dtype=np.int8)
+
+        row = np.arange(n_rows)
+        trajectory_starts = np.ones(n_rows, dtype=bool)
+        trajectory_starts[1:] = trajectory_nums[1:] != trajectory_nums[:-1]
+        first_row = np.maximum.accumulate(np.where(trajectory_starts, row, 0))
+
+        # timesteps since the plume was last sighted in this trajectory
+        last_sighting = np.maximum.accumulate(np.where(in_plume, row, -1))
+        plume_sighted_ago = np.where(last_sighting >= first_row, row - last_sighting, self.never_sighted)
+
+        # side of the plume we last exited on in this trajectory
+        exited = plume_sighted_ago == 1
+        exited_left = crosswind_velocity < 0
+        last_exit = np.maximum.accumulate(np.where(exited, row, -1))
+        have_exited = last_exit >= first_row
+        last_exit_left = have_exited & exited_left[np.maximum(last_exit, 0)]
+
+        return self._boolean_codes(in_plume, plume_sighted_ago, exited_left, last_exit_left)
+
+    def _boolean_codes(self, in_plume, plume_sighted_ago, exited_left, last_exit_left):
+        """decision and plume signal codes of the boolean policies, given the policy state at every row"""
+        decisions = np.full(len(in_plume), DECISION_CODES['search'], dtype=np.int8)
+        plume_signals = np.full(len(in_plume), PLUME_SIGNAL_CODES['out'], dtype=np.int8)
+
+        if 'surge' in self.decision_policy:
+            decisions[in_plume] = DECISION_CODES['surge']
+        plume_signals[in_plume] = PLUME_SIGNAL_CODES['in']
+
+        # we just exited the plume. if our y velocity is negative, we just exited to the left. otherwise, to the right.
+        exited = plume_sighted_ago == 1
+        plume_signals[exited] = np.where(exited_left[exited], PLUME_SIGNAL_CODES['exit_l'], PLUME_SIGNAL_CODES['exit_r'])
+        decisions[exited] = np.where(exited_left[exited], DECISION_CODES['cast_r'], DECISION_CODES['cast_l'])
+
+        if 'cast' in self.decision_policy:  # cast away from the side we exited if we were in the plume recently
+            casting = (plume_sighted_ago > 1) & (plume_sighted_ago <= self.stimulus_memory_n_timesteps)
+            decisions[casting] = np.where(last_exit_left[casting], DECISION_CODES['cast_r'], DECISION_CODES['cast_l'])
+
+        return decisions, plume_signals
+
     def _boolean_decisions(self, in_plume, crosswind_velocity):
         if in_plume == True:  # use == instead of "is" because we're using type np.bool
             self.plume_sighted_ago = 0
@@ -67,7 +209,7 @@ class Decisions:
         plume_signal
             tell upstream code to look up plume signal
         """
-        plume_signal = 'X'  # magic code to look up gradient
+        plume_signal = 'gradient'
         current_decision = 'ga'
 
         return current_decision, plume_signal
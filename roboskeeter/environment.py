@@ -1,13 +1,20 @@
 __author__ = 'richard'
 
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 from scipy.interpolate import Rbf
 from scipy.spatial import cKDTree as kdt
 
+from roboskeeter.io import plume_cache, raw_plume_cache
 from roboskeeter.io.i_o import get_directory
+from roboskeeter.math.rbf_evaluation import evaluate_rbf_on_grid, evaluate_rbf_gradient_on_grid, evaluate_rbf_gradient
+from roboskeeter.math.regular_grid import RegularGridSampler
 from roboskeeter.plotting.plot_environment import plot_windtunnel, plot_plume_gradient, draw_bool_plume
 
+DEFAULT_PLUME_RESOLUTION = (50, 15, 15)  # number of x, y, z points gridded plumes are interpolated at
+
 
 class Environment(object):
     def __init__(self, experiment):
@@ -22,14 +29,23 @@ class Environment(object):
         self.condition = experiment.experiment_conditions['condition']
         self.bounded = experiment.experiment_conditions['bounded']
         self.plume_model = experiment.experiment_conditions['plume_model'].lower()
+        # how to sample gridded plumes: 'nearest' grid point or 'trilinear' interpolation
+        self.plume_sampling = experiment.experiment_conditions.get('plume_sampling', 'nearest')
+        # number of x, y, z points to interpolate gridded plumes at
+        self.plume_resolution = experiment.experiment_conditions.get('plume_resolution', DEFAULT_PLUME_RESOLUTION)
+        # number of processes to interpolate gridded plumes with
+        self.plume_build_processes = experiment.experiment_conditions.get('plume_build_processes', None)
+        # how to get the TimeAvg plume gradient: 'finite_difference' of the temperature grid, 'analytic' derivative of
+        # the RBF precomputed on the grid, or 'analytic_on_demand' RBF derivative evaluated at the queried positions
+        self.plume_gradient = experiment.experiment_conditions.get('plume_gradient', 'finite_difference')
 
         if self.condition == 'Control' and self.plume_model != 'none':
             print "{} plume model selected for control condition, setting instead to no plume.".format(self.plume_model)
             self.plume_model = 'none'
 
         self.windtunnel = WindTunnel(self.condition)
-        self.plume = self._load_plume()
         self.room_temperature = 19.0
+        self.plume = self._load_plume()
 
     def _load_plume(self):
         if self.plume_model == "boolean":
@@ -101,6 +117,26 @@ class Walls:
 
         return inside, past_wall
 
+    def in_bounds_mask(self, positions):
+        """
+        Vectorized version of check_in_bounds()
+
+        Parameters
+        ----------
+        positions
+            [x, y, z] or (N, 3) array
+
+        Returns
+        -------
+        (N,) boolean array, True where the position is inside the windtunnel
+        """
+        positions = np.atleast_2d(positions)
+        x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
+
+        return (x >= self.downwind) & (x <= self.upwind) & \
+               (y >= self.left) & (y <= self.right) & \
+               (z >= self.floor) & (z <= self.ceiling)
+
 
 class Heater:
     def __init__(self, side, experimental_condition):
@@ -173,19 +209,66 @@ class Plume(object):
         self.ceiling = self.walls.ceiling
         self.floor = self.walls.floor
         self.bounds = [self.downwind, self.upwind, self.left, self.right, self.floor, self.ceiling]
+        self.room_temperature = environment.room_temperature
+
+    # every plume answers these batched queries. the simulator, the annotation of experiments and the plots all go
+    # through them, so a new plume model only needs to implement these three
+    def in_plume_mask(self, positions, time=0.):
+        """
+        Parameters
+        ----------
+        positions
+            (N, 3) array of positions
+        time
+            simulation time (s). only time-resolved plumes depend on it
+
+        Returns
+        -------
+        (N,) boolean array, True inside the plume
+        """
+        raise NotImplementedError
+
+    def temperatures(self, positions, time=0.):
+        """(N,) float array of the temperatures at (N, 3) positions, see in_plume_mask()"""
+        raise NotImplementedError
+
+    def gradients(self, positions, time=0.):
+        """(N, 3) float array of the temperature gradients at (N, 3) positions, see in_plume_mask()"""
+        raise NotImplementedError
+
+    # the same queries for one [x, y, z] position. (N, 3) arrays are passed straight to the batched query
+    def check_in_plume_bounds(self, position, time=0.):
+        return _query_one(self.in_plume_mask, position, time)
+
+    def get_temperature(self, position, time=0.):
+        return _query_one(self.temperatures, position, time)
+
+    def get_nearest_gradient(self, position, time=0.):
+        return _query_one(self.gradients, position, time)
+
+
+def _query_one(query, position, time):
+    position = np.asarray(position, dtype=float)
+    if position.ndim == 1:
+        return query(position[np.newaxis], time)[0]
+
+    return query(position, time)
 
 
 class NoPlume(Plume):
     def __init__(self, environment):
         super(self.__class__, self).__init__(environment)
 
-    def check_in_plume_bounds(self, _):
+    def in_plume_mask(self, positions, time=0.):
         # always return false
-        return False
+        return np.zeros(len(positions), dtype=bool)
+
+    def temperatures(self, positions, time=0.):
+        return np.full(len(positions), self.room_temperature)
 
-    def get_nearest_gradient(self, _):
+    def gradients(self, positions, time=0.):
         """if trying to use gradient ascent decision policy with No Plume, return no gradient"""
-        return np.array([0., 0., 0.])
+        return np.zeros((len(positions), 3))
 
 
 class BooleanPlume(Plume):
@@ -197,48 +280,72 @@ class BooleanPlume(Plume):
 
         self.resolution = self._calc_resolution()
 
-    def check_in_plume_bounds(self, position):
-        in_windtunnel_bounds, _ = self.walls.check_in_bounds(position)
-        x, y, z = position
+        self._plane_x, self._plane_y, self._plane_z, self._minor_axis, self._major_axis = self._calc_plane_arrays()
+        # planes are usually evenly spaced, in which case we can find the nearest one by direct indexing
+        self._planes_are_uniform = np.allclose(np.diff(self._plane_x), self.resolution)
 
-        x_distances_to_plume_planes = np.abs(self.data['x_position'] - x)
+    def in_plume_mask(self, positions, time=0.):
+        """
+        Test which positions are inside the plume
 
-        if x_distances_to_plume_planes.min() > self.resolution:
-            # if distance to nearest plume plane is greater than thresh, we are too far upwind or downwind from plume
-            # to be inside the plume
-            in_plume = False
-        elif in_windtunnel_bounds is False:
-            # print("WARNING: can't find plumes outside of windtunnel bounds")
-            in_plume = False
-        else:
-            plume_plane = self._get_nearest_plume_plane(x)
-            minor_axis = plume_plane.small_radius
-            minor_ax_major_ax_ratio = 3
-            major_axis = minor_axis * minor_ax_major_ax_ratio
-
-            # check if position is within the elipsoid
-            # implementation of http://math.stackexchange.com/a/76463/291217
-            value = (((y - plume_plane.y_position) ** 2) / minor_axis ** 2) + \
-                    (((z - plume_plane.z_position) ** 2) / major_axis ** 2)
-
-            if value <= 1:
-                in_plume = True
-            else:
-                in_plume = False
+        Parameters
+        ----------
+        positions
+            (N, 3) array
+        time
+            ignored, the plume bounds don't change
+
+        Returns
+        -------
+        (N,) boolean array
+        """
+        positions = np.atleast_2d(positions)
+        x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
+
+        plane = self._nearest_plane_index(x)
+
+        # if distance to nearest plume plane is greater than thresh, we are too far upwind or downwind from plume
+        # to be inside the plume. we also can't find plumes outside of windtunnel bounds
+        in_plume = (np.abs(self._plane_x[plane] - x) <= self.resolution) & self.walls.in_bounds_mask(positions)
 
-        return in_plume
+        # check if position is within the elipsoid
+        # implementation of http://math.stackexchange.com/a/76463/291217
+        value = (((y - self._plane_y[plane]) ** 2) / self._minor_axis[plane] ** 2) + \
+                (((z - self._plane_z[plane]) ** 2) / self._major_axis[plane] ** 2)
+
+        return in_plume & (value <= 1)
 
     def show(self):
         fig, ax = plot_windtunnel(self.environment.windtunnel)
         ax.axis('off')
         draw_bool_plume(self, ax=ax)
 
-    def _get_nearest_plume_plane(self, x_position):
-        """given x position, find nearest plan"""
-        closest_plume_index = (np.abs(self.data['x_position'] - x_position)).argmin()
-        plume_plane = self.data.loc[closest_plume_index]
+    def _calc_plane_arrays(self):
+        """plume planes as numpy arrays, sorted by x"""
+        data = self.data.sort_values('x_position')
+        minor_ax_major_ax_ratio = 3
+
+        minor_axis = data.small_radius.values.astype(float)
+        major_axis = minor_axis * minor_ax_major_ax_ratio
+
+        return data.x_position.values.astype(float), data.y_position.values.astype(float), \
+               data.z_position.values.astype(float), minor_axis, major_axis
+
+    def _nearest_plane_index(self, x):
+        """index into the plane arrays of the plane nearest to each x"""
+        n_planes = len(self._plane_x)
+        if n_planes == 1:
+            return np.zeros(len(x), dtype=int)
 
-        return plume_plane
+        if self._planes_are_uniform:
+            index = np.rint((x - self._plane_x[0]) / self.resolution).astype(int)
+            return np.clip(index, 0, n_planes - 1)
+
+        upper = np.clip(np.searchsorted(self._plane_x, x), 1, n_planes - 1)
+        lower = upper - 1
+        closer_to_lower = (x - self._plane_x[lower]) <= (self._plane_x[upper] - x)
+
+        return np.where(closer_to_lower, lower, upper)
 
     def _load_plume_data(self):
         col_names = ['x_position', 'z_position', 'small_radius']
@@ -267,9 +374,13 @@ class BooleanPlume(Plume):
 
         return resolution
 
-    def get_nearest_gradient(self, _):
+    def temperatures(self, positions, time=0.):
+        """the boolean plume has bounds but no temperatures, so these are all NaN"""
+        return np.full(len(positions), np.nan)
+
+    def gradients(self, positions, time=0.):
         """if trying to use gradient ascent decision policy with Boolean, return no gradient"""
-        return np.array([0., 0., 0.])
+        return np.zeros((len(positions), 3))
 
 
 class TimeAvgPlume(Plume):
@@ -280,29 +391,57 @@ class TimeAvgPlume(Plume):
 
         # number of x, y, z positions to interpolate the data. numbers chosen to reflect the spacing at which the
         # measurements were taken to avoid gradient values of 0 due to undersampling
-        # resolution = (100j, 25j, 25j)  # stored as complex numbers for mgrid to work properly
-        interpolation_resolution = .05  # 1 cm
+        self.resolution = tuple(environment.plume_resolution)
+
+        # rbf smoothing was determined by testing various numbers and looking at the minimum and maximum of the
+        # resulting plumes. if I put values too far from this, the minimum and maximum temperature start to become
+        # extremely unnaturalistic.
+        self.smoothing = 2e-5
+        self.epsilon = None
+        self.rbfi = None  # the fitted Rbf, if we had to fit it
+        self.cache_key = None
+
+        self.gradient_method = environment.plume_gradient
+        if self.gradient_method not in ('finite_difference', 'analytic', 'analytic_on_demand'):
+            raise ValueError("unknown plume gradient method {}".format(self.gradient_method))
 
         print "loading raw plume data"
-        self._raw_data = self._load_plume_data()
         data_list = self._load_plume_data()
 
         if len(data_list) == 3:
             print "loading precomputed padded and interpolated data"
             self._raw_data, self.padded_data, self.data = data_list
+            fields = self._precomputed_grid_fields()
         elif len(data_list) == 1:
             self._raw_data = data_list[0]
             # print "filling area surrounding measured area with room temperature data"
             # self.padded_data = self._pad_plume_data()
             print "adding sheet of room temp data on outer windtunnel walls"
             self.padded_data = self._room_temp_wall_sheet()
-            print "starting interpolation"
-            self.data, self.grid_x, self.grid_y, self.grid_z, self.grid_temp = self._interpolate_data(self.padded_data, interpolation_resolution)
-            print "calculating gradient"
-            self.gradient_x, self.gradient_y, self.gradient_z = self._calc_gradient()
 
-        print "calculating kd-tree"
-        self.tree = self._calc_kdtree()
+            # calculate average 3D euclidean distance b/w observations
+            self.epsilon = self.calc_euclidean_distance_neighbords(selection='padded')
+
+            # the analytic gradient grids differ from the finite difference ones, so they are cached separately
+            extra = ('analytic_gradient',) if self.gradient_method == 'analytic' else ()
+            self.cache_key = plume_cache.make_key(self._raw_data_path, self.smoothing, self.epsilon, self.resolution,
+                                                  extra=extra)
+            fields = plume_cache.load(self.cache_key)
+            if fields is None:
+                print "starting interpolation"
+                self.data, self.grid_x, self.grid_y, self.grid_z, self.grid_temp = self._interpolate_data(self.padded_data)
+                print "calculating gradient"
+                self.gradient_x, self.gradient_y, self.gradient_z = self._calc_gradient()
+                fields = self._grid_fields()
+                print "saving interpolated plume to {}".format(plume_cache.save(self.cache_key, fields))
+            else:
+                print "loading cached interpolated plume"
+                self._load_grid_fields(fields)
+
+        self.tree = None  # kd-tree of the interpolated data, built by get_nearest_prediction() if it's ever needed
+
+        self.sampling = environment.plume_sampling
+        self.sampler = self._calc_grid_sampler(fields)
 
         print """Timeaveraged plume stats:  TODO implement sanity checks
         raw data min temp: {}
@@ -315,19 +454,11 @@ class TimeAvgPlume(Plume):
         print """Warning: we don't know the plume bounds for the Timeavg plume, so the check_for_plume() method
                 always returns False"""
 
-    def check_in_plume_bounds(self, *_):
+    def in_plume_mask(self, positions, time=0.):
         """
-        we don't know the plume bounds for the Timeavg plume, so the check_in_plume_bounds() method
-                always returns False
-
-        Returns
-        -------
-        in_plume
-            always return False.
+        we don't know the plume bounds for the Timeavg plume, so this always returns False
         """
-
-        return False
-
+        return np.zeros(len(positions), dtype=bool)
 
     def get_nearest_prediction(self, position):
         """
@@ -342,13 +473,49 @@ class TimeAvgPlume(Plume):
         temperature
         """
 
+        if self.tree is None:
+            self.tree = self._calc_kdtree()
         _, index = self.tree.query(position)
         data = self.data.iloc[index]
         return data
 
-    def get_nearest_gradient(self, position):
-        data = self.get_nearest_prediction(position)
-        return np.array([data['gradient_x'], data['gradient_y'], data['gradient_z']])
+    def gradients(self, positions, time=0.):
+        """
+        Look up the gradient on the interpolated grid, or evaluate the RBF derivative at the positions if
+        gradient_method is 'analytic_on_demand'
+
+        Parameters
+        ----------
+        positions
+            (N, 3) array of positions
+        time
+            ignored, the plume is time-averaged
+
+        Returns
+        -------
+        (N, 3) array of [dx, dy, dz]
+        """
+        if self.gradient_method == 'analytic_on_demand':
+            return evaluate_rbf_gradient(self._get_rbf(), positions)
+
+        return self.sampler.sample(positions, ['gradient_x', 'gradient_y', 'gradient_z'], mode=self.sampling)
+
+    def temperatures(self, positions, time=0.):
+        """
+        Look up the temperature on the interpolated grid
+
+        Parameters
+        ----------
+        positions
+            (N, 3) array of positions
+        time
+            ignored, the plume is time-averaged
+
+        Returns
+        -------
+        (N,) array
+        """
+        return self.sampler.sample(positions, ['avg_temp'], mode=self.sampling)[:, 0]
 
     def show_scatter_data(self, selection = 'raw', temp_thresh=0):
         data = self._select_data(selection)
@@ -380,13 +547,10 @@ class TimeAvgPlume(Plume):
         data = self._select_data(selection)
         kdtree = self._calc_kdtree(selection)
 
-        coords = data[['x', 'y', 'z']]
+        coords = data[['x', 'y', 'z']].values
 
-        dist_neighbors = np.zeros(len(coords))
-        for i in range(len(coords)):
-            coord = coords.iloc[i]
-            dists, _ = kdtree.query(coord, k=2, p=2)  # euclidean dist, select 2 nearest neighbords
-            dist_neighbors[i] = dists[-1]  # select second entry
+        dists, _ = kdtree.query(coords, k=2, p=2)  # euclidean dist, select 2 nearest neighbords
+        dist_neighbors = dists[:, -1]  # select second entry
 
         return dist_neighbors.mean()
 
@@ -406,6 +570,7 @@ class TimeAvgPlume(Plume):
             return None
         elif self.condition in 'lLleftLeft':
             plume_dir = get_directory('THERMOCOUPLE_TIMEAVG_LEFT_CSV')
+            self._raw_data_path = plume_dir
             raw = pd.read_csv(plume_dir, names=col_names)
             raw = raw.dropna()
 
@@ -424,6 +589,7 @@ class TimeAvgPlume(Plume):
 
         elif self.condition in 'rightRight':
             plume_dir = get_directory('THERMOCOUPLE_TIMEAVG_RIGHT_CSV')
+            self._raw_data_path = plume_dir
             raw = pd.read_csv(plume_dir, names=col_names)
             raw = raw.dropna()
 
@@ -516,13 +682,12 @@ class TimeAvgPlume(Plume):
 
         return df
 
-    def _interpolate_data(self, data, resolution):
+    def _interpolate_data(self, data):
         """
-        Replace data with a higher resolution interpolation
+        Replace data with a higher resolution interpolation, at self.resolution
         Parameters
         ----------
         data
-        resolution
 
         Returns
         -------
@@ -533,25 +698,14 @@ class TimeAvgPlume(Plume):
         if self.condition in 'controlControlCONTROL':
             return None  # TODO: wtf
 
-        # useful aliases
-        x, y, z, temps = data.x.values, data.y.values, data.z.values, data.avg_temp.values
-
-        # calculate average 3D euclidean distance b/w observations
-        avg_distance = self.calc_euclidean_distance_neighbords(selection = 'padded')
-
-
         # init rbf interpolator
-        """smoothing was determined by testing various numbers and looking at the minimum and maximum of the resulting plumes
-        if I put values too far from this, the minimum and maximum temperature start to become extremely unnaturalistic.
-        """
-        smoothing = 2e-5
-        rbfi = Rbf(x, y, z, temps, function='quintic', smooth=smoothing, epsilon=avg_distance)
+        rbfi = self._fit_rbf(data)
 
         # make positions to interpolate at
-        # TODO: run this on a computer with lots of memory and save CSV so you don't run into memory errors (200, 60, 60)
-        xi = np.linspace(self.downwind, self.upwind, 50)  # todo: fix resolution
-        yi = np.linspace(self.left, self.right, 15)
-        zi = np.linspace(self.floor, self.ceiling, 15)
+        # TODO: prebuild the plume cache on a computer with lots of memory so you don't run into memory errors (200, 60, 60)
+        xi = np.linspace(self.downwind, self.upwind, self.resolution[0])
+        yi = np.linspace(self.left, self.right, self.resolution[1])
+        zi = np.linspace(self.floor, self.ceiling, self.resolution[2])
         # xi = np.linspace(self.downwind, self.upwind, 25)  # todo: fix resolution
         # yi = np.linspace(self.left, self.right, 7)
         # zi = np.linspace(self.floor, self.ceiling, 7)
@@ -561,10 +715,10 @@ class TimeAvgPlume(Plume):
         grid_y_flat = grid_y.ravel()
         grid_z_flat = grid_z.ravel()
 
-        # interpolate
-        interp_temps = rbfi(grid_x_flat, grid_y_flat, grid_z_flat)
+        # interpolate in bounded-memory blocks
         # we save this grid b/c it helps us with the gradient func
-        grid_temps = interp_temps.reshape((len(xi), len(yi), len(zi)))
+        grid_temps = evaluate_rbf_on_grid(rbfi, xi, yi, zi, processes=self.environment.plume_build_processes)
+        interp_temps = grid_temps.ravel()
 
         # save to df
         df_dict = dict()
@@ -576,6 +730,22 @@ class TimeAvgPlume(Plume):
 
         return interpolated_temps, grid_x, grid_y, grid_z, grid_temps
 
+    def _fit_rbf(self, data):
+        x, y, z, temps = data.x.values, data.y.values, data.z.values, data.avg_temp.values
+        self.rbfi = Rbf(x, y, z, temps, function='quintic', smooth=self.smoothing, epsilon=self.epsilon)
+
+        return self.rbfi
+
+    def _get_rbf(self):
+        """the Rbf fitted to the padded data, fitting it the first time it's needed (e.g. if the grids were cached)"""
+        if self.rbfi is None:
+            if self.epsilon is None:
+                self.epsilon = self.calc_euclidean_distance_neighbords(selection='padded')
+            print "fitting rbf for the analytic plume gradient"
+            self._fit_rbf(self.padded_data)
+
+        return self.rbfi
+
     def _calc_gradient(self):
         # impossible to do gradient with uneven samples: https://stackoverflow.com/questions/36781698/numpy-sample-distances-for-3d-gradient
         # so doing instead on regular grid
@@ -586,9 +756,16 @@ class TimeAvgPlume(Plume):
         # grid_x, grid_y, grid_z = np.meshgrid(xi, yi, zi, indexing='ij')
         #grid_temps = interp_temps.reshape((len(xi), len(yi), len(zi)))
 
-        # Solve for the spatial
-        distances = [np.diff(self.data.x.unique())[0], np.diff(self.data.y.unique())[0], np.diff(self.data.z.unique())[0]]
-        gradient_x, gradient_y, gradient_z = np.gradient(self.grid_temp, *distances)
+        if self.gradient_method == 'analytic':
+            gradients = evaluate_rbf_gradient_on_grid(self._get_rbf(), self.grid_x[:, 0, 0], self.grid_y[0, :, 0],
+                                                      self.grid_z[0, 0, :],
+                                                      processes=self.environment.plume_build_processes)
+            gradient_x, gradient_y, gradient_z = gradients[..., 0], gradients[..., 1], gradients[..., 2]
+        else:
+            # Solve for the spatial
+            distances = [np.diff(self.data.x.unique())[0], np.diff(self.data.y.unique())[0],
+                         np.diff(self.data.z.unique())[0]]
+            gradient_x, gradient_y, gradient_z = np.gradient(self.grid_temp, *distances)
 
         self.data['gradient_x'] = gradient_x.ravel()
         self.data['gradient_y'] = gradient_y.ravel()
@@ -601,6 +778,81 @@ class TimeAvgPlume(Plume):
 
         return gradient_x, gradient_y, gradient_z
 
+    def _grid_fields(self):
+        """the interpolated grids, in the form the plume cache stores them"""
+        shape = self.grid_temp.shape
+        return {'xi': self.grid_x[:, 0, 0],
+                'yi': self.grid_y[0, :, 0],
+                'zi': self.grid_z[0, 0, :],
+                'avg_temp': self.grid_temp,
+                'gradient_x': self.data.gradient_x.values.reshape(shape),  # with NaNs, infs replaced
+                'gradient_y': self.data.gradient_y.values.reshape(shape),
+                'gradient_z': self.data.gradient_z.values.reshape(shape)}
+
+    def _load_grid_fields(self, fields):
+        """inverse of _grid_fields(): rebuild the grids and the interpolated data frame from cached fields"""
+        self.grid_x, self.grid_y, self.grid_z = np.meshgrid(fields['xi'], fields['yi'], fields['zi'], indexing='ij')
+        self.grid_temp = fields['avg_temp']
+        self.gradient_x, self.gradient_y, self.gradient_z = fields['gradient_x'], fields['gradient_y'], fields['gradient_z']
+
+        df_dict = dict()
+        df_dict['x'] = self.grid_x.ravel()
+        df_dict['y'] = self.grid_y.ravel()
+        df_dict['z'] = self.grid_z.ravel()
+        df_dict['avg_temp'] = self.grid_temp.ravel()
+        df_dict['gradient_x'] = self.gradient_x.ravel()
+        df_dict['gradient_y'] = self.gradient_y.ravel()
+        df_dict['gradient_z'] = self.gradient_z.ravel()
+        self.data = pd.DataFrame(df_dict)
+        self.data['gradient_norm'] = np.linalg.norm(self.data[['gradient_x', 'gradient_y', 'gradient_z']], axis=1)
+
+    def _precomputed_grid_fields(self):
+        """
+        Put the precomputed interpolated csv data back onto its regular grid, see _grid_fields().
+
+        The csv fixes the grid, so a plume_resolution other than the default or the csv's own raises. With
+        gradient_method 'analytic', the gradient grids of the csv (finite differences) are replaced by the derivative
+        of the RBF on the same grid.
+        """
+        xi, yi, zi = np.unique(self.data.x.values), np.unique(self.data.y.values), np.unique(self.data.z.values)
+        shape = (len(xi), len(yi), len(zi))
+        if np.prod(shape) != len(self.data):
+            raise ValueError("interpolated plume data is not on a regular grid")
+        if self.resolution not in (shape, DEFAULT_PLUME_RESOLUTION):
+            raise ValueError("the precomputed interpolated plume is on a {} grid. plume_resolution {} needs the raw data "
+                             "path, without the precomputed padded and interpolated csvs".format(shape, self.resolution))
+        self.resolution = shape
+
+        # sort by x, then y, then z: the order of meshgrid(indexing='ij').ravel()
+        order = np.lexsort((self.data.z.values, self.data.y.values, self.data.x.values))
+        fields = {name: self.data[name].values[order].reshape(shape)
+                  for name in ['avg_temp', 'gradient_x', 'gradient_y', 'gradient_z']}
+        fields['xi'], fields['yi'], fields['zi'] = xi, yi, zi
+
+        if self.gradient_method == 'analytic':
+            print "calculating analytic gradient on the precomputed grid"
+            gradients = evaluate_rbf_gradient_on_grid(self._get_rbf(), xi, yi, zi,
+                                                      processes=self.environment.plume_build_processes)
+            fields['gradient_x'], fields['gradient_y'], fields['gradient_z'] = \
+                gradients[..., 0], gradients[..., 1], gradients[..., 2]
+            self._load_grid_fields(fields)
+
+        return fields
+
+    def _calc_grid_sampler(self, fields):
+        """
+        Parameters
+        ----------
+        fields
+            the interpolated grids, see _grid_fields()
+        """
+        if self.condition in 'controlControlCONTROL':
+            return None
+
+        field_names = ['avg_temp', 'gradient_x', 'gradient_y', 'gradient_z']
+        return RegularGridSampler((fields['xi'], fields['yi'], fields['zi']),
+                                  {name: fields[name] for name in field_names})
+
     def _calc_kdtree(self, selection = 'interpolated'):
         if self.condition in 'controlControlCONTROL':
             return None
@@ -623,7 +875,105 @@ class TimeAvgPlume(Plume):
         return data
 
 
-class UnaveragedPlume:
+class UnaveragedPlume(Plume):
+    """
+    The raw, time-resolved thermocouple recordings, as a plume that changes over time.
+
+    The recordings are memory-mapped from a binary cache (see io.raw_plume_cache), so only the frames the simulation
+    visits are ever read. The temperature at a time is interpolated linearly between the two nearest frames, and the
+    recording is looped if the simulation outlasts it. Interpolated frames are kept in a bounded least-recently-used
+    cache, since an ensemble queries the same times over and over.
+
+    Between the thermocouples, temperatures are inverse-distance weighted over the nearest n_neighbors thermocouples,
+    and gradients are central differences of that field.
+    """
     def __init__(self, environment):
         super(self.__class__, self).__init__(environment)
-        raise NotImplementedError  # TODO: implement unaveraged plume
\ No newline at end of file
+
+        if self.condition in 'controlControlCONTROL':
+            raise ValueError("there is no plume recording for the control condition")
+
+        self.threshold = 1.  # degrees above room temperature counted as in the plume
+        self.n_neighbors = 8
+        self.gradient_step = 0.01  # (m) of the central differences
+        self.frame_cache_size = 256  # number of interpolated frames to keep
+
+        print "loading raw plume recordings"
+        self.positions, self.frames, self.sampling_rate = raw_plume_cache.load_condition(self.condition)
+        self.n_samples = len(self.frames)
+        self.tree = kdt(self.positions)
+
+        self._frame_cache = OrderedDict()
+
+    def in_plume_mask(self, positions, time=0.):
+        """True where the temperature is more than threshold above room temperature, see Plume.in_plume_mask()"""
+        return self.temperatures(positions, time) > self.room_temperature + self.threshold
+
+    def temperatures(self, positions, time=0.):
+        """
+        Parameters
+        ----------
+        positions
+            (N, 3) array of positions
+        time
+            simulation time (s)
+
+        Returns
+        -------
+        (N,) array
+        """
+        return self._interpolate(np.asarray(positions, dtype=float), self.get_frame(time))
+
+    def gradients(self, positions, time=0.):
+        """
+        Parameters
+        ----------
+        positions
+            (N, 3) array of positions
+        time
+            simulation time (s)
+
+        Returns
+        -------
+        (N, 3) array of [dx, dy, dz]
+        """
+        positions = np.asarray(positions, dtype=float)
+
+        # the 6 neighbors of every position in one query: (N, 3 axes, 2 sides, 3)
+        steps = self.gradient_step * np.eye(3)
+        probes = positions[:, np.newaxis, np.newaxis, :] + np.stack([steps, -steps], axis=1)[np.newaxis]
+        temperatures = self._interpolate(probes.reshape(-1, 3), self.get_frame(time)).reshape(-1, 3, 2)
+
+        return (temperatures[..., 0] - temperatures[..., 1]) / (2 * self.gradient_step)
+
+    def get_frame(self, time):
+        """temperatures of every thermocouple at a time, interpolated between the recorded frames"""
+        if time in self._frame_cache:
+            frame = self._frame_cache.pop(time)
+        else:
+            sample = (time * self.sampling_rate) % self.n_samples  # loop the recording
+            before = int(sample)
+            after = (before + 1) % self.n_samples
+            weight = sample - before
+            frame = (1 - weight) * self.frames[before].astype(float) + weight * self.frames[after].astype(float)
+
+        self._frame_cache[time] = frame  # (re)insert as most recently used
+        while len(self._frame_cache) > self.frame_cache_size:
+            self._frame_cache.popitem(last=False)
+
+        return frame
+
+    def _interpolate(self, positions, frame):
+        """inverse distance weighting of a frame at (N, 3) positions"""
+        # with fewer thermocouples than n_neighbors, the kd-tree would pad the result with out of range indices
+        distances, neighbors = self.tree.query(positions, k=min(self.n_neighbors, len(self.positions)))
+        distances = distances.reshape(len(positions), -1)
+        neighbors = neighbors.reshape(len(positions), -1)
+
+        with np.errstate(divide='ignore'):
+            weights = 1. / distances ** 2
+        on_thermocouple = np.isinf(weights)
+        exact = on_thermocouple.any(axis=1)
+        weights[exact] = on_thermocouple[exact]  # all the weight on the thermocouple we are sitting on
+
+        return np.sum(weights * frame[neighbors], axis=1) / np.sum(weights, axis=1)
\ No newline at end of file
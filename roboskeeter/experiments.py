@@ -2,13 +2,14 @@ __author__ = 'richard'
 """
 """
 
+from roboskeeter.decisions import DECISIONS, PLUME_SIGNALS
 from roboskeeter.math.kinematic_math import DoMath
 from roboskeeter.math.scoring.scoring import Scoring
 from roboskeeter.simulator import Simulator
 from roboskeeter.environment import Environment
 from roboskeeter.observations import Observations
 from roboskeeter.plotting.plot_funcs_wrapper import PlotFuncsWrapper
-import numpy as np
+import pandas as pd
 
 
 class Experiment(object):
@@ -35,7 +36,7 @@ class Experiment(object):
         self.side_ratio_score = None
         self.score, self.score_components = None, None
 
-    def run(self, n=None):  # None as default in case we're loading experiments instead of simulating
+    def run(self, n=None, vectorized=False, workers=None, seed=None):  # None as default in case we're loading experiments instead of simulating
         """
         Func that either loads experimental data or runs a simulation, depending on whether self.is_simulation is True
         Parameters
@@ -43,6 +44,15 @@ class Experiment(object):
         n
             (int, optional)
             Number of flights to simulate. If we are just loading files, it will load the entire ensemble.
+        vectorized
+            (bool, optional)
+            Simulate all flights at once with the vectorized ensemble integrator. Ignored when loading files.
+        workers
+            (int, optional)
+            Number of processes to spread the simulation across. Ignored when loading files.
+        seed
+            (int, optional)
+            Seed for the simulation, for reproducible flights. Ignored when loading files.
 
         Returns
         -------
@@ -52,25 +62,23 @@ class Experiment(object):
             if type(n) != int:
                 raise TypeError("Number of flights must be integer.")
             else:
-                self.observations = self.agent.fly(n_trajectories=n)
+                self.observations = self.agent.fly(n_trajectories=n, vectorized=vectorized, workers=workers,
+                                                   seed=seed)
         else:
             self.observations.experiment_data_to_DF(experimental_condition=self.experiment_conditions['condition'])
             if self.experiment_conditions['optimizing'] is False:  # skip unneccessary computations for optimizer
-                print """\nDone loading files. Iterating through flights and presenting plume, making hypothetical
+                print """\nDone loading files. Presenting plume to all flights, making hypothetical
                  decisions using selected decision policy ({})""".format(self.agent.decision_policy)
-                n_rows = len(self.observations.kinematics)
-                in_plume = np.zeros(n_rows, dtype=bool)
-                plume_signal = np.array([None] * n_rows)
-                decision = np.array([None] * n_rows)
-                for i, row in self.observations.kinematics.iterrows():
-                    in_plume[i] = self.environment.plume.check_in_plume_bounds([row.position_x,
-                                                                                row.position_y,
-                                                                                row.position_z])
-                    decision[i], plume_signal[i] = self.agent.decisions.make_decision(in_plume[i], row.velocity_y)
-
-                self.observations.kinematics['in_plume'] = in_plume
-                self.observations.kinematics['plume_signal'] = plume_signal
-                self.observations.kinematics['decision'] = decision
+                kinematics = self.observations.kinematics
+                positions = kinematics[['position_x', 'position_y', 'position_z']].values
+                in_plume = self.environment.plume.in_plume_mask(positions)
+                decision, plume_signal = self.agent.decisions.scan(in_plume,
+                                                                   kinematics['velocity_y'].values,
+                                                                   kinematics['trajectory_num'].values)
+
+                kinematics['in_plume'] = in_plume
+                kinematics['plume_signal'] = pd.Categorical.from_codes(plume_signal, categories=PLUME_SIGNALS)
+                kinematics['decision'] = pd.Categorical.from_codes(decision, categories=DECISIONS)
 
         # assign alias
         self.plt = PlotFuncsWrapper(self)  # takes self, extracts metadata for files and titles, etc
@@ -100,7 +108,8 @@ class Experiment(object):
 
 
 
-def start_simulation(num_flights, agent_kwargs=None, simulation_conditions=None):
+def start_simulation(num_flights, agent_kwargs=None, simulation_conditions=None, vectorized=False, workers=None,
+                     seed=None):
     """
     Fire up RoboSkeeter
     Parameters
@@ -111,6 +120,12 @@ def start_simulation(num_flights, agent_kwargs=None, simulation_conditions=None)
         (dict) params for agent
     simulation_conditions
         (dict) params for environment
+    vectorized
+        (bool) simulate all flights at once with the vectorized ensemble integrator
+    workers
+        (int) number of processes to spread the flights across. None runs everything in this process
+    seed
+        (int) seed for reproducible flights. None leaves the random number generators alone
 
     Returns
     -------
@@ -138,19 +153,22 @@ def start_simulation(num_flights, agent_kwargs=None, simulation_conditions=None)
                         }
 
     experiment = Experiment(agent_kwargs, simulation_conditions)
-    experiment.run(n=num_flights)
+    experiment.run(n=num_flights, vectorized=vectorized, workers=workers, seed=seed)
     if agent_kwargs['verbose'] is True:
         print "\nDone running simulation."
 
     return experiment
 
 
-def load_experiment(condition='Control'):
+def load_experiment(condition='Control', optimizing=False):
     """
     Load Sharri's experiments into experiment class
     Parameters
     ----------
-    experiment_conditions
+    condition
+        (string) Control, Left, or Right, or list thereof
+    optimizing
+        (bool) skip presenting the plume and making hypothetical decisions, e.g. when all we need is reference data
 
     Returns
     -------
@@ -160,7 +178,7 @@ def load_experiment(condition='Control'):
                              'plume_model': "None", #"Boolean",  # "Boolean" "None, "Timeavg", "Unaveraged"
                              'time_max': "N/A (experiment)",
                              'bounded': True,
-                             'optimizing': False
+                             'optimizing': optimizing
                              }
 
     agent_kwargs = {'is_simulation': False,  # ALL THESE VALUES ARE A HYPOTHESIS!!!
@@ -1,5 +1,6 @@
 __author__ = 'richard'
 import numpy as np
+from roboskeeter.decisions import DECISIONS, DECISION_CODES
 from roboskeeter.math import math_toolbox
 
 
@@ -9,40 +10,80 @@ class Flight():
         self.stim_f_strength = stim_f_strength  # TODO: separate surge strength, cast strength, gradient strenght
         self.damping_coeff = damping_coeff
         self.max_stim_f = 1e-5  # putting a maximum value on the stim_f
+        self.unit_vectors = math_toolbox.UnitVectorSampler(3)  # random force directions, drawn in bulk
+        self.stimulus_table = self._build_stimulus_table()
 
-    def random(self):
+    def random(self, n_agents=None, sampler=None, directions=None):
         """Generate random-direction force vector at each timestep from double-
         exponential distribution given exponent term rf.
+
+        If n_agents is given, returns an (n_agents, 3) array with one force per agent.
+        sampler is the math_toolbox.UnitVectorSampler to draw directions from, self.unit_vectors by default.
+        If directions (unit vectors drawn beforehand) are given, they are used instead of drawing new ones.
         """
         # TODO: make randomF draw from the canonical eqn for random draws Rich taught you
-        ends = math_toolbox.gen_symm_vecs(3)
-        force = self.random_f_strength * ends
+        if directions is None:
+            if sampler is None:
+                sampler = self.unit_vectors
+            directions = sampler.draw(n_agents)
+        force = self.random_f_strength * directions
 
         return force
 
+    def _build_stimulus_table(self):
+        """
+        The stimulus force of every decision is constant, except for following the gradient, so they are computed once.
+
+        Returns
+        -------
+        read-only (len(DECISIONS), 3) array, the force of each decision code. the 'ga' row is 0, its force depends on
+        the gradient
+        """
+        table = np.zeros((len(DECISIONS), 3))
+        table[DECISION_CODES['surge']] = self.surge_upwind()
+        table[DECISION_CODES['cast_l']] = self.cast('cast_l')
+        table[DECISION_CODES['cast_r']] = self.cast('cast_r')
+        table.flags.writeable = False
+
+        return table
+
     def stimulus(self, decision, plume_signal):
-        force = np.array([0., 0., 0.])
-
-        if decision is 'search':
-            pass  # there is no stimulus_f in the absence of stimulus
-        elif decision is 'ga':
-            force += self.surge_up_gradient(plume_signal)
-        elif decision is 'surge':
-            force += self.surge_upwind()
-        elif 'cast' in decision:
-            force += self.cast(decision)
-        elif decision == 'ignore':
-            pass
-        else:
+        if decision == 'ga':
+            return self.surge_up_gradient(plume_signal)
+
+        try:
+            return self.stimulus_table[DECISION_CODES[decision]]
+        except KeyError:
             raise LookupError('unknown decision {}'.format(decision))
 
-        return force
+    def stimulus_codes(self, decisions, gradients=None):
+        """
+        Batched stimulus()
+
+        Parameters
+        ----------
+        decisions
+            (n,) array of codes into decisions.DECISIONS
+        gradients
+            (n, 3) plume gradients at the agents, only needed if any of them follows the gradient ('ga')
+
+        Returns
+        -------
+        (n, 3) array of stimulus forces
+        """
+        forces = self.stimulus_table[decisions]
+        if gradients is not None:
+            following = decisions == DECISION_CODES['ga']
+            if following.any():
+                forces[following] = self.surge_up_gradient(gradients[following])
+
+        return forces
 
-    def calc_forces(self, current_velocity, decision, plume_signal):
+    def calc_forces(self, current_velocity, decision, plume_signal, sampler=None):
         ################################################
         # Calculate driving forces at this timestep
         ################################################
-        random_f = self.random()
+        random_f = self.random(sampler=sampler)
 
         stim_f = self.stimulus(decision, plume_signal)
 
@@ -89,12 +130,12 @@ class Flight():
         Parameters
         ----------
         gradient
-            the current plume gradient
+            the current plume gradient, or (n, 3) gradients of n agents
 
         Returns
         -------
         force
-            the stimulus force to ascend the gradient, properly scaled
+            the stimulus force to ascend the gradient, properly scaled, of the same shape
         """
 
         scalar = self.stim_f_strength
@@ -103,17 +144,20 @@ class Flight():
         force = self._shrink_huge_stim_f(force)
 
         # catch bugs in gradient multiplication
-        if np.isnan(force).any():
-            raise ValueError("Nans in gradient force!! force = {} gradient = {}".format(force, gradient))
-        if np.isinf(force).any():
+        if not np.isfinite(force).all():
+            if np.isnan(force).any():
+                raise ValueError("Nans in gradient force!! force = {} gradient = {}".format(force, gradient))
             raise ValueError("infs in gradient force! force = {} gradient = {}".format(force, gradient))
 
         return force
 
     def _shrink_huge_stim_f(self, force):
-        norm = np.linalg.norm(force)
-        if norm > self.max_stim_f:
-            force *= self.max_stim_f / norm  # shrink force to maximum allowed value
+        """shrink forces (a [x, y, z] force or (n, 3) array of them) whose norm is above max_stim_f to max_stim_f"""
+        norm = np.sqrt(np.sum(force * force, axis=-1))
+        too_huge = norm > self.max_stim_f
+        if np.any(too_huge):
+            scale = np.where(too_huge, self.max_stim_f / np.where(too_huge, norm, 1.), 1.)
+            force = force * scale[..., np.newaxis]
 
         return force
 
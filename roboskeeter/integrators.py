@@ -0,0 +1,99 @@
+"""
+Time integration of the agent's equation of motion
+
+    m dv/dt = -damping_coeff * v + F
+
+where F = random_f + stim_f is drawn once per timestep and held for the whole step. Every integrator advances the
+position and velocity of one agent, or an (N, 3) ensemble, by one step of dt given the acceleration at the start of the
+step, total_f / m.
+
+    euler       semi-implicit Euler, the original scheme: v' = v + a dt, x' = x + v' dt. unstable once
+                damping_coeff / m * dt > 2, so velocities are capped at VELOCITY_CEILING
+    exact       the exact solution for the held force (the Ornstein-Uhlenbeck update for damping plus noise). stable
+                for any damping and dt, so no ceiling is needed
+    heun        stochastic Heun (second order Runge-Kutta) with the force held over the step. capped like euler
+"""
+__author__ = 'richard'
+
+import numpy as np
+
+# cap on every velocity component (m/s) for the conditionally stable integrators. without it, unstable parameters
+# explored by the optimizer send velocities to infinity and crash the run
+VELOCITY_CEILING = 20.
+
+
+class EulerIntegrator(object):
+    def __init__(self, mass, damping_coeff, dt):
+        self.mass = mass
+        self.damping_coeff = damping_coeff
+        self.dt = dt
+
+    def step(self, position, velocity, acceleration):
+        """
+        Parameters
+        ----------
+        position, velocity, acceleration
+            at the start of the step, [x, y, z] of one agent or (N, 3) arrays
+
+        Returns
+        -------
+        candidate position and velocity at the end of the step, before wall collisions
+        """
+        candidate_velo = np.clip(velocity + acceleration * self.dt, -VELOCITY_CEILING, VELOCITY_CEILING)
+        candidate_pos = position + candidate_velo * self.dt
+
+        return candidate_pos, candidate_velo
+
+
+class ExactIntegrator(EulerIntegrator):
+    def __init__(self, mass, damping_coeff, dt):
+        """
+        With decay rate k = damping_coeff / m and z = k dt, holding F over the step gives
+
+            v' = v + a dt phi1(z)
+            x' = x + v dt + a dt^2 phi2(z)
+
+        phi1(z) = (1 - exp(-z)) / z and phi2(z) = (z - 1 + exp(-z)) / z^2 are computed once, with expm1 so that they
+        stay accurate (and go to 1 and 1/2) as the damping goes to zero.
+        """
+        super(ExactIntegrator, self).__init__(mass, damping_coeff, dt)
+
+        z = damping_coeff / mass * dt
+        if abs(z) < 1e-6:  # series expansion, expm1 can't save the cancellation in phi2 this close to 0
+            phi1, phi2 = 1. - z / 2., 0.5 - z / 6.
+        else:
+            phi1 = -np.expm1(-z) / z
+            phi2 = (z + np.expm1(-z)) / z ** 2
+        self.velocity_gain = dt * phi1
+        self.position_gain = dt ** 2 * phi2
+
+    def step(self, position, velocity, acceleration):
+        candidate_velo = velocity + acceleration * self.velocity_gain
+        candidate_pos = position + velocity * self.dt + acceleration * self.position_gain
+
+        return candidate_pos, candidate_velo
+
+
+class HeunIntegrator(EulerIntegrator):
+    def step(self, position, velocity, acceleration):
+        # the force is held, so the acceleration only changes through the damping
+        predicted_velo = velocity + acceleration * self.dt
+        predicted_acceleration = acceleration - self.damping_coeff / self.mass * (predicted_velo - velocity)
+
+        candidate_velo = velocity + (acceleration + predicted_acceleration) * (self.dt / 2.)
+        candidate_velo = np.clip(candidate_velo, -VELOCITY_CEILING, VELOCITY_CEILING)
+        candidate_pos = position + (velocity + candidate_velo) * (self.dt / 2.)
+
+        return candidate_pos, candidate_velo
+
+
+INTEGRATORS = {'euler': EulerIntegrator,
+               'exact': ExactIntegrator,
+               'heun': HeunIntegrator}
+
+
+def make_integrator(name, mass, damping_coeff, dt):
+    try:
+        return INTEGRATORS[name](mass, damping_coeff, dt)
+    except KeyError:
+        raise ValueError("unknown integrator {}, choose from {}".format(name, sorted(INTEGRATORS)))
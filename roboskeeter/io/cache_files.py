@@ -0,0 +1,75 @@
+"""
+File handling shared by the on-disk caches (trajectory_cache, raw_plume_cache and plume_cache).
+
+Cache files are written under a temporary name next to their target and renamed into place, so a crash never leaves a
+half-written file behind. Caches made of several files carry a .json manifest, written last since it's what marks the
+cache as valid: a cache is only loaded if its manifest and all of its data files exist and the manifest has the
+current version.
+"""
+__author__ = 'richard'
+
+import json
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path next to path, which is renamed to path once the with block completes. The extension is
+    kept, since numpy appends .npy/.npz to paths without one.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    root, extension = os.path.splitext(path)
+    tmp_path = root + '.tmp' + extension
+    try:
+        yield tmp_path
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+
+def save_manifest(path, manifest):
+    """write the manifest of a cache, after all of its data files"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+
+
+def load_manifest(path, version, data_paths, **expected):
+    """
+    Parameters
+    ----------
+    path
+        of the .json manifest
+    version
+        current version of the cache
+    data_paths
+        files the cache is made of
+    expected
+        any other manifest entries that must match, e.g. the columns
+
+    Returns
+    -------
+    the manifest dict, or None if the cache is missing, incomplete or out of date
+    """
+    if not all(os.path.isfile(p) for p in [path] + list(data_paths)):
+        return None
+
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != version or any(manifest.get(key) != value for key, value in expected.iteritems()):
+        return None
+
+    return manifest
+
+
+def describe_file(path):
+    """[size, mtime] of a source file, recorded in manifests to tell when it changed"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
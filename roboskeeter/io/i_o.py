@@ -14,6 +14,22 @@ import pandas as pd
 
 import setup  # hack to get root dir
 
+EXPERIMENT_COLUMNS = [  # TODO: check that Sharri's kinematics are the same as your kinematics
+    'position_x',
+    'position_y',
+    'position_z',
+    'velocity_x',
+    'velocity_y',
+    'velocity_z',
+    'acceleration_x',
+    'acceleration_y',
+    'acceleration_z',
+    'heading_angleS',
+    'angular_velo_xyS',
+    'angular_velo_yzS',
+    'curvatureS'
+    ]
+
 
 def load_single_csv_to_df(csv_dir):
     """
@@ -28,25 +44,9 @@ def load_single_csv_to_df(csv_dir):
     pandas df
     """
 
-    col_labels = [  # TODO: check that Sharri's kinematics are the same as your kinematics
-        'position_x',
-        'position_y',
-        'position_z',
-        'velocity_x',
-        'velocity_y',
-        'velocity_z',
-        'acceleration_x',
-        'acceleration_y',
-        'acceleration_z',
-        'heading_angleS',
-        'angular_velo_xyS',
-        'angular_velo_yzS',
-        'curvatureS'
-        ]
-
     # map string "NaN" to np.nan
     # header=None is needed to make sure dtype float is assigned properly, apparently
-    dataframe = pd.read_csv(csv_dir, na_values="NaN", names=col_labels, header=None, dtype=np.float32)
+    dataframe = pd.read_csv(csv_dir, na_values="NaN", names=EXPERIMENT_COLUMNS, header=None, dtype=np.float32)
 
     dataframe.fillna(value=0, inplace=True)  # TODO: there shouldn't be NaNs in data
 
@@ -76,26 +76,37 @@ def experiment_condition_to_DF(experimental_condition):
     -------
     df
     """
+    from roboskeeter.io import trajectory_cache  # imported here to avoid a circular import
+
     if type(experimental_condition) is str:
         experimental_condition = [experimental_condition]
     experimental_condition = [string.upper(i) for i in experimental_condition]
-    df_list = []
-    for condition in experimental_condition:
-        dir_label = "EXP_TRAJECTORIES_" + condition
-        directory = get_directory(dir_label)
-
-        for fname in [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]:  # list files
-            print "Loading {} from {}".format(fname, directory)
-            file_path = os.path.join(directory, fname)
-            dataframe = load_single_csv_to_df(file_path)
-
-            df_list.append(dataframe)
+    df_list = [trajectory_cache.load_condition_dataframe(condition) for condition in experimental_condition]
+    if len(df_list) == 1:
+        return df_list[0]  # concat would copy the memory-mapped columns into memory
 
     df = pd.concat(df_list)
 
     return df
 
 
+def load_condition_csvs(directory):
+    """
+    Parse every trajectory csv in a directory.
+
+    Returns
+    -------
+    list of (fname, dataframe), sorted by fname
+    """
+    fnames = sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)))
+    dataframes = []
+    for fname in fnames:
+        print "Loading {} from {}".format(fname, directory)
+        dataframes.append((fname, load_single_csv_to_df(os.path.join(directory, fname))))
+
+    return dataframes
+
+
 def get_csv_name_list(path, relative=True):
     if relative:
         return os.listdir(os.path.join(os.path.realpath('.'), path))
@@ -147,6 +158,9 @@ def get_directory(selection=None):
     TIMEAVG = os.path.join(PLUME_PATH, 'timeavg')
     VAR = os.path.join(PLUME_PATH, 'variance')
     BOOL = os.path.join(PLUME_PATH, 'boolean')
+    PLUME_CACHE = os.path.join(TIMEAVG, 'cache')
+    EXP_TRAJECTORIES_CACHE = os.path.join(EXPERIMENTAL_TRAJECTORIES, 'cache')
+    RAW_PLUME_CACHE = os.path.join(RAW, 'cache')
     VAR_LEFT_CSV = os.path.join(VAR, 'left', 'LeftplumeVar_nonan.csv')
     VAR_RIGHT_CSV = os.path.join(VAR, 'right', 'RightplumeVar_nonan.csv')
     THERMOCOUPLE_RAW_LEFT_CSV = os.path.join(RAW, 'left', 'raw_left.csv')
@@ -171,6 +185,7 @@ def get_directory(selection=None):
         'EXP_TRAJECTORIES_CONTROL': EXP_TRAJECTORIES_CONTROL,
         'EXP_TRAJECTORIES_LEFT': EXP_TRAJECTORIES_LEFT,
         'EXP_TRAJECTORIES_RIGHT': EXP_TRAJECTORIES_RIGHT,
+        'EXP_TRAJECTORIES_CACHE': EXP_TRAJECTORIES_CACHE,
         'THERMOCOUPLE_RAW_LEFT': THERMOCOUPLE_RAW_LEFT_CSV,
         'THERMOCOUPLE_TIMEAVG_LEFT_PADDED_CSV': THERMOCOUPLE_TIMEAVG_LEFT_PADDED_CSV,
         'THERMOCOUPLE_TIMEAVG_LEFT_INTERPOLATED_CSV': THERMOCOUPLE_TIMEAVG_LEFT_INTERPOLATED_CSV,
@@ -182,7 +197,9 @@ def get_directory(selection=None):
         'BOOL_LEFT_CSV': BOOL_LEFT_CSV,
         'BOOL_RIGHT_CSV': BOOL_RIGHT_CSV,
         'VAR_LEFT_CSV': VAR_LEFT_CSV,
-        'VAR_RIGHT_CSV': VAR_RIGHT_CSV
+        'VAR_RIGHT_CSV': VAR_RIGHT_CSV,
+        'PLUME_CACHE': PLUME_CACHE,
+        'RAW_PLUME_CACHE': RAW_PLUME_CACHE
     }
 
     if selection is None:
@@ -0,0 +1,126 @@
+"""
+Content-addressed on-disk cache for the interpolated TimeAvg plume fields.
+
+Fitting the RBF over the padded thermocouple data and evaluating it on the grid takes minutes, so the resulting
+temperature grid and the three gradient grids are saved to an .npz file whose name is a hash of everything that went
+into them: the raw CSV bytes, the RBF smoothing and epsilon, the grid resolution, and whether the gradients are finite
+differences or the analytic derivative of the RBF. Change any of those and you get
+a different file, so the cache never needs to be invalidated by hand.
+
+Run this module to prebuild the cache, e.g. at high resolution on a machine with lots of memory:
+
+    python -m roboskeeter.io.plume_cache --condition Left Right --resolution 200 60 60 --processes 8 --gradient analytic
+"""
+__author__ = 'richard'
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from roboskeeter.io.cache_files import atomic_path
+from roboskeeter.io.i_o import get_directory
+
+FIELD_NAMES = ['xi', 'yi', 'zi', 'avg_temp', 'gradient_x', 'gradient_y', 'gradient_z']
+
+
+def make_key(raw_csv_path, smoothing, epsilon, resolution, extra=()):
+    """
+    Parameters
+    ----------
+    raw_csv_path
+        path of the raw thermocouple csv the fields are interpolated from
+    smoothing, epsilon
+        RBF parameters
+    resolution
+        (nx, ny, nz) grid resolution
+    extra
+        any other settings the fields depend on
+
+    Returns
+    -------
+    hex digest identifying the fields
+    """
+    digest = hashlib.sha1()
+    with open(raw_csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    settings = [repr(float(smoothing)), repr(float(epsilon))] + [str(int(n)) for n in resolution] + \
+               [str(setting) for setting in extra]
+    digest.update(';'.join(settings).encode('ascii'))
+
+    return digest.hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(get_directory('PLUME_CACHE'), 'timeavg_{}.npz'.format(key))
+
+
+def load(key):
+    """
+    Returns
+    -------
+    dict of the cached arrays (see FIELD_NAMES), or None if nothing is cached under this key
+    """
+    path = cache_path(key)
+    if not os.path.isfile(path):
+        return None
+
+    with np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def save(key, fields):
+    """
+    Parameters
+    ----------
+    key
+        from make_key()
+    fields
+        dict with the 1D grid axes xi, yi, zi and the 3D avg_temp and gradient grids
+    """
+    path = cache_path(key)
+    with atomic_path(path) as tmp_path:
+        np.savez(tmp_path, **{name: fields[name] for name in FIELD_NAMES})
+
+    return path
+
+
+def prebuild(condition, resolution, processes=None, gradient='finite_difference'):
+    """interpolate the TimeAvg plume for a condition at a given resolution, filling the cache on the way"""
+    from roboskeeter.environment import Environment  # imported here to avoid a circular import
+
+    class _Conditions(object):
+        """Environment only needs the experiment conditions"""
+        def __init__(self, experiment_conditions):
+            self.experiment_conditions = experiment_conditions
+
+    environment = Environment(_Conditions({'condition': condition,
+                                           'bounded': True,
+                                           'plume_model': 'Timeavg',
+                                           'plume_resolution': tuple(resolution),
+                                           'plume_build_processes': processes,
+                                           'plume_gradient': gradient}))
+
+    return environment.plume
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prebuild the interpolated TimeAvg plume cache")
+    parser.add_argument('--condition', nargs='+', default=['Left', 'Right'], help="Left and/or Right")
+    parser.add_argument('--resolution', nargs=3, type=int, default=[50, 15, 15], metavar=('NX', 'NY', 'NZ'),
+                        help="number of grid points along x, y and z")
+    parser.add_argument('--processes', type=int, default=None, help="number of processes to interpolate with")
+    parser.add_argument('--gradient', default='finite_difference', choices=['finite_difference', 'analytic'],
+                        help="how to compute the gradient grids")
+    args = parser.parse_args()
+
+    for condition in args.condition:
+        print "building {} plume at resolution {}".format(condition, args.resolution)
+        plume = prebuild(condition, args.resolution, processes=args.processes, gradient=args.gradient)
+        if plume.cache_key is None:
+            print "found precomputed interpolated CSVs for {}, nothing was cached".format(condition)
+        else:
+            print "cached in {}".format(cache_path(plume.cache_key))
@@ -0,0 +1,130 @@
+"""
+Binary cache of the raw (unaveraged) thermocouple recordings.
+
+Every thermocouple position was recorded for 20 s at 1000 Hz, far too much to parse and keep in memory on every load.
+The raw csv has one row per position, x, y, z followed by the temperature samples, which the first load of a condition
+converts into
+
+    positions.npy   (n_positions, 3) float64
+    frames.npy      (n_samples, n_positions) float32, one row per sample time
+
+plus a .json manifest. Frames are stored time-major so the temperatures of every position at one sample time are
+contiguous, and later loads memory-map them: only the frames the simulation actually visits get read from disk.
+
+Like the trajectory cache, the manifest records the size and mtime of the source csv, and the cache is rebuilt when it
+changes.
+
+    python -m roboskeeter.io.raw_plume_cache --condition Left Right
+"""
+__author__ = 'richard'
+
+import argparse
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+from roboskeeter.io.cache_files import atomic_path, describe_file, load_manifest, save_manifest
+from roboskeeter.io.i_o import get_directory
+
+CACHE_VERSION = 1
+SAMPLING_RATE = 1000.  # Hz of the raw recordings
+
+
+def load_condition(condition, rebuild=False):
+    """
+    Parameters
+    ----------
+    condition
+        Left or Right
+    rebuild
+        (bool) reconvert the csv even if the cache is up to date
+
+    Returns
+    -------
+    positions
+        (n_positions, 3) array of thermocouple positions
+    frames
+        memory-mapped (n_samples, n_positions) float32 array of temperatures
+    sampling_rate
+        of the frames, in Hz
+    """
+    condition = string.upper(condition)
+    source_path = get_directory('THERMOCOUPLE_RAW_' + condition)
+    source = describe_file(source_path)
+
+    manifest = None if rebuild else load_manifest(_path(condition, 'json'), CACHE_VERSION,
+                                                  [_path(condition, 'frames.npy'), _path(condition, 'positions.npy')])
+    if manifest is None or manifest['source'] != source:
+        manifest = build(condition, source_path, source)
+
+    positions = np.load(_path(condition, 'positions.npy'))
+    frames = np.load(_path(condition, 'frames.npy'), mmap_mode='r')
+    if frames.shape != (manifest['n_samples'], len(positions)):  # manifest and data out of sync
+        manifest = build(condition, source_path, source)
+        positions = np.load(_path(condition, 'positions.npy'))
+        frames = np.load(_path(condition, 'frames.npy'), mmap_mode='r')
+
+    return positions, frames, manifest['sampling_rate']
+
+
+def build(condition, source_path, source, chunk_rows=64):
+    """stream the raw csv of a condition into the cache, chunk_rows positions at a time"""
+    print "Converting raw {} plume recordings in {} to binary".format(condition, source_path)
+    # first pass over the positions only, to size the output. rows we can't place are no use
+    with open(source_path) as f:
+        n_samples = len(f.readline().split(',')) - 3
+    positions = pd.read_csv(source_path, header=None, usecols=[0, 1, 2]).values
+    valid = ~np.isnan(positions).any(axis=1)
+    positions = positions[valid]
+
+    with atomic_path(_path(condition, 'frames.npy')) as tmp_path:
+        frames = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(n_samples, len(positions)))
+        _fill_frames(frames, source_path, valid, chunk_rows)
+        frames.flush()
+        del frames
+    with atomic_path(_path(condition, 'positions.npy')) as tmp_path:
+        np.save(tmp_path, positions)
+
+    manifest = {'version': CACHE_VERSION,
+                'source': source,
+                'n_samples': n_samples,
+                'n_positions': len(positions),
+                'sampling_rate': SAMPLING_RATE}
+    save_manifest(_path(condition, 'json'), manifest)
+
+    return manifest
+
+
+def _fill_frames(frames, source_path, valid, chunk_rows):
+    """stream the temperatures of the valid rows of the csv into the (n_samples, n_positions) frames"""
+    row, column = 0, 0
+    for chunk in pd.read_csv(source_path, header=None, chunksize=chunk_rows, dtype=np.float64):
+        temperatures = chunk.values[valid[row:row + len(chunk)], 3:]
+        row += len(chunk)
+
+        # fill dropped samples with the mean of their position
+        missing = np.isnan(temperatures)
+        if missing.any():
+            temperatures = np.where(missing, np.nanmean(temperatures, axis=1)[:, np.newaxis], temperatures)
+
+        frames[:, column:column + len(temperatures)] = temperatures.T
+        column += len(temperatures)
+
+
+def _path(condition, suffix):
+    return os.path.join(get_directory('RAW_PLUME_CACHE'), '{}_{}'.format(string.lower(condition), suffix))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the raw thermocouple csvs to the binary cache")
+    parser.add_argument('--condition', nargs='+', default=['Left', 'Right'], help="Left and/or Right")
+    parser.add_argument('--rebuild', action='store_true', help="reconvert even if the cache is up to date")
+    args = parser.parse_args()
+
+    for condition in args.condition:
+        positions, frames, sampling_rate = load_condition(condition, rebuild=args.rebuild)
+        print "{}: {} positions, {:.1f} s at {:.0f} Hz in {}".format(condition, len(positions),
+                                                                     len(frames) / sampling_rate, sampling_rate,
+                                                                     get_directory('RAW_PLUME_CACHE'))
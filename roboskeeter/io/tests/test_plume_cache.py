@@ -0,0 +1,68 @@
+__author__ = 'richard'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from roboskeeter.io import plume_cache
+
+SETTINGS = (2e-5, 0.05, (6, 4, 3))  # smoothing, epsilon, resolution
+
+
+class TestPlumeCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.raw_csv_path = os.path.join(self.directory, 'raw.csv')
+        random_state = np.random.RandomState(0)
+        np.savetxt(self.raw_csv_path, random_state.rand(20, 4), delimiter=',')
+
+        self.fields = {'xi': np.linspace(0, 1, 6), 'yi': np.linspace(-0.1, 0.1, 4), 'zi': np.linspace(0, 0.2, 3)}
+        for name in ['avg_temp', 'gradient_x', 'gradient_y', 'gradient_z']:
+            self.fields[name] = random_state.randn(6, 4, 3)
+
+        self._get_directory = plume_cache.get_directory
+        plume_cache.get_directory = lambda selection=None: os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        plume_cache.get_directory = self._get_directory
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        key = plume_cache.make_key(self.raw_csv_path, *SETTINGS)
+        self.assertIsNone(plume_cache.load(key))
+
+        path = plume_cache.save(key, self.fields)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])  # no tmp file left behind
+
+        loaded = plume_cache.load(key)
+        self.assertEqual(sorted(loaded), sorted(plume_cache.FIELD_NAMES))
+        for name in plume_cache.FIELD_NAMES:
+            np.testing.assert_array_equal(loaded[name], self.fields[name])
+
+    def test_changed_source_or_settings_miss(self):
+        key = plume_cache.make_key(self.raw_csv_path, *SETTINGS)
+        plume_cache.save(key, self.fields)
+        self.assertEqual(plume_cache.make_key(self.raw_csv_path, *SETTINGS), key)
+
+        for smoothing, epsilon, resolution, extra in [(1e-5, 0.05, (6, 4, 3), ()),
+                                                      (2e-5, 0.06, (6, 4, 3), ()),
+                                                      (2e-5, 0.05, (6, 4, 4), ()),
+                                                      (2e-5, 0.05, (6, 4, 3), ('analytic',))]:
+            self.assertNotEqual(plume_cache.make_key(self.raw_csv_path, smoothing, epsilon, resolution, extra), key)
+
+        # same size, different bytes
+        with open(self.raw_csv_path) as f:
+            raw = f.read()
+        with open(self.raw_csv_path, 'w') as f:
+            f.write(raw.replace('1', '2', 1) if '1' in raw else raw.replace('2', '1', 1))
+
+        changed_key = plume_cache.make_key(self.raw_csv_path, *SETTINGS)
+        self.assertNotEqual(changed_key, key)
+        self.assertIsNone(plume_cache.load(changed_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
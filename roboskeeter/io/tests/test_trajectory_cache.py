@@ -0,0 +1,99 @@
+__author__ = 'richard'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from roboskeeter.io import trajectory_cache
+from roboskeeter.io.i_o import EXPERIMENT_COLUMNS, load_condition_csvs
+
+
+class TestTrajectoryCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_directory = os.path.join(self.directory, 'control')
+        os.makedirs(self.source_directory)
+        self.random_state = np.random.RandomState(0)
+        for trajectory_num, n_rows in [(1, 30), (4, 7), (12, 55)]:
+            self.write_csv(trajectory_num, n_rows)
+
+        directories = {'EXP_TRAJECTORIES_CONTROL': self.source_directory,
+                       'EXP_TRAJECTORIES_CACHE': os.path.join(self.directory, 'cache')}
+        self._get_directory = trajectory_cache.get_directory
+        trajectory_cache.get_directory = lambda selection=None: directories[selection]
+
+        # count the conversions, to tell a cache hit from a rebuild
+        self.n_builds = 0
+        self._build = trajectory_cache.build
+
+        def counting_build(*args):
+            self.n_builds += 1
+            return self._build(*args)
+        trajectory_cache.build = counting_build
+
+    def tearDown(self):
+        trajectory_cache.get_directory = self._get_directory
+        trajectory_cache.build = self._build
+        shutil.rmtree(self.directory)
+
+    def write_csv(self, trajectory_num, n_rows):
+        path = os.path.join(self.source_directory, 'Control_{}.csv'.format(trajectory_num))
+        np.savetxt(path, self.random_state.randn(n_rows, len(EXPERIMENT_COLUMNS)), delimiter=',', fmt='%.6f')
+
+    def assertMatchesCsvs(self, store):
+        dataframes = load_condition_csvs(self.source_directory)
+        self.assertEqual(store.n_trajectories, len(dataframes))
+        for i, (_, dataframe) in enumerate(dataframes):
+            trajectory = store.trajectory(i)
+            self.assertEqual(store.trajectory_nums[i], dataframe.trajectory_num.iloc[0])
+            np.testing.assert_array_equal(trajectory['tsi'], dataframe.tsi.values)
+            for name in ['position', 'velocity', 'acceleration']:
+                np.testing.assert_array_equal(trajectory[name],
+                                              dataframe[[name + '_x', name + '_y', name + '_z']].values)
+            np.testing.assert_array_equal(trajectory['curvatureS'], dataframe.curvatureS.values)
+
+    def test_round_trip(self):
+        store = trajectory_cache.load_condition('Control')
+        self.assertEqual(self.n_builds, 1)
+        self.assertMatchesCsvs(store)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, 'cache'))), ['control.json', 'control.npy'])
+
+        store = trajectory_cache.load_condition('Control')
+        self.assertEqual(self.n_builds, 1)  # served from the cache
+        self.assertIsInstance(store.column('position').base, np.memmap)
+        self.assertMatchesCsvs(store)
+
+        dataframe = trajectory_cache.load_condition_dataframe('Control')
+        self.assertEqual(self.n_builds, 1)
+        expected = store.to_dataframe()
+        self.assertEqual(list(dataframe.columns), list(expected.columns))
+        for name in expected.columns:
+            np.testing.assert_array_equal(dataframe[name].values, expected[name].values)
+
+    def test_changed_sources_rebuild(self):
+        trajectory_cache.load_condition('Control')
+
+        self.write_csv(4, 9)  # rewritten with other data
+        self.assertMatchesCsvs(trajectory_cache.load_condition('Control'))
+        self.assertEqual(self.n_builds, 2)
+
+        self.write_csv(20, 5)  # added
+        self.assertMatchesCsvs(trajectory_cache.load_condition('Control'))
+        os.remove(os.path.join(self.source_directory, 'Control_1.csv'))  # removed
+        self.assertMatchesCsvs(trajectory_cache.load_condition('Control'))
+        self.assertEqual(self.n_builds, 4)
+
+    def test_stale_manifest_rebuilds(self):
+        trajectory_cache.load_condition('Control')
+        with open(trajectory_cache._manifest_path('Control'), 'w') as f:
+            f.write('{"version": 0}')
+
+        self.assertMatchesCsvs(trajectory_cache.load_condition('Control'))
+        self.assertEqual(self.n_builds, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+Binary columnar cache of the experimental trajectory csvs.
+
+Parsing a few hundred csvs with pandas every time an experiment is loaded is slow, so the first load of a condition
+converts its whole directory into one float32 .npy file holding every kinematic column back to back, plus a small
+.json manifest with the trajectory offsets and numbers. Later loads memory-map the .npy, so only the pages that are
+actually used get read.
+
+The manifest also records the name, size and mtime of every source csv. If any of them change, or files are added or
+removed, the cache is rebuilt automatically.
+
+Run this module to build the caches ahead of time:
+
+    python -m roboskeeter.io.trajectory_cache --condition Control Left Right
+"""
+__author__ = 'richard'
+
+import argparse
+import os
+import string
+
+import numpy as np
+import pandas as pd
+
+from roboskeeter.io.cache_files import atomic_path, describe_file, load_manifest, save_manifest
+from roboskeeter.io.i_o import EXPERIMENT_COLUMNS, get_directory, load_condition_csvs
+from roboskeeter.trajectory_store import TrajectoryStore, experiment_columns
+
+CACHE_VERSION = 1
+
+
+def load_condition(condition, rebuild=False):
+    """
+    Parameters
+    ----------
+    condition
+        Control, Left or Right
+    rebuild
+        (bool) reconvert the csvs even if the cache is up to date
+
+    Returns
+    -------
+    TrajectoryStore backed by the memory-mapped cache
+    """
+    kinematics, manifest = _load(condition, rebuild, mmap_mode='r')
+
+    return _to_store(kinematics, manifest['offsets'], manifest['trajectory_nums'])
+
+
+def load_condition_dataframe(condition, rebuild=False):
+    """
+    Like load_condition(), but as a DataFrame. The kinematic columns are a single float32 block viewing the
+    memory-mapped cache, so loading doesn't read the data, and writes to the columns stay in memory (copy on write).
+    """
+    kinematics, manifest = _load(condition, rebuild, mmap_mode='c')
+    offsets = np.array(manifest['offsets'])
+
+    dataframe = pd.DataFrame(kinematics.T, columns=EXPERIMENT_COLUMNS, copy=False)
+    dataframe['tsi'] = _tsi(offsets)
+    dataframe['trajectory_num'] = np.repeat(np.array(manifest['trajectory_nums'], dtype=np.int64), np.diff(offsets))
+
+    return dataframe
+
+
+def build(condition, source_directory, sources):
+    """parse the csvs of a condition and write them to the cache"""
+    print "Converting {} trajectories in {} to binary".format(condition, source_directory)
+    dataframes = load_condition_csvs(source_directory)
+
+    lengths = [len(dataframe) for _, dataframe in dataframes]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    trajectory_nums = [int(dataframe['trajectory_num'].iloc[0]) if len(dataframe) else -1
+                       for _, dataframe in dataframes]
+
+    # one row per kinematic, so that every column is contiguous on disk
+    kinematics = np.empty((len(EXPERIMENT_COLUMNS), offsets[-1]), dtype=np.float32)
+    for (_, dataframe), start, stop in zip(dataframes, offsets[:-1], offsets[1:]):
+        kinematics[:, start:stop] = dataframe[EXPERIMENT_COLUMNS].values.T
+
+    manifest = {'version': CACHE_VERSION,
+                'columns': EXPERIMENT_COLUMNS,
+                'sources': sources,
+                'offsets': offsets.tolist(),
+                'trajectory_nums': trajectory_nums}
+
+    with atomic_path(_data_path(condition)) as tmp_path:
+        np.save(tmp_path, kinematics)
+    save_manifest(_manifest_path(condition), manifest)
+
+    return manifest
+
+
+def _load(condition, rebuild, mmap_mode):
+    """the memory-mapped (n_kinematics, n_rows) block of a condition and its manifest, rebuilding them if needed"""
+    condition = string.upper(condition)
+    source_directory = get_directory("EXP_TRAJECTORIES_" + condition)
+    sources = _list_sources(source_directory)
+
+    manifest = None if rebuild else load_manifest(_manifest_path(condition), CACHE_VERSION, [_data_path(condition)],
+                                                  columns=EXPERIMENT_COLUMNS)
+    if manifest is None or manifest['sources'] != sources:
+        manifest = build(condition, source_directory, sources)
+
+    kinematics = np.load(_data_path(condition), mmap_mode=mmap_mode)
+    if kinematics.shape != (len(EXPERIMENT_COLUMNS), manifest['offsets'][-1]):  # manifest and data out of sync
+        manifest = build(condition, source_directory, sources)
+        kinematics = np.load(_data_path(condition), mmap_mode=mmap_mode)
+
+    return kinematics, manifest
+
+
+def _to_store(kinematics, offsets, trajectory_nums):
+    """wrap the (n_kinematics, n_rows) block in a TrajectoryStore without copying it"""
+    rows = {name: kinematics[i] for i, name in enumerate(EXPERIMENT_COLUMNS)}
+
+    arrays = {}
+    for column in experiment_columns():
+        if column.width == 3:
+            first = EXPERIMENT_COLUMNS.index(column.name + '_x')  # _x, _y, _z are adjacent, so this is a view
+            arrays[column.name] = kinematics[first:first + 3].T
+        elif column.name == 'tsi':
+            arrays['tsi'] = _tsi(offsets)
+        else:
+            arrays[column.name] = rows[column.name]
+
+    return TrajectoryStore.from_arrays(experiment_columns(), arrays, offsets, trajectory_nums)
+
+
+def _tsi(offsets):
+    """timestep index of every row, counting from 0 at the start of each trajectory"""
+    offsets = np.asarray(offsets)
+    return (np.arange(offsets[-1]) - np.repeat(offsets[:-1], np.diff(offsets))).astype(np.int32)
+
+
+def _list_sources(directory):
+    """[name, size, mtime] of every csv in the directory, sorted by name"""
+    sources = []
+    for fname in sorted(os.listdir(directory)):
+        path = os.path.join(directory, fname)
+        if os.path.isfile(path):
+            sources.append([fname] + describe_file(path))
+
+    return sources
+
+
+def _data_path(condition):
+    return os.path.join(get_directory('EXP_TRAJECTORIES_CACHE'), '{}.npy'.format(string.lower(condition)))
+
+
+def _manifest_path(condition):
+    return os.path.join(get_directory('EXP_TRAJECTORIES_CACHE'), '{}.json'.format(string.lower(condition)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the experimental trajectory csvs to the binary cache")
+    parser.add_argument('--condition', nargs='+', default=['Control', 'Left', 'Right'],
+                        help="Control, Left and/or Right")
+    parser.add_argument('--rebuild', action='store_true', help="reconvert even if the cache is up to date")
+    args = parser.parse_args()
+
+    for condition in args.condition:
+        store = load_condition(condition, rebuild=args.rebuild)
+        print "{}: {} trajectories, {} rows in {}".format(condition, store.n_trajectories, len(store),
+                                                          _data_path(condition))
@@ -109,21 +109,91 @@ def calculate_curvature(ensemble):
     return curvature
 
 
-def gen_symm_vecs(dims=3):
+def gen_symm_vecs(dims=3, n_vecs=None, random_state=None):
     """generate randomly pointed (radially-symmetric) 3D unit vectors/ direction vectors
 
     first we draw from a 3D gaussian, which is a symmetric distribution no matter how you slice it. then, we map
     those draws onto the unit sphere.
 
+    if n_vecs is given, returns an (n_vecs, dims) array of unit vectors drawn in one go. drawing n_vecs at once gives
+    the same vectors as n_vecs single draws from the same random_state.
+
+    random_state is an np.random.RandomState to draw from. defaults to the global numpy RNG.
+
     credit: http://codereview.stackexchange.com/a/77945/76407
     """
-    vecs = np.random.normal(size=dims)
-    vec_norm = np.linalg.norm(vecs, axis=-1)
+    if random_state is None:
+        random_state = np.random
+    if n_vecs is None:
+        vecs = random_state.normal(size=dims)
+    else:
+        vecs = random_state.normal(size=(n_vecs, dims))
+    vec_norm = np.sqrt(np.sum(vecs * vecs, axis=-1))  # not np.linalg.norm, which rounds differently for 1D input
 
     ends = vecs / vec_norm[..., np.newaxis]  # divide by length to get unit vector
 
     return ends
 
+
+class UnitVectorSampler(object):
+    """hands out random unit vectors (see gen_symm_vecs) from a buffer that is refilled in bulk, instead of making
+    a tiny numpy draw for every vector
+
+    because a random_state's normal draws come out the same whether they are made one by one or in a block, drawing
+    vectors from a sampler gives the same vectors as calling gen_symm_vecs on the same random_state every time, as long
+    as nothing else draws from that random_state in between.
+    """
+    def __init__(self, dims=3, block_size=4096, random_state=None):
+        """
+        Parameters
+        ----------
+        dims
+            (int) dimensions of the vectors
+        block_size
+            (int) number of vectors generated per refill
+        random_state
+            np.random.RandomState to draw from. defaults to the global numpy RNG
+        """
+        self.dims = dims
+        self.block_size = block_size
+        self.random_state = random_state
+        self._buffer = np.empty((0, dims))
+        self._next = 0
+
+    def draw(self, n_vecs=None):
+        """
+        Returns
+        -------
+        a (dims,) unit vector, or an (n_vecs, dims) array of them if n_vecs is given. these are views into the
+        buffer, copy them if you need to modify them
+        """
+        if n_vecs is None:
+            if self._next == len(self._buffer):
+                self._refill()
+            self._next += 1
+            return self._buffer[self._next - 1]
+
+        if self._next + n_vecs <= len(self._buffer):
+            self._next += n_vecs
+            return self._buffer[self._next - n_vecs:self._next]
+
+        vecs = np.empty((n_vecs, self.dims))
+        filled = 0
+        while filled < n_vecs:
+            if self._next == len(self._buffer):
+                self._refill()
+            n = min(n_vecs - filled, len(self._buffer) - self._next)
+            vecs[filled:filled + n] = self._buffer[self._next:self._next + n]
+            self._next += n
+            filled += n
+
+        return vecs
+
+    def _refill(self):
+        self._buffer = gen_symm_vecs(self.dims, n_vecs=self.block_size, random_state=self.random_state)
+        self._next = 0
+
+
 def rads_to_degrees(rads):
     degrees = (rads * 180/np.pi) % 360  # map to [0,360)
     return degrees
@@ -0,0 +1,111 @@
+"""
+Append-only journal of optimizer evaluations.
+
+Every evaluated guess is written as one JSON line (parameters, seed, number of flights, whether it was stopped early,
+run configuration, score, score components, time) and flushed to disk straight away, so a Ctrl-C or a crash loses at
+most the evaluation that was running. Opening an existing journal reads it back, which lets a fit resume where it
+stopped and serve guesses it has already simulated without simulating them again.
+"""
+__author__ = 'richard'
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+class EvaluationJournal(object):
+    def __init__(self, path, rtol=1e-6):
+        """
+        Parameters
+        ----------
+        path
+            jsonl file to append to. created if it doesn't exist, read back if it does
+        rtol
+            relative tolerance within which two parameter vectors count as the same guess in lookup()
+        """
+        self.path = path
+        self.rtol = rtol
+        self.entries = []
+        self._ends_mid_line = False  # the last line was cut off, start the next record on a fresh line
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    self._ends_mid_line = not line.endswith('\n')
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:  # the line being written when we were killed
+                        continue
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, params, score, score_components, seed=None, n_trajectories=None, truncated=False, config=None):
+        """
+        append an evaluation to the journal and flush it to disk
+
+        Parameters
+        ----------
+        n_trajectories
+            number of flights actually simulated
+        truncated
+            (bool) the evaluation was stopped early, so the score is not comparable to complete ones
+        config
+            JSON-able description of everything else the score depends on (e.g. simulation conditions)
+        """
+        entry = {'params': [float(param) for param in params],
+                 'seed': None if seed is None else int(seed),
+                 'n_trajectories': n_trajectories,
+                 'truncated': bool(truncated),
+                 'config': config,
+                 'score': float(score),
+                 'score_components': {kinematic: float(component)
+                                      for kinematic, component in score_components.iteritems()},
+                 'time': str(datetime.now())}
+
+        with open(self.path, 'a') as f:
+            if self._ends_mid_line:
+                f.write('\n')
+                self._ends_mid_line = False
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.entries.append(entry)
+
+        return entry
+
+    def select(self, n_trajectories=None, config=None):
+        """
+        Returns
+        -------
+        the complete (not truncated) entries that simulated n_trajectories flights and ran with config, where given
+        """
+        return [entry for entry in self.entries
+                if not entry.get('truncated', False)
+                and (n_trajectories is None or entry['n_trajectories'] == n_trajectories)
+                and (config is None or entry.get('config') == config)]
+
+    def lookup(self, params, n_trajectories=None, config=None):
+        """
+        Returns
+        -------
+        the latest entry of select(n_trajectories, config) whose parameters match params within rtol, or None
+        """
+        entries = self.select(n_trajectories, config)
+        if not entries:
+            return None
+
+        params = np.asarray(params, dtype=float)
+        journal_params = np.array([entry['params'] for entry in entries], dtype=float)
+        matches = np.flatnonzero(np.all(np.abs(journal_params - params) <= self.rtol * np.abs(params), axis=1))
+        if len(matches) == 0:
+            return None
+
+        return entries[matches[-1]]
+
+    def best(self, n=1, n_trajectories=None, config=None):
+        """the n lowest scoring entries of select(n_trajectories, config), best first"""
+        return sorted(self.select(n_trajectories, config), key=lambda entry: entry['score'])[:n]
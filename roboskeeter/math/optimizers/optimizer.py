@@ -1,16 +1,19 @@
 __author__ = 'richard'
 
 import logging
+import multiprocessing
 from datetime import datetime
 
 import numpy as np
-from scipy.optimize import minimize_scalar, basinhopping
+from scipy.optimize import OptimizeResult, minimize_scalar, basinhopping, differential_evolution
 
 from roboskeeter import experiments
+from roboskeeter.math.optimizers.journal import EvaluationJournal
+from roboskeeter.math.optimizers.surrogate import GaussianProcessSurrogate
+from roboskeeter.math.scoring.scoring import KSScorer, get_reference_data
 
 logging.basicConfig(filename='basin_hopping.log', level=logging.DEBUG)
 
-# TODO: save guesses and their scores
 
 
     # if PLOTTER is True:
@@ -77,11 +80,75 @@ logging.basicConfig(filename='basin_hopping.log', level=logging.DEBUG)
     # return BEST_GUESS, HIGH_SCORE, result
 
 
+BASELINE_SIMULATION_CONDITIONS = {'condition': 'Control',
+                                  'time_max': 6.,
+                                  'bounded': True,
+                                  'plume_model': "None",
+                                  'optimizing': True
+                                  }
+
+
+def baseline_agent_kwargs(guess):
+    """agent kwargs of the baseline (plume-ignoring) model for a [restitution, randomF, damping] guess"""
+    restitution, random_f, damping = guess
+
+    return {'is_simulation': True,
+            'random_f_strength': random_f,
+            'stim_f_strength': 0.,
+            'damping_coeff': damping,
+            'collision_type': 'part_elastic',
+            'restitution_coeff': restitution,  # Optimizing this
+            'stimulus_memory_n_timesteps': 1,
+            'decision_policy': 'ignore',  # 'surge_only', 'cast_only', 'cast+surge', 'gradient', 'ignore'
+            'initial_position_selection': 'downwind_high',
+            'verbose': False,
+            'optimizing': True
+            }
+
+
 class FitBaselineModel:
-    def __init__(self, initial_guess, n_trajectories = 100):
+    def __init__(self, initial_guess, n_trajectories = 100, sequential=False, batch_size=25, method='basinhopping',
+                 workers=None, seed=None, journal_path=None):
+        """
+        Parameters
+        ----------
+        initial_guess
+            [restitution, randomF, damping]
+        n_trajectories
+            (int) flights simulated per guess
+        sequential
+            (bool) simulate each guess in batches of batch_size flights, and stop early once the guess is clearly worse
+            than the best one so far. see _sequential_score()
+        batch_size
+            (int) flights per batch in sequential mode
+        method
+            'basinhopping' evaluates one guess at a time. 'differential_evolution' evolves a population of guesses,
+            evaluating each generation in parallel on a pool of workers with common random numbers, see
+            _run_differential_evolution(). 'bayesian' fits a Gaussian process to the evaluations so far and only
+            simulates batches of guesses picked by expected improvement, see _run_bayesian_optimization()
+        workers
+            (int) number of processes a differential evolution generation is spread across. None evaluates in this
+            process
+        seed
+            (int) seed that the per-generation simulation seeds of differential evolution are drawn from
+        journal_path
+            jsonl file every evaluation is appended to, e.g. 'fit_baseline_journal.jsonl'. if it already holds complete
+            evaluations of the same n_trajectories and run configuration, the fit resumes from them and guesses in it
+            are not simulated again. None (the default) turns the journal off
+        """
         print "starting optimization"
         self.iter_count = 0
-        self.function = basinhopping
+        if method not in ['basinhopping', 'differential_evolution', 'bayesian']:
+            raise ValueError("unknown optimization method {}".format(method))
+        self.method = method
+
+        self.workers = workers
+        self.seed = seed
+        self.popsize = 15  # population is popsize * 3 guesses
+        self.maxiter = 100  # number of generations
+        self.n_initial_points = 10  # latin hypercube guesses before the surrogate takes over
+        self.n_batches = 30  # number of surrogate-proposed batches
+        self.surrogate_batch_size = 4 if workers is None else workers
 
         self.stepsize = 4e-6
         self.temperature = 5e-5
@@ -114,13 +181,30 @@ class FitBaselineModel:
         self.initial_guess = initial_guess
         self.n_trajectories = n_trajectories
 
+        self.sequential = sequential
+        self.batch_size = batch_size
+        self.min_batches = 2  # don't trust a bootstrap over fewer batches than this
+        self.early_stopping_confidence = 0.95
+        self.n_bootstrap_resamples = 100
+        self.n_simulated = 0  # total number of flights simulated, to see what early stopping saves
+        self.n_evaluations = 0  # guesses simulated by this run, not served from the journal
+
         self.reference_data = self._load_reference_ensemble()
 
+        # what the scores depend on besides the guess and n_trajectories. journal entries of other runs are ignored
+        self.journal_config = {'simulation_conditions': BASELINE_SIMULATION_CONDITIONS,
+                               'score_weights': self.score_weights}
+        self.journal = None if journal_path is None else EvaluationJournal(journal_path)
+        if self.journal is not None:
+            self._resume_from_journal()
+
         logging.info("""\n ############################################################
         ############################################################
         {date}
+        method = {method}
         algorithm = {algo}
         n_trajectories = {N}
+        sequential = {seq} (batch size {bs})
         Params = {pn}
         Initial Guess = {i}
         stepsize = {ss}
@@ -129,8 +213,11 @@ class FitBaselineModel:
         niter_success = {nis}
         ############################################################""".format(
             date=datetime.now(),
+            method=self.method,
             algo=self.optimizer,
             N=self.n_trajectories,
+            seq=self.sequential,
+            bs=self.batch_size,
             pn=self.parameter_names,
             i=self.initial_guess,
             ss = self.stepsize,
@@ -142,6 +229,11 @@ class FitBaselineModel:
         self.result = self.run_optimization()
 
     def run_optimization(self):
+        if self.method == 'differential_evolution':
+            return self._run_differential_evolution()
+        elif self.method == 'bayesian':
+            return self._run_bayesian_optimization()
+
         try:
             result = basinhopping(
                 self.simulation_wrapper,
@@ -175,55 +267,301 @@ class FitBaselineModel:
         """
         self.iter_count += 1
 
-        resitution, randomF, damping  = guess
-
-        simulation_conditions = {'condition': 'Control',
-                             'time_max': 6.,
-                             'bounded': True,
-                             'plume_model': "None",
-                             'optimizing': True
-                             }
-
-        agent_kwargs = {'is_simulation': True,
-                        'random_f_strength': resitution,
-                        'stim_f_strength': 0.,
-                        'damping_coeff': damping,
-                        'collision_type': 'part_elastic',
-                        'restitution_coeff': resitution,  # Optimizing this
-                        'stimulus_memory_n_timesteps': 1,
-                        'decision_policy': 'ignore',  # 'surge_only', 'cast_only', 'cast+surge', 'gradient', 'ignore'
-                        'initial_position_selection': 'downwind_high',
-                        'verbose': False,
-                        'optimizing': True
-                        }
-
-        experiment = experiments.start_simulation(self.n_trajectories, agent_kwargs, simulation_conditions)
-
-        combined_score, score_components = experiment.calc_score(score_weights=self.score_weights, reference_data=self.reference_data)  # save on computation by passing the ref data
-
-        log_str = "iter {}, guess = {}. total score = {}. score components = {}. time = {}".format(self.iter_count, guess, combined_score, score_components, datetime.now())
+        journal_entry = self._lookup_journal(guess)
+        if journal_entry is not None:
+            return journal_entry['score']
+
+        agent_kwargs = baseline_agent_kwargs(guess)
+        simulation_conditions = dict(BASELINE_SIMULATION_CONDITIONS)
+
+        if self.sequential:
+            combined_score, score_components, n_simulated = self._sequential_score(agent_kwargs, simulation_conditions)
+        else:
+            experiment = experiments.start_simulation(self.n_trajectories, agent_kwargs, simulation_conditions,
+                                                      vectorized=True)
+            n_simulated = self.n_trajectories
+            self.n_simulated += self.n_trajectories
+
+            combined_score, score_components = experiment.calc_score(score_weights=self.score_weights, reference_data=self.reference_data)  # save on computation by passing the ref data
+
+        self._record_evaluation(guess, combined_score, score_components, n_simulated=n_simulated)
+
+        return combined_score
+
+    def _record_evaluation(self, guess, combined_score, score_components, seed=None, iteration=None,
+                           n_simulated=None):
+        """
+        journal and log an evaluated guess and keep track of the best one. n_simulated is the number of flights the
+        score is based on, if the evaluation was stopped before simulating all n_trajectories
+        """
+        self.n_evaluations += 1
+        if iteration is None:
+            iteration = self.iter_count
+        if n_simulated is None:
+            n_simulated = self.n_trajectories
+        if self.journal is not None:
+            self.journal.record(guess, combined_score, score_components, seed=seed, n_trajectories=n_simulated,
+                                truncated=n_simulated < self.n_trajectories, config=self.journal_config)
+
+        log_str = "iter {}, guess = {}. total score = {}. score components = {}. time = {}".format(iteration, guess, combined_score, score_components, datetime.now())
+        if seed is not None:
+            log_str += ". seed = {}".format(seed)
         logging.info(log_str)
         print log_str
 
-        if combined_score < self.best_score:  # move to own func
+        if combined_score < self.best_score:
             self.best_score = combined_score
             self.best_guess = guess
             hs_announcement = "accepted {} as new best guess!!!!!!!!!!!!!!!!!!!!!".format(guess)
             print(hs_announcement)
             logging.info(hs_announcement)
 
-        return combined_score
+    def _lookup_journal(self, guess):
+        """journal entry of a guess that was already simulated, or None"""
+        if self.journal is None:
+            return None
+
+        journal_entry = self.journal.lookup(guess, n_trajectories=self.n_trajectories, config=self.journal_config)
+        if journal_entry is not None:
+            log_str = "iter {}, guess = {}. total score = {} (from journal)".format(self.iter_count, guess,
+                                                                                 journal_entry['score'])
+            logging.info(log_str)
+            print log_str
+
+        return journal_entry
+
+    def _resume_from_journal(self):
+        """pick up the best guess so far that was scored the same way as this run, and restart from it"""
+        best_entries = self.journal.best(n_trajectories=self.n_trajectories, config=self.journal_config)
+        if not best_entries:
+            return
+
+        best_entry = best_entries[0]
+        self.best_score, self.best_guess = best_entry['score'], best_entry['params']
+        self.iter_count = len(self.journal)
+        self.initial_guess = best_entry['params']
+
+        resume_str = "resuming from {} journaled evaluations in {}. best guess = {}, score = {}".format(
+            len(self.journal), self.journal.path, self.best_guess, self.best_score)
+        logging.info(resume_str)
+        print resume_str
+
+    def _initial_population(self):
+        """the best journaled guesses if there are enough of them to fill a population, else a latin hypercube"""
+        population_size = self.popsize * len(self.bounds)
+        if self.journal is None:
+            return 'latinhypercube'
+
+        best_entries = self.journal.best(population_size, n_trajectories=self.n_trajectories,
+                                         config=self.journal_config)
+        if len(best_entries) < population_size:
+            return 'latinhypercube'
+
+        lower, upper = np.array(self.bounds).T
+        population = np.array([entry['params'] for entry in best_entries])
+        return np.clip(population, lower, upper)
+
+    def _run_differential_evolution(self):
+        """
+        Differential evolution over the bounds. Every guess of a generation is simulated with the same seed, so
+        guesses are compared on the same random forces and starting positions, not on luck of the draw.
+        """
+        generation_seeds = np.random.RandomState(self.seed)
+
+        if self.workers is not None and self.workers > 1:
+            pool = multiprocessing.Pool(processes=self.workers, initializer=_init_worker,
+                                        initargs=(self.reference_data, self.score_weights, self.n_trajectories))
+        else:
+            pool = None
+            _init_worker(self.reference_data, self.score_weights, self.n_trajectories)
+
+        try:
+            result = differential_evolution(
+                self.simulation_wrapper,  # only called by polish, which is off. generations go through _GenerationMap
+                self.bounds,
+                popsize=self.popsize,
+                maxiter=self.maxiter,
+                init=self._initial_population(),
+                polish=False,  # a local minimizer on a stochastic objective just chases noise
+                updating='deferred',  # needed to evaluate a whole generation at once
+                workers=_GenerationMap(self, pool, generation_seeds),
+                disp=True)
+            if pool is not None:
+                pool.close()
+
+            return result
+        except KeyboardInterrupt:
+            print "\n Optimization interrupted! Moving along..."
+            if pool is not None:
+                pool.terminate()
+            return ""
+        finally:
+            if pool is not None:
+                pool.join()
+
+    def _sequential_score(self, agent_kwargs, simulation_conditions):
+        """
+        Simulate a guess batch by batch, updating its KS score as flights come in. Once min_batches are in, stop as
+        soon as the whole bootstrap confidence interval of the score lies above the best score so far: more flights
+        would only tell us more precisely how bad the guess is.
+
+        Returns
+        -------
+        total score and score components of the flights simulated, and the number of flights simulated
+        """
+        scorer = KSScorer(self.reference_data, self.score_weights)
+
+        n_simulated, n_batches = 0, 0
+        while n_simulated < self.n_trajectories:
+            n = min(self.batch_size, self.n_trajectories - n_simulated)
+            experiment = experiments.start_simulation(n, agent_kwargs, simulation_conditions, vectorized=True)
+            observations = experiment.observations
+            # trajectory numbers restart at 0 every batch, offset them so they stay unique
+            scorer.update(observations.get_kinematic_dict(trim_endzones=True),
+                          observations.get_trajectory_num_array(trim_endzones=True) + n_simulated)
+            n_simulated += n
+            n_batches += 1
+
+            if n_batches >= self.min_batches and n_simulated < self.n_trajectories:
+                lower, upper = scorer.bootstrap_interval(n_resamples=self.n_bootstrap_resamples,
+                                                         confidence=self.early_stopping_confidence)
+                if lower > self.best_score:
+                    stop_str = "stopped after {} flights, score interval ({}, {}) is above best score {}".format(
+                        n_simulated, lower, upper, self.best_score)
+                    logging.info(stop_str)
+                    print stop_str
+                    break
+
+        self.n_simulated += n_simulated
+        combined_score, score_components = scorer.score()
+
+        return combined_score, score_components, n_simulated
 
     def _load_reference_ensemble(self):
-        reference_experiment = experiments.load_experiment(experiment_conditions = {'condition': 'Control',
-                                 'plume_model': "None",
-                                 'time_max': "N/A (experiment)",
-                                 'bounded': True,
-                                 'optimizing': True
-                                 })
+        return get_reference_data('Control', trim_endzones=False)
 
-        return reference_experiment.observations.get_kinematic_dict()
+    def _run_bayesian_optimization(self):
+        """
+        Bayesian optimization: start from the journaled evaluations plus a latin hypercube of guesses, then repeatedly
+        fit a Gaussian process to every evaluation so far and simulate the batch of guesses it expects the most
+        improvement from. Batches are simulated like differential evolution generations, in parallel with a common
+        seed.
+        """
+        random_state = np.random.RandomState(self.seed)
+        surrogate = GaussianProcessSurrogate(self.bounds, random_state=random_state)
+
+        if self.workers is not None and self.workers > 1:
+            pool = multiprocessing.Pool(processes=self.workers, initializer=_init_worker,
+                                        initargs=(self.reference_data, self.score_weights, self.n_trajectories))
+        else:
+            pool = None
+            _init_worker(self.reference_data, self.score_weights, self.n_trajectories)
+        evaluate_batch = _GenerationMap(self, pool, random_state)
+        n_evaluations = self.n_evaluations
+        interrupted = False
+
+        params, scores = [], []
+        if self.journal is not None:
+            for entry in self.journal.select(self.n_trajectories, self.journal_config):
+                params.append(entry['params'])
+                scores.append(entry['score'])
 
+        try:
+            initial_guesses = surrogate.latin_hypercube(self.n_initial_points)
+            params.extend(initial_guesses.tolist())
+            scores.extend(evaluate_batch(None, initial_guesses))
+
+            for batch in range(self.n_batches):
+                guesses = surrogate.propose(np.array(params), np.array(scores), self.surrogate_batch_size)
+                params.extend(guesses.tolist())
+                scores.extend(evaluate_batch(None, guesses))
+
+                batch_str = "bayesian batch {}: best guess = {}, score = {}".format(batch, self.best_guess,
+                                                                                   self.best_score)
+                logging.info(batch_str)
+                print batch_str
+
+            if pool is not None:
+                pool.close()
+        except KeyboardInterrupt:
+            print "\n Optimization interrupted! Moving along..."
+            interrupted = True
+            if pool is not None:
+                pool.terminate()
+        finally:
+            if pool is not None:
+                pool.join()
+
+        nfev = self.n_evaluations - n_evaluations
+        if self.best_guess is None:
+            return OptimizeResult(x=None, fun=None, nfev=nfev, success=False,
+                                  message="interrupted before any guess was evaluated")
+        elif interrupted:
+            return OptimizeResult(x=np.array(self.best_guess), fun=self.best_score, nfev=nfev, success=False,
+                                  message="interrupted, best guess so far")
+
+        return OptimizeResult(x=np.array(self.best_guess), fun=self.best_score, nfev=nfev, success=True,
+                              message="completed {} batches".format(self.n_batches))
+
+
+class _GenerationMap(object):
+    """
+    map-like callable for differential_evolution(workers=...), also used for the batches of the Bayesian optimizer.
+    Instead of mapping scipy's objective wrapper, it simulates every guess of the generation with one fresh seed on the
+    pool, and logs each evaluation.
+    """
+    def __init__(self, model, pool, generation_seeds):
+        self.model = model
+        self.pool = pool
+        self.generation_seeds = generation_seeds
+
+    def __call__(self, _, guesses):
+        guesses = [np.array(guess) for guess in guesses]
+        scores = [None] * len(guesses)
+        iterations = range(self.model.iter_count + 1, self.model.iter_count + len(guesses) + 1)
+
+        # guesses already in the journal don't get simulated again
+        for i, guess in enumerate(guesses):
+            self.model.iter_count += 1
+            journal_entry = self.model._lookup_journal(guess)
+            if journal_entry is not None:
+                scores[i] = journal_entry['score']
+
+        seed = self.generation_seeds.randint(0, 2 ** 31 - 1)
+        tasks = [(guess, seed) for guess, score in zip(guesses, scores) if score is None]
+        if self.pool is None:
+            results = map(_evaluate_guess, tasks)
+        else:
+            results = self.pool.map(_evaluate_guess, tasks)
+
+        results = iter(results)
+        for i, guess in enumerate(guesses):
+            if scores[i] is None:
+                combined_score, score_components = next(results)
+                self.model.n_simulated += self.model.n_trajectories
+                self.model._record_evaluation(guess, combined_score, score_components, seed=seed,
+                                              iteration=iterations[i])
+                scores[i] = combined_score
+
+        return scores
+
+
+# what the process evaluating guesses needs, set by _init_worker()
+_worker_reference_data, _worker_score_weights, _worker_n_trajectories = None, None, None
+
+
+def _init_worker(reference_data, score_weights, n_trajectories):
+    """hand the reference data to the process once, instead of pickling it with every guess"""
+    global _worker_reference_data, _worker_score_weights, _worker_n_trajectories
+    _worker_reference_data, _worker_score_weights, _worker_n_trajectories = reference_data, score_weights, n_trajectories
+
+
+def _evaluate_guess(task):
+    guess, seed = task
+    experiment = experiments.start_simulation(_worker_n_trajectories, baseline_agent_kwargs(guess),
+                                              dict(BASELINE_SIMULATION_CONDITIONS), vectorized=True, seed=seed)
+
+    return experiment.calc_score(score_weights=_worker_score_weights, reference_data=_worker_reference_data)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+"""
+Gaussian process surrogate of the optimizer objective, for Bayesian optimization.
+
+Every objective call is a whole ensemble simulation, while fitting a GP to a few hundred evaluations takes a fraction
+of a second. So the GP is fit to all evaluations so far and the simulator is only run on the points where the expected
+improvement over the best score is highest. Batches of points are proposed with the "constant liar" heuristic: after
+picking a point, pretend it scored as well as the best score so far, refit, and pick the next one. This keeps the
+points of a batch apart, so they can be simulated in parallel.
+
+Parameters spanning orders of magnitude (randomF and damping do) are modelled on a log scale.
+"""
+__author__ = 'richard'
+
+import numpy as np
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+
+
+class GaussianProcessSurrogate(object):
+    def __init__(self, bounds, random_state=None):
+        """
+        Parameters
+        ----------
+        bounds
+            ((min, max), ...) of every parameter
+        random_state
+            np.random.RandomState used to draw candidate points, or None for a fresh one
+        """
+        self.lower, self.upper = np.array(bounds, dtype=float).T
+        # log scale for strictly positive parameters spanning at least two orders of magnitude
+        self.log_scale = (self.lower > 0) & (self.upper / np.where(self.lower > 0, self.lower, 1) >= 100)
+        self.random_state = np.random.RandomState() if random_state is None else random_state
+
+        n_dims = len(self.lower)
+        # the objective is noisy (ensembles are finite), hence the white noise term
+        self.kernel = ConstantKernel(1.0) * Matern(length_scale=np.full(n_dims, 0.3), length_scale_bounds=(1e-2, 1e1),
+                                                   nu=2.5) + \
+            WhiteKernel(noise_level=1e-2, noise_level_bounds=(1e-6, 1e0))
+        self.gp = None
+
+    def to_unit(self, params):
+        """map parameters to the unit cube the GP lives in"""
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        lower, upper = self.lower.copy(), self.upper.copy()
+        scaled = params.copy()
+        scaled[:, self.log_scale] = np.log10(params[:, self.log_scale])
+        lower[self.log_scale], upper[self.log_scale] = np.log10(lower[self.log_scale]), np.log10(upper[self.log_scale])
+
+        return (scaled - lower) / (upper - lower)
+
+    def from_unit(self, unit_points):
+        unit_points = np.atleast_2d(unit_points)
+        lower, upper = self.lower.copy(), self.upper.copy()
+        lower[self.log_scale], upper[self.log_scale] = np.log10(lower[self.log_scale]), np.log10(upper[self.log_scale])
+        params = lower + unit_points * (upper - lower)
+        params[:, self.log_scale] = 10 ** params[:, self.log_scale]
+
+        return np.clip(params, self.lower, self.upper)
+
+    def latin_hypercube(self, n_points):
+        """n_points parameters with exactly one point in every 1/n_points slice of every (unit cube) dimension"""
+        n_dims = len(self.lower)
+        slices = np.array([self.random_state.permutation(n_points) for _ in range(n_dims)]).T
+        return self.from_unit((slices + self.random_state.rand(n_points, n_dims)) / n_points)
+
+    def fit(self, params, scores):
+        """fit the GP, kernel hyperparameters included, to the evaluations so far"""
+        self.gp = GaussianProcessRegressor(kernel=self.kernel, normalize_y=True, n_restarts_optimizer=3,
+                                           random_state=self.random_state)
+        self.gp.fit(self.to_unit(params), np.asarray(scores, dtype=float))
+
+        return self
+
+    def expected_improvement(self, unit_points, best_score, gp=None, xi=0.01):
+        """expected improvement (for minimization) over best_score at points of the unit cube"""
+        if gp is None:
+            gp = self.gp
+        mean, std = gp.predict(unit_points, return_std=True)
+        std = np.maximum(std, 1e-12)
+
+        improvement = best_score - mean - xi
+        z = improvement / std
+        return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+    def propose(self, params, scores, n_points, n_candidates=2000):
+        """
+        Parameters
+        ----------
+        params
+            (n_evaluations, n_dims) evaluated parameters
+        scores
+            (n_evaluations,) their scores
+        n_points
+            (int) batch size
+        n_candidates
+            (int) number of random points EI is maximized over, for every point of the batch
+
+        Returns
+        -------
+        (n_points, n_dims) parameters to simulate next
+        """
+        self.fit(params, scores)
+
+        unit_params = self.to_unit(params)
+        scores = np.asarray(scores, dtype=float)
+        best_score = scores.min()
+        best_unit_point = unit_params[np.argmin(scores)]
+
+        # refitting the liars with the kernel found above is enough, and much faster than a full fit
+        liar_gp = GaussianProcessRegressor(kernel=self.gp.kernel_, optimizer=None, normalize_y=True)
+        gp = self.gp
+
+        proposals = []
+        for _ in range(n_points):
+            # half the candidates anywhere, half close to the best point so far
+            n_dims = unit_params.shape[1]
+            candidates = np.vstack([self.random_state.rand(n_candidates // 2, n_dims),
+                                    np.clip(best_unit_point + 0.05 * self.random_state.randn(n_candidates // 2, n_dims),
+                                            0, 1)])
+            proposal = candidates[np.argmax(self.expected_improvement(candidates, best_score, gp=gp))]
+            proposals.append(proposal)
+
+            unit_params = np.vstack([unit_params, proposal])
+            scores = np.append(scores, best_score)  # the constant liar
+            gp = liar_gp.fit(unit_params, scores)
+
+        return self.from_unit(np.array(proposals))
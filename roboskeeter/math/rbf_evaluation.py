@@ -0,0 +1,234 @@
+"""
+Bounded-memory evaluation of a fitted scipy Rbf on big grids.
+
+Rbf.__call__ builds the full (n_targets, n_nodes) distance matrix in one go, so memory grows with
+grid points x data points. Here the target grid is streamed in blocks whose size is set by a memory budget, every
+block is written straight into a preallocated (possibly memory-mapped) output array, and blocks can be spread over a
+pool of processes.
+
+The same machinery evaluates the analytic gradient of the Rbf. With s(x) = sum_j nodes_j phi(|x - c_j|),
+
+    grad s(x) = sum_j nodes_j phi'(r_j) / r_j (x - c_j)
+              = x K nodes - K (nodes * c)
+
+where K is the block of kernel derivative values phi'(r_j) / r_j, so a block costs one matrix product with an
+(n_nodes, 4) matrix and never needs an (n_targets, n_nodes, 3) array of difference vectors.
+"""
+__author__ = 'richard'
+
+import multiprocessing
+
+import numpy as np
+from scipy.spatial.distance import cdist
+from scipy.special import xlogy
+
+
+def rbf_kernel(function, epsilon):
+    """the radial basis functions of scipy.interpolate.Rbf, as functions of the distance r"""
+    kernels = {'multiquadric': lambda r: np.sqrt((r / epsilon) ** 2 + 1),
+               'inverse': lambda r: 1.0 / np.sqrt((r / epsilon) ** 2 + 1),
+               'gaussian': lambda r: np.exp(-(r / epsilon) ** 2),
+               'linear': lambda r: r,
+               'cubic': lambda r: r ** 3,
+               'quintic': lambda r: r ** 5,
+               'thin_plate': lambda r: xlogy(r ** 2, r)}
+    if function == 'inverse_multiquadric':
+        function = 'inverse'
+
+    try:
+        return kernels[function]
+    except (KeyError, TypeError):
+        raise ValueError("can only evaluate the built-in Rbf functions in blocks, not {}".format(function))
+
+
+def rbf_kernel_derivative(function, epsilon):
+    """phi'(r) / r of the radial basis functions of scipy.interpolate.Rbf, see rbf_kernel()"""
+    def _where_positive(r, value):
+        # the kernels singular at r = 0 have no gradient contribution there: phi'(r) -> 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(r > 0, value(r), 0.)
+
+    kernels = {'multiquadric': lambda r: 1.0 / (epsilon ** 2 * np.sqrt((r / epsilon) ** 2 + 1)),
+               'inverse': lambda r: -1.0 / (epsilon ** 2 * np.sqrt((r / epsilon) ** 2 + 1) ** 3),
+               'gaussian': lambda r: -2.0 / epsilon ** 2 * np.exp(-(r / epsilon) ** 2),
+               'linear': lambda r: _where_positive(r, lambda r: 1.0 / r),
+               'cubic': lambda r: 3 * r,
+               'quintic': lambda r: 5 * r ** 3,
+               'thin_plate': lambda r: _where_positive(r, lambda r: 2 * np.log(r) + 1)}
+    if function == 'inverse_multiquadric':
+        function = 'inverse'
+
+    try:
+        return kernels[function]
+    except (KeyError, TypeError):
+        raise ValueError("can only differentiate the built-in Rbf functions, not {}".format(function))
+
+
+def evaluate_rbf_on_grid(rbfi, xi, yi, zi, out=None, max_block_bytes=256 * 2 ** 20, processes=None):
+    """
+    Evaluate a fitted 3D Rbf on the grid meshgrid(xi, yi, zi, indexing='ij') without ever holding more than
+    max_block_bytes of distance matrix per process.
+
+    Parameters
+    ----------
+    rbfi
+        fitted scipy.interpolate.Rbf with a built-in function and the euclidean norm
+    xi, yi, zi
+        1D grid axes
+    out
+        optional preallocated (len(xi), len(yi), len(zi)) array to write into, e.g. np.lib.format.open_memmap()
+    max_block_bytes
+        memory budget for the distance matrix of one block
+    processes
+        if > 1, evaluate blocks in parallel on this many processes
+
+    Returns
+    -------
+    out
+        (len(xi), len(yi), len(zi)) array of interpolated values
+    """
+    return _evaluate_on_grid(rbfi, xi, yi, zi, out, max_block_bytes, processes, gradient=False)
+
+
+def evaluate_rbf_gradient_on_grid(rbfi, xi, yi, zi, out=None, max_block_bytes=256 * 2 ** 20, processes=None):
+    """
+    Same as evaluate_rbf_on_grid(), for the analytic gradient of the Rbf
+
+    Returns
+    -------
+    out
+        (len(xi), len(yi), len(zi), 3) array of [d/dx, d/dy, d/dz]
+    """
+    return _evaluate_on_grid(rbfi, xi, yi, zi, out, max_block_bytes, processes, gradient=True)
+
+
+def evaluate_rbf_gradient(rbfi, positions, max_block_bytes=256 * 2 ** 20):
+    """
+    Analytic gradient of a fitted 3D Rbf at arbitrary positions, in blocks of bounded memory
+
+    Parameters
+    ----------
+    rbfi
+        fitted scipy.interpolate.Rbf with a built-in function and the euclidean norm
+    positions
+        [x, y, z] or (N, 3) array of positions
+
+    Returns
+    -------
+    gradient
+        [d/dx, d/dy, d/dz] or (N, 3) array
+    """
+    _check_rbf(rbfi, gradient=True)
+    positions = np.asarray(positions, dtype=float)
+    single = positions.ndim == 1
+    positions = np.atleast_2d(positions)
+
+    evaluator = _BlockEvaluator(rbfi.xi.T, rbfi.nodes, rbfi.function, rbfi.epsilon, None, gradient=True)
+    block_size = _block_size(rbfi, max_block_bytes)
+    gradients = np.empty((len(positions), 3))
+    for start in range(0, len(positions), block_size):
+        gradients[start:start + block_size] = evaluator.evaluate(positions[start:start + block_size])
+
+    return gradients[0] if single else gradients
+
+
+def _check_rbf(rbfi, gradient):
+    if rbfi.norm != 'euclidean':
+        raise ValueError("can only evaluate Rbfs with the euclidean norm in blocks, not {}".format(rbfi.norm))
+    # fail early on custom functions
+    if gradient:
+        rbf_kernel_derivative(rbfi.function, rbfi.epsilon)
+    else:
+        rbf_kernel(rbfi.function, rbfi.epsilon)
+
+
+def _block_size(rbfi, max_block_bytes):
+    """rows per block: the distance matrix and its kernel values are both alive during a block"""
+    n_nodes = rbfi.xi.shape[1]
+    return max(1, int(max_block_bytes // (2 * 8 * n_nodes)))
+
+
+def _evaluate_on_grid(rbfi, xi, yi, zi, out, max_block_bytes, processes, gradient):
+    _check_rbf(rbfi, gradient)
+
+    axes = (np.asarray(xi, dtype=float), np.asarray(yi, dtype=float), np.asarray(zi, dtype=float))
+    shape = tuple(len(axis) for axis in axes)
+    if gradient:
+        shape += (3,)
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError("out has shape {}, grid has shape {}".format(out.shape, shape))
+    elif not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous so that blocks can be written into it")
+    flat_out = out.reshape((-1, 3) if gradient else -1)  # a view, since out is contiguous
+
+    n_points = len(flat_out)
+    block_size = _block_size(rbfi, max_block_bytes)
+    blocks = [(start, min(start + block_size, n_points)) for start in range(0, n_points, block_size)]
+
+    evaluator_args = (rbfi.xi.T, rbfi.nodes, rbfi.function, rbfi.epsilon, axes, gradient)
+
+    if processes is not None and processes > 1:
+        pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=evaluator_args)
+        try:
+            for (start, stop), values in pool.imap_unordered(_evaluate_block_in_worker, blocks):
+                flat_out[start:stop] = values
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        evaluator = _BlockEvaluator(*evaluator_args)
+        for start, stop in blocks:
+            flat_out[start:stop] = evaluator(start, stop)
+
+    return out
+
+
+class _BlockEvaluator(object):
+    def __init__(self, centers, nodes, function, epsilon, axes, gradient=False):
+        self.centers = centers
+        self.nodes = nodes
+        self.axes = axes
+        self.shape = None if axes is None else tuple(len(axis) for axis in axes)
+
+        self.gradient = gradient
+        if gradient:
+            self.kernel = rbf_kernel_derivative(function, epsilon)
+            # nodes and nodes * c side by side, see the module docstring
+            self.weights = np.column_stack([nodes, nodes[:, np.newaxis] * centers])
+        else:
+            self.kernel = rbf_kernel(function, epsilon)
+
+    def points(self, start, stop):
+        """grid coordinates of flat grid indices start:stop, in meshgrid(indexing='ij').ravel() order"""
+        index = np.unravel_index(np.arange(start, stop), self.shape)
+        return np.column_stack([axis[i] for axis, i in zip(self.axes, index)])
+
+    def __call__(self, start, stop):
+        return self.evaluate(self.points(start, stop))
+
+    def evaluate(self, points):
+        k = self.kernel(cdist(points, self.centers))
+        if not self.gradient:
+            return np.dot(k, self.nodes)
+
+        weighted = np.dot(k, self.weights)
+        return points * weighted[:, :1] - weighted[:, 1:]
+
+
+# the evaluator living in each worker process, built by _init_worker()
+_worker_evaluator = None
+
+
+def _init_worker(*evaluator_args):
+    global _worker_evaluator
+    _worker_evaluator = _BlockEvaluator(*evaluator_args)
+
+
+def _evaluate_block_in_worker(block):
+    start, stop = block
+    return block, _worker_evaluator(start, stop)
@@ -0,0 +1,87 @@
+"""
+Lookups on fields sampled over a regular (meshgrid, indexing='ij') grid.
+
+Because the grid is regular, finding the cell a position falls in is plain index arithmetic: no kd-tree queries and no
+pandas row access. Positions outside the grid are clamped to its faces, which is what a nearest-neighbor query would
+give too.
+"""
+__author__ = 'richard'
+
+import numpy as np
+
+
+class RegularGridSampler(object):
+    def __init__(self, axes, fields):
+        """
+        Parameters
+        ----------
+        axes
+            (xi, yi, zi) evenly spaced, increasing 1D coordinate arrays
+        fields
+            dict of field name -> array of shape (len(xi), len(yi), len(zi))
+        """
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.shape = tuple(len(axis) for axis in self.axes)
+        if min(self.shape) < 2:
+            raise ValueError("need at least 2 grid points per dimension, got shape {}".format(self.shape))
+
+        self.origin = np.array([axis[0] for axis in self.axes])
+        self.spacing = np.array([(axis[-1] - axis[0]) / (len(axis) - 1) for axis in self.axes])
+        self._max_index = np.array(self.shape) - 1
+
+        # all fields side by side, so one fancy index fetches every requested field at once
+        self.field_names = list(fields.keys())
+        self._columns = {name: i for i, name in enumerate(self.field_names)}
+        self._values = np.empty((np.prod(self.shape), len(self.field_names)))
+        for name, field in fields.iteritems():
+            if field.shape != self.shape:
+                raise ValueError("field {} has shape {}, grid has shape {}".format(name, field.shape, self.shape))
+            self._values[:, self._columns[name]] = field.ravel()
+
+    def sample(self, positions, field_names, mode='nearest'):
+        """
+        Parameters
+        ----------
+        positions
+            [x, y, z] or (N, 3) array of positions
+        field_names
+            list of fields to look up
+        mode
+            'nearest' returns the value at the nearest grid point, 'trilinear' interpolates between the 8 surrounding
+            grid points
+
+        Returns
+        -------
+        values
+            (len(field_names),) array for a single position, (N, len(field_names)) array otherwise
+        """
+        positions = np.asarray(positions, dtype=float)
+        single = positions.ndim == 1
+        positions = np.atleast_2d(positions)
+        columns = [self._columns[name] for name in field_names]
+
+        # fractional grid index of every position, clamped to the grid
+        fractional_index = np.clip((positions - self.origin) / self.spacing, 0, self._max_index)
+
+        if mode == 'nearest':
+            index = np.rint(fractional_index).astype(int)
+            values = self._values[self._flat_index(index)][:, columns]
+        elif mode == 'trilinear':
+            lower = np.minimum(np.floor(fractional_index).astype(int), self._max_index - 1)
+            t = fractional_index - lower
+
+            values = np.zeros((len(positions), len(columns)))
+            for corner in np.ndindex(2, 2, 2):
+                corner = np.array(corner)
+                weight = np.prod(np.where(corner, t, 1 - t), axis=1)
+                values += weight[:, np.newaxis] * self._values[self._flat_index(lower + corner)][:, columns]
+        else:
+            raise ValueError("unknown sampling mode {}".format(mode))
+
+        if single:
+            values = values[0]
+
+        return values
+
+    def _flat_index(self, index):
+        return np.ravel_multi_index((index[:, 0], index[:, 1], index[:, 2]), self.shape)
@@ -1,9 +1,192 @@
 __author__ = 'richard'
 
+from collections import OrderedDict
+
 import numpy as np
-from scipy.stats import ks_2samp
+
+# reference kinematics shared by everything that scores in this process, see get_reference_data()
+REFERENCE_CACHE_SIZE = 4
+_reference_cache = OrderedDict()
+
+
+def get_reference_data(condition, trim_endzones=True):
+    """
+    Kinematics of the experimental ensemble of a condition, loaded once per process.
+
+    The least recently used ensemble is dropped once more than REFERENCE_CACHE_SIZE are cached.
+
+    Parameters
+    ----------
+    condition
+        Control, Left, or Right, or list thereof
+    trim_endzones
+        (bool) drop the rows near the ends of the windtunnel, see Observations.get_kinematic_dict()
+
+    Returns
+    -------
+    dict of kinematic -> sorted, read-only array. don't modify it, it is shared
+    """
+    if isinstance(condition, str):
+        key = ((condition,), trim_endzones)
+    else:
+        key = (tuple(condition), trim_endzones)
+
+    if key in _reference_cache:
+        reference_data = _reference_cache.pop(key)
+    else:
+        print "no reference data cached for {}; loading experimental data".format(condition)
+        reference_experiment = load_reference_ensemble(condition)
+        reference_data = {}
+        for kinematic, kinematic_array in \
+                reference_experiment.observations.get_kinematic_dict(trim_endzones=trim_endzones).iteritems():
+            reference_data[kinematic] = np.sort(kinematic_array)  # the KS statistic only needs the sorted samples
+            reference_data[kinematic].flags.writeable = False
+
+    _reference_cache[key] = reference_data  # (re)insert as most recently used
+    while len(_reference_cache) > REFERENCE_CACHE_SIZE:
+        _reference_cache.popitem(last=False)
+
+    return reference_data
+
+
+def clear_reference_cache():
+    _reference_cache.clear()
+
+
+def load_reference_ensemble(condition):
+    from roboskeeter import experiments  # imported here to avoid a circular import
+    return experiments.load_experiment(condition, optimizing=True)
 
 
+def ks_statistic(sorted_sample, sorted_reference):
+    """
+    Two-sample Kolmogorov-Smirnov statistic of two sorted arrays, the same D as scipy.stats.ks_2samp.
+
+    The supremum of |F_sample - F_reference| is reached on either side of a sample point, so it is enough to look up
+    where every sample point falls in the reference: O(m log n) for m sample and n reference points, no re-sorting
+    and no merge of the two arrays.
+    """
+    m, n = float(len(sorted_sample)), float(len(sorted_reference))
+    sample_left = np.searchsorted(sorted_sample, sorted_sample, side='left') / m
+    sample_right = np.searchsorted(sorted_sample, sorted_sample, side='right') / m
+    reference_left = np.searchsorted(sorted_reference, sorted_sample, side='left') / n
+    reference_right = np.searchsorted(sorted_reference, sorted_sample, side='right') / n
+
+    return max(np.max(np.abs(sample_left - reference_left)), np.max(np.abs(sample_right - reference_right)))
+
+
+def as_sorted(array):
+    """sorted version of array, without sorting again if it already is"""
+    array = np.asarray(array)
+    if len(array) < 2 or np.all(array[1:] >= array[:-1]):
+        return array
+    return np.sort(array)
+
+
+class KSScorer(object):
+    def __init__(self, reference_data, score_weights):
+        """
+        Weighted sum of KS statistics between a simulated ensemble and sorted reference kinematics.
+
+        The simulated samples are kept sorted too, so they can grow chunk by chunk through update() and be rescored
+        without sorting everything again.
+
+        Parameters
+        ----------
+        reference_data
+            dict of kinematic -> array. sorted once here, unless it already is (see get_reference_data())
+        score_weights
+            dict of kinematic -> weight
+        """
+        self.reference_data = {kinematic: as_sorted(array) for kinematic, array in reference_data.iteritems()}
+        self.score_weights = score_weights
+        self.target_data = {}
+        self._unsorted_chunks = []  # (target_data, trajectory_nums) as given to update(), for resampling
+
+    def update(self, target_data, trajectory_nums=None):
+        """
+        Add samples to the simulated ensemble.
+
+        Parameters
+        ----------
+        target_data
+            dict of kinematic -> array of new samples, e.g. from Observations.get_kinematic_dict()
+        trajectory_nums
+            optional array saying which trajectory every sample belongs to. needed by bootstrap_interval(). labels
+            must be unique across updates
+        """
+        for kinematic, kinematic_array in target_data.iteritems():
+            new_samples = np.sort(kinematic_array)
+            if kinematic not in self.target_data:
+                self.target_data[kinematic] = new_samples
+            else:  # merge two sorted arrays in linear time
+                old_samples = self.target_data[kinematic]
+                self.target_data[kinematic] = np.insert(old_samples,
+                                                        np.searchsorted(old_samples, new_samples, side='right'),
+                                                        new_samples)
+
+        if trajectory_nums is not None:
+            self._unsorted_chunks.append((target_data, np.asarray(trajectory_nums)))
+
+    def bootstrap_interval(self, n_resamples=100, confidence=0.95, random_state=None):
+        """
+        Confidence interval of the total score, from resampling whole trajectories with replacement (samples along a
+        trajectory are strongly correlated, so resampling single samples would make the interval far too narrow).
+
+        Parameters
+        ----------
+        n_resamples
+            (int) number of bootstrap resamples
+        confidence
+            (float) coverage of the interval
+        random_state
+            np.random.RandomState, or None to use the global numpy RNG
+
+        Returns
+        -------
+        (lower, upper) percentile interval of the total score
+        """
+        if not self._unsorted_chunks:
+            raise ValueError("no trajectory labels given to update(), can't resample trajectories")
+        if random_state is None:
+            random_state = np.random
+
+        kinematics = self._unsorted_chunks[0][0].keys()
+        trajectory_nums = np.concatenate([nums for _, nums in self._unsorted_chunks])
+        by_trajectory = np.argsort(trajectory_nums, kind='mergesort')
+        samples = {kinematic: np.concatenate([chunk[kinematic] for chunk, _ in self._unsorted_chunks])[by_trajectory]
+                   for kinematic in kinematics}
+
+        # rows of the i-th trajectory are starts[i]:starts[i] + lengths[i] of the regrouped samples
+        _, starts, lengths = np.unique(trajectory_nums[by_trajectory], return_index=True, return_counts=True)
+
+        scores = np.empty(n_resamples)
+        for i in range(n_resamples):
+            picked = random_state.randint(0, len(starts), size=len(starts))
+            picked_lengths = lengths[picked]
+            # row indices of the picked trajectories, back to back
+            rows = np.repeat(starts[picked] - np.cumsum(picked_lengths) + picked_lengths, picked_lengths) + \
+                np.arange(picked_lengths.sum())
+            scores[i] = sum(self.score_weights[kinematic] * ks_statistic(np.sort(samples[kinematic][rows]),
+                                                                         self.reference_data[kinematic])
+                            for kinematic in kinematics)
+
+        tail = 100. * (1 - confidence) / 2
+        return np.percentile(scores, tail), np.percentile(scores, 100. - tail)
+
+    def score(self):
+        """
+        Returns
+        -------
+        total score and score components of the samples seen so far
+        """
+        score_components = dict()
+        for kinematic, kinematic_array in self.target_data.iteritems():
+            score_components[kinematic] = self.score_weights[kinematic] * ks_statistic(kinematic_array,
+                                                                                       self.reference_data[kinematic])
+
+        return sum(score_components.values()), score_components
+
 
 class Scoring():
     def __init__(self,
@@ -13,9 +196,7 @@ class Scoring():
                  ):
         if reference_data is None:
             # when called from an experiment class, find out the relevant experiment from metadata, load that experiment, use as reference
-            print "no reference data provided; loading experimental data"
-            reference_experiment = self.load_reference_ensemble(target_experiment.experiment_conditions['condition'])
-            self.reference_data = reference_experiment.observations.get_kinematic_dict(trim_endzones=True)
+            self.reference_data = get_reference_data(target_experiment.experiment_conditions['condition'])
         else:
             self.reference_data = reference_data
 
@@ -33,19 +214,7 @@ class Scoring():
         -------
         total score and score components
         """
-        score_components = dict()
-        for kinematic, kinematic_array in self.target_data.iteritems():
-            ks_score, pval = ks_2samp(kinematic_array, self.reference_data[kinematic])
-            score_components[kinematic] = self.score_weights[kinematic] * ks_score
-
-        return sum(score_components.values()), score_components
+        scorer = KSScorer(self.reference_data, self.score_weights)
+        scorer.update(self.target_data)
 
-    def load_reference_ensemble(self, condition):
-        from roboskeeter import experiments
-        reference_experiment = experiments.load_experiment(experiment_conditions = {'condition': condition,
-                                 'plume_model': "None",  # "Boolean" "None, "Timeavg", "Unaveraged"
-                                 'time_max': "N/A (experiment)",
-                                 'bounded': True,
-                                 'optimizing': True
-                                 })
-        return reference_experiment
+        return scorer.score()
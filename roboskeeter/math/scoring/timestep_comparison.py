@@ -0,0 +1,105 @@
+"""
+Benchmark how far the simulated kinematic distributions drift from the dt = 0.01 s ones as the timestep grows, for
+both wall collision modes (see collisions.WallCollider) and a choice of integrators (see integrators).
+
+The reference is a dt = 0.01 s ensemble with Euler steps and teleporting walls, the way the model has always been
+simulated. Every (integrator, mode, dt) ensemble is simulated with a different seed than the reference, so the
+dt = 0.01 s euler teleport row is the sampling noise floor: a larger dt is as good as the reference if its KS statistics
+are about as small.
+
+Note the random force is held for a whole timestep, so at equal random_f_strength its impulse grows with dt.
+
+    python -m roboskeeter.math.scoring.timestep_comparison --n 200 --dt 0.01 0.02 0.03 0.05 --integrator euler exact
+"""
+__author__ = 'richard'
+
+import argparse
+import time
+
+from roboskeeter import experiments
+from roboskeeter.math.optimizers.optimizer import BASELINE_SIMULATION_CONDITIONS, baseline_agent_kwargs
+from roboskeeter.math.scoring.scoring import KSScorer, as_sorted
+
+KINEMATICS = ['velocity_x', 'velocity_y', 'velocity_z',
+              'acceleration_x', 'acceleration_y', 'acceleration_z',
+              'position_x', 'position_y', 'position_z',
+              'curvature']
+
+
+def simulate_kinematics(guess, n_trajectories, dt, wall_collision, seed, integrator='euler'):
+    """
+    Returns
+    -------
+    kinematic dict of the ensemble (endzones trimmed, like when scoring), and the wall-clock time of the simulation
+    """
+    agent_kwargs = baseline_agent_kwargs(guess)
+    agent_kwargs['dt'] = dt
+    agent_kwargs['wall_collision'] = wall_collision
+    agent_kwargs['integrator'] = integrator
+
+    start = time.time()
+    experiment = experiments.start_simulation(n_trajectories, agent_kwargs, dict(BASELINE_SIMULATION_CONDITIONS),
+                                              vectorized=True, seed=seed)
+    elapsed = time.time() - start
+
+    return experiment.observations.get_kinematic_dict(trim_endzones=True), elapsed
+
+
+def compare_timesteps(guess, n_trajectories=200, timesteps=(0.01, 0.02, 0.03, 0.05), modes=('teleport', 'reflect'),
+                      integrators=('euler',), seed=0):
+    """
+    Parameters
+    ----------
+    guess
+        [restitution, randomF, damping] of the baseline model
+    n_trajectories
+        size of every ensemble
+    timesteps
+        dt values to compare to the dt = 0.01 s reference
+    modes
+        wall collision modes
+    integrators
+        integrator names
+
+    Returns
+    -------
+    list of (integrator, mode, dt, seconds, {kinematic: KS statistic against the reference})
+    """
+    reference_kinematics, _ = simulate_kinematics(guess, n_trajectories, 0.01, 'teleport', seed)
+    reference_data = {kinematic: as_sorted(reference_kinematics[kinematic]) for kinematic in KINEMATICS}
+    unit_weights = {kinematic: 1 for kinematic in KINEMATICS}
+
+    results = []
+    for integrator in integrators:
+        for mode in modes:
+            for dt in timesteps:
+                kinematics, elapsed = simulate_kinematics(guess, n_trajectories, dt, mode, seed + 1, integrator)
+                scorer = KSScorer(reference_data, unit_weights)
+                scorer.update({kinematic: kinematics[kinematic] for kinematic in KINEMATICS})
+                _, ks_statistics = scorer.score()
+                results.append((integrator, mode, dt, elapsed, ks_statistics))
+
+    return results
+
+
+def print_results(results):
+    header = "{:>10} {:>9} {:>6} {:>8} ".format('integrator', 'walls', 'dt', 'seconds') + \
+             " ".join("{:>7}".format(kinematic.replace('velocity', 'v').replace('acceleration', 'a')
+                                     .replace('position', 'p')[:7]) for kinematic in KINEMATICS)
+    print header
+    for integrator, mode, dt, elapsed, ks_statistics in results:
+        print "{:>10} {:>9} {:>6.3f} {:>8.2f} ".format(integrator, mode, dt, elapsed) + \
+              " ".join("{:>7.3f}".format(ks_statistics[kinematic]) for kinematic in KINEMATICS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare kinematic distributions simulated at different timesteps")
+    parser.add_argument('--n', type=int, default=200, help="trajectories per ensemble")
+    parser.add_argument('--dt', type=float, nargs='+', default=[0.01, 0.02, 0.03, 0.05], help="timesteps (s)")
+    parser.add_argument('--guess', type=float, nargs=3, default=[0.1, 6.64725529e-06, 3.63417031e-07],
+                        help="restitution, randomF, damping")
+    parser.add_argument('--integrator', nargs='+', default=['euler'], help="euler, exact and/or heun")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print_results(compare_timesteps(args.guess, args.n, args.dt, integrators=args.integrator, seed=args.seed))
@@ -0,0 +1,170 @@
+__author__ = 'richard'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from roboskeeter.math.optimizers import optimizer
+from roboskeeter.math.optimizers.journal import EvaluationJournal
+from roboskeeter.math.optimizers.optimizer import FitBaselineModel
+
+GUESS = [0.1, 6.64725529e-06, 3.63417031e-07]
+CONFIG = {'simulation_conditions': {'condition': 'Control', 'bounded': True}, 'score_weights': {'curvature': 3}}
+COMPONENTS = {'curvature': 0.3}
+
+
+class _ResumedFit(FitBaselineModel):
+    """FitBaselineModel that doesn't start optimizing and has no reference data, enough to resume from a journal"""
+    def _load_reference_ensemble(self):
+        return {}
+
+    def run_optimization(self):
+        return None
+
+
+class TestEvaluationJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_within_rtol(self):
+        journal = EvaluationJournal(self.path, rtol=1e-6)
+        journal.record(GUESS, 0.5, COMPONENTS, n_trajectories=20, config=CONFIG)
+
+        close = np.array(GUESS) * (1 + 0.5e-6)
+        self.assertEqual(journal.lookup(close, n_trajectories=20, config=CONFIG)['score'], 0.5)
+        far = np.array(GUESS) * (1 + 2e-6)
+        self.assertIsNone(journal.lookup(far, n_trajectories=20, config=CONFIG))
+
+        # the latest of several matches
+        journal.record(GUESS, 0.4, COMPONENTS, n_trajectories=20, config=CONFIG)
+        self.assertEqual(journal.lookup(GUESS, n_trajectories=20, config=CONFIG)['score'], 0.4)
+
+    def test_select_excludes_truncated_and_other_runs(self):
+        journal = EvaluationJournal(self.path)
+        other_config = dict(CONFIG, score_weights={'curvature': 1})
+        journal.record([0.1, 1e-6, 1e-6], 0.5, COMPONENTS, n_trajectories=20, config=CONFIG)
+        journal.record([0.2, 1e-6, 1e-6], 0.1, COMPONENTS, n_trajectories=8, truncated=True, config=CONFIG)
+        journal.record([0.3, 1e-6, 1e-6], 0.2, COMPONENTS, n_trajectories=10, config=CONFIG)
+        journal.record([0.4, 1e-6, 1e-6], 0.3, COMPONENTS, n_trajectories=20, config=other_config)
+        journal.record([0.5, 1e-6, 1e-6], 0.6, COMPONENTS, n_trajectories=20, config=CONFIG)
+
+        selected = journal.select(n_trajectories=20, config=CONFIG)
+        self.assertEqual([entry['params'][0] for entry in selected], [0.1, 0.5])
+        self.assertEqual([entry['score'] for entry in journal.best(5, n_trajectories=20, config=CONFIG)], [0.5, 0.6])
+        self.assertEqual(len(journal.select()), 4)  # everything but the truncated one
+
+        for params in [[0.2, 1e-6, 1e-6], [0.3, 1e-6, 1e-6], [0.4, 1e-6, 1e-6]]:
+            self.assertIsNone(journal.lookup(params, n_trajectories=20, config=CONFIG))
+
+    def test_reload_with_truncated_last_line(self):
+        journal = EvaluationJournal(self.path)
+        journal.record(GUESS, 0.5, COMPONENTS, n_trajectories=20, config=CONFIG)
+        journal.record([0.2, 1e-6, 1e-6], 0.4, COMPONENTS, n_trajectories=20, config=CONFIG)
+        with open(self.path, 'a') as f:
+            f.write('{"params": [0.3, 1e-06')  # killed mid-write
+
+        journal = EvaluationJournal(self.path)
+        self.assertEqual([entry['score'] for entry in journal.entries], [0.5, 0.4])
+
+        # a record after the cut-off line survives the next load
+        journal.record([0.4, 1e-6, 1e-6], 0.3, COMPONENTS, n_trajectories=20, config=CONFIG)
+        self.assertEqual([entry['score'] for entry in EvaluationJournal(self.path).entries], [0.5, 0.4, 0.3])
+
+
+class TestResumeFromJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        model = _ResumedFit(GUESS, n_trajectories=20, journal_path=self.path)
+        self.assertIsNone(model.best_guess)  # nothing to resume from yet
+        self.assertEqual(model.iter_count, 0)
+        config = model.journal_config
+
+        journal = EvaluationJournal(self.path)
+        journal.record([0.3, 1e-6, 1e-6], 0.5, COMPONENTS, n_trajectories=20, config=config)
+        journal.record([0.4, 2e-6, 1e-6], 0.2, COMPONENTS, n_trajectories=20, config=config)
+        journal.record([0.5, 1e-6, 1e-6], 0.1, COMPONENTS, n_trajectories=10, truncated=True, config=config)
+        journal.record([0.6, 1e-6, 1e-6], 0.05, COMPONENTS, n_trajectories=10, config=config)
+
+        model = _ResumedFit(GUESS, n_trajectories=20, journal_path=self.path)
+        self.assertEqual(model.best_guess, [0.4, 2e-6, 1e-6])
+        self.assertEqual(model.best_score, 0.2)
+        self.assertEqual(model.initial_guess, [0.4, 2e-6, 1e-6])
+        self.assertEqual(model.iter_count, 4)
+
+        # a journaled guess is served without simulating it again
+        self.assertEqual(model.simulation_wrapper([0.3, 1e-6, 1e-6]), 0.5)
+        self.assertEqual(model.n_simulated, 0)
+
+        # a run at another n_trajectories starts from scratch
+        model = _ResumedFit(GUESS, n_trajectories=10, journal_path=self.path)
+        self.assertEqual(model.best_guess, [0.6, 1e-6, 1e-6])
+        model = _ResumedFit(GUESS, n_trajectories=40, journal_path=self.path)
+        self.assertIsNone(model.best_guess)
+        self.assertEqual(model.best_score, 1e10)
+
+
+def _fake_evaluate_guess(task):
+    """a cheap score instead of simulating the guess"""
+    guess, _ = task
+    return float(guess[0]), COMPONENTS
+
+
+def _interrupt(task):
+    raise KeyboardInterrupt
+
+
+class TestBayesianResult(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.jsonl')
+        self._evaluate_guess = optimizer._evaluate_guess
+
+    def tearDown(self):
+        optimizer._evaluate_guess = self._evaluate_guess
+        shutil.rmtree(self.directory)
+
+    def make_model(self):
+        model = _ResumedFit(GUESS, n_trajectories=20, method='bayesian', seed=0, journal_path=self.path)
+        model.n_initial_points, model.n_batches, model.surrogate_batch_size = 3, 1, 2
+        return model
+
+    def test_nfev_counts_this_run(self):
+        config = self.make_model().journal_config
+        journal = EvaluationJournal(self.path)
+        for restitution in [0.3, 0.4]:
+            journal.record([restitution, 1e-6, 1e-6], restitution, COMPONENTS, n_trajectories=20, config=config)
+
+        optimizer._evaluate_guess = _fake_evaluate_guess
+        result = self.make_model()._run_bayesian_optimization()
+        self.assertTrue(result.success)
+        self.assertEqual(result.nfev, 5)  # 3 initial points and a batch of 2, not the 2 journaled entries
+        self.assertEqual(len(EvaluationJournal(self.path)), 7)
+        self.assertEqual(result.fun, result.x[0])
+
+    def test_interrupted_before_any_evaluation(self):
+        optimizer._evaluate_guess = _interrupt
+        result = self.make_model()._run_bayesian_optimization()
+        self.assertFalse(result.success)
+        self.assertIsNone(result.x)
+        self.assertEqual(result.nfev, 0)
+        self.assertTrue(result.message)
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, _ResumedFit, GUESS, method='annealing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+from scipy.interpolate import Rbf
+
+from roboskeeter.math.rbf_evaluation import evaluate_rbf_gradient, evaluate_rbf_gradient_on_grid, \
+    evaluate_rbf_on_grid
+
+FUNCTIONS = ['multiquadric', 'inverse', 'gaussian', 'linear', 'cubic', 'quintic', 'thin_plate']
+SMALL_BLOCKS = 50 * 2 * 8 * 40  # 50 rows per block for 40 nodes, so every grid below takes several blocks
+
+
+def fit_rbf(function, random_state):
+    nodes = random_state.rand(40, 3)
+    values = np.sin(3 * nodes[:, 0]) + nodes[:, 1] * nodes[:, 2]
+    # quintic with smoothing, like TimeAvgPlume
+    smooth = 2e-5 if function == 'quintic' else 0.
+    return Rbf(nodes[:, 0], nodes[:, 1], nodes[:, 2], values, function=function, smooth=smooth)
+
+
+class TestRbfEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.xi, self.yi, self.zi = np.linspace(0, 1, 9), np.linspace(-0.1, 1.1, 7), np.linspace(0.2, 0.8, 5)
+
+    def test_blocks_match_rbf_call(self):
+        grid = np.meshgrid(self.xi, self.yi, self.zi, indexing='ij')
+        for function in FUNCTIONS:
+            rbfi = fit_rbf(function, self.random_state)
+            expected = rbfi(*grid)
+
+            np.testing.assert_allclose(evaluate_rbf_on_grid(rbfi, self.xi, self.yi, self.zi,
+                                                            max_block_bytes=SMALL_BLOCKS),
+                                       expected, rtol=1e-10, atol=1e-10, err_msg=function)
+
+            out = np.empty(expected.shape)
+            evaluate_rbf_on_grid(rbfi, self.xi, self.yi, self.zi, out=out, max_block_bytes=SMALL_BLOCKS)
+            np.testing.assert_allclose(out, expected, rtol=1e-10, atol=1e-10, err_msg=function)
+
+    def test_worker_pool_matches_serial(self):
+        rbfi = fit_rbf('quintic', self.random_state)
+        serial = evaluate_rbf_on_grid(rbfi, self.xi, self.yi, self.zi, max_block_bytes=SMALL_BLOCKS)
+        parallel = evaluate_rbf_on_grid(rbfi, self.xi, self.yi, self.zi, max_block_bytes=SMALL_BLOCKS, processes=2)
+        np.testing.assert_array_equal(parallel, serial)
+
+        serial = evaluate_rbf_gradient_on_grid(rbfi, self.xi, self.yi, self.zi, max_block_bytes=SMALL_BLOCKS)
+        parallel = evaluate_rbf_gradient_on_grid(rbfi, self.xi, self.yi, self.zi, max_block_bytes=SMALL_BLOCKS,
+                                                 processes=2)
+        np.testing.assert_array_equal(parallel, serial)
+
+    def test_gradient_matches_central_differences(self):
+        positions = self.random_state.uniform(0.1, 0.9, (30, 3))
+        h = 1e-5
+        for function in FUNCTIONS:
+            rbfi = fit_rbf(function, self.random_state)
+
+            expected = np.empty_like(positions)
+            for dim in range(3):
+                step = np.zeros(3)
+                step[dim] = h
+                forward, backward = positions + step, positions - step
+                expected[:, dim] = (rbfi(*forward.T) - rbfi(*backward.T)) / (2 * h)
+
+            gradients = evaluate_rbf_gradient(rbfi, positions, max_block_bytes=SMALL_BLOCKS)
+            np.testing.assert_allclose(gradients, expected, rtol=1e-5, atol=1e-6 * np.abs(expected).max(),
+                                       err_msg=function)
+            np.testing.assert_allclose(evaluate_rbf_gradient(rbfi, positions[0]), gradients[0], rtol=1e-12)
+
+    def test_gradient_on_grid(self):
+        """what TimeAvgPlume precomputes with gradient_method='analytic'"""
+        rbfi = fit_rbf('quintic', self.random_state)
+        grid = np.meshgrid(self.xi, self.yi, self.zi, indexing='ij')
+        points = np.column_stack([axis.ravel() for axis in grid])
+
+        gradients = evaluate_rbf_gradient_on_grid(rbfi, self.xi, self.yi, self.zi, max_block_bytes=SMALL_BLOCKS)
+        self.assertEqual(gradients.shape, (len(self.xi), len(self.yi), len(self.zi), 3))
+        np.testing.assert_allclose(gradients.reshape(-1, 3), evaluate_rbf_gradient(rbfi, points), rtol=1e-12,
+                                   atol=1e-12)
+
+        # and the finite difference gradient of the interpolated grid converges to it as the grid gets finer
+        xi, yi, zi = np.linspace(0.4, 0.6, 41), np.linspace(0.4, 0.6, 41), np.linspace(0.4, 0.6, 41)
+        temperatures = evaluate_rbf_on_grid(rbfi, xi, yi, zi)
+        finite_difference = np.stack(np.gradient(temperatures, xi[1] - xi[0], yi[1] - yi[0], zi[1] - zi[0]), axis=-1)
+        analytic = evaluate_rbf_gradient_on_grid(rbfi, xi, yi, zi)
+        interior = (slice(1, -1),) * 3
+        np.testing.assert_allclose(finite_difference[interior], analytic[interior], rtol=1e-3,
+                                   atol=1e-4 * np.abs(analytic).max())
+
+    def test_rejects_custom_functions(self):
+        rbfi = fit_rbf('quintic', self.random_state)
+        rbfi.function = lambda self, r: r ** 2
+        self.assertRaises(ValueError, evaluate_rbf_on_grid, rbfi, self.xi, self.yi, self.zi)
+        self.assertRaises(ValueError, evaluate_rbf_gradient, rbfi, [0.5, 0.5, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+
+from roboskeeter.math.regular_grid import RegularGridSampler
+
+
+class TestRegularGridSampler(unittest.TestCase):
+    def setUp(self):
+        self.axes = [np.linspace(-0.1, 1., 12), np.linspace(-0.127, 0.127, 7), np.linspace(0., 0.254, 5)]
+        grid = np.meshgrid(*self.axes, indexing='ij')
+        self.random_state = np.random.RandomState(0)
+        self.fields = {'random': self.random_state.randn(*grid[0].shape),
+                       'linear': 2. * grid[0] - 3. * grid[1] + 0.5 * grid[2] + 1.}
+        self.sampler = RegularGridSampler(self.axes, self.fields)
+        self.lower = np.array([axis[0] for axis in self.axes])
+        self.upper = np.array([axis[-1] for axis in self.axes])
+
+    def test_nearest_is_index_lookup(self):
+        # on the nodes, and jittered by less than half a cell
+        index = np.column_stack([self.random_state.randint(0, len(axis), 200) for axis in self.axes])
+        nodes = np.column_stack([axis[index[:, dim]] for dim, axis in enumerate(self.axes)])
+        jitter = self.random_state.uniform(-0.49, 0.49, nodes.shape) * self.sampler.spacing
+        expected = self.fields['random'][index[:, 0], index[:, 1], index[:, 2]]
+
+        for positions in [nodes, np.clip(nodes + jitter, self.lower, self.upper)]:
+            values = self.sampler.sample(positions, ['random', 'linear'])
+            np.testing.assert_array_equal(values[:, 0], expected)
+        np.testing.assert_array_equal(self.sampler.sample(nodes[0], ['random']), expected[:1])
+
+    def test_trilinear_exact_for_linear_field(self):
+        positions = self.random_state.uniform(self.lower, self.upper, (500, 3))
+        expected = 2. * positions[:, 0] - 3. * positions[:, 1] + 0.5 * positions[:, 2] + 1.
+        values = self.sampler.sample(positions, ['linear'], mode='trilinear')
+        np.testing.assert_allclose(values[:, 0], expected, rtol=0, atol=1e-12)
+
+        # the upper faces, where the cell index is clamped to the last cell
+        values = self.sampler.sample(self.upper, ['linear'], mode='trilinear')
+        self.assertAlmostEqual(values[0], 2. * self.upper[0] - 3. * self.upper[1] + 0.5 * self.upper[2] + 1., 12)
+
+    def test_out_of_bounds_clamped(self):
+        """positions outside the grid get the value on the nearest face, in both modes"""
+        inside = self.random_state.uniform(self.lower, self.upper, (100, 3))
+        outside = inside.copy()
+        dims = self.random_state.randint(0, 3, 100)
+        below = self.random_state.rand(100) < 0.5
+        outside[np.arange(100), dims] = np.where(below, self.lower[dims] - 5., self.upper[dims] + 5.)
+        clamped = np.clip(outside, self.lower, self.upper)
+
+        for mode in ['nearest', 'trilinear']:
+            np.testing.assert_array_equal(self.sampler.sample(outside, ['random', 'linear'], mode=mode),
+                                          self.sampler.sample(clamped, ['random', 'linear'], mode=mode))
+
+    def test_bad_input(self):
+        self.assertRaises(ValueError, self.sampler.sample, [0.5, 0., 0.1], ['linear'], mode='cubic')
+        self.assertRaises(ValueError, RegularGridSampler, self.axes, {'wrong': np.zeros((3, 3, 3))})
+        self.assertRaises(ValueError, RegularGridSampler, [self.axes[0], [0.], self.axes[2]], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
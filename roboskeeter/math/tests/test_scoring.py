@@ -0,0 +1,111 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+from scipy.stats import ks_2samp
+
+from roboskeeter import experiments
+from roboskeeter.math.optimizers.optimizer import BASELINE_SIMULATION_CONDITIONS, FitBaselineModel, \
+    baseline_agent_kwargs
+from roboskeeter.math.scoring.scoring import KSScorer, ks_statistic
+
+GUESS = [0.1, 6.64725529e-06, 3.63417031e-07]
+
+
+class TestKSStatistic(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def assertMatchesScipy(self, sample, reference):
+        self.assertAlmostEqual(ks_statistic(np.sort(sample), np.sort(reference)), ks_2samp(sample, reference)[0],
+                               places=12)
+
+    def test_continuous(self):
+        for m, n in [(100, 100), (37, 500), (1000, 13)]:
+            self.assertMatchesScipy(self.random_state.randn(m), self.random_state.randn(n) + 0.3)
+
+    def test_ties(self):
+        for m, n in [(200, 200), (50, 731), (900, 20)]:
+            self.assertMatchesScipy(np.round(self.random_state.randn(m), 1), np.round(self.random_state.randn(n), 1))
+            self.assertMatchesScipy(self.random_state.randint(0, 5, m), self.random_state.randint(0, 7, n))
+
+    def test_extremes(self):
+        sample = self.random_state.rand(50)
+        self.assertEqual(ks_statistic(np.sort(sample), np.sort(sample)), 0.)
+        self.assertEqual(ks_statistic(np.sort(sample), np.sort(sample) + 2.), 1.)
+
+
+class TestKSScorer(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(1)
+        self.reference_data = {'a': random_state.randn(300), 'b': random_state.rand(200)}
+        self.target_data = {'a': random_state.randn(250) + 0.2, 'b': random_state.rand(120) * 1.1}
+        self.trajectory_nums = np.repeat(np.arange(10), 25)  # 10 trajectories of 25 samples
+        self.score_weights = {'a': 1, 'b': 3}
+
+    def test_score(self):
+        scorer = KSScorer(self.reference_data, self.score_weights)
+        scorer.update(self.target_data)
+        score, score_components = scorer.score()
+
+        for kinematic, weight in self.score_weights.iteritems():
+            self.assertAlmostEqual(score_components[kinematic],
+                                   weight * ks_2samp(self.target_data[kinematic], self.reference_data[kinematic])[0],
+                                   places=12)
+        self.assertAlmostEqual(score, sum(score_components.values()), places=12)
+
+    def test_incremental_update(self):
+        whole = KSScorer(self.reference_data, self.score_weights)
+        whole.update(self.target_data)
+
+        chunked = KSScorer(self.reference_data, self.score_weights)
+        for chunk in [slice(0, 40), slice(40, 41), slice(41, None)]:
+            chunked.update({kinematic: array[chunk] for kinematic, array in self.target_data.iteritems()})
+
+        for kinematic in self.score_weights:
+            np.testing.assert_array_equal(chunked.target_data[kinematic], whole.target_data[kinematic])
+        self.assertEqual(chunked.score(), whole.score())
+
+    def test_bootstrap_interval(self):
+        scorer = KSScorer({'a': self.reference_data['a']}, {'a': 1})
+        scorer.update({'a': self.target_data['a']}, self.trajectory_nums)
+
+        lower, upper = scorer.bootstrap_interval(n_resamples=200, random_state=np.random.RandomState(2))
+        self.assertLessEqual(lower, upper)
+        self.assertEqual((lower, upper), scorer.bootstrap_interval(n_resamples=200,
+                                                                   random_state=np.random.RandomState(2)))
+
+    def test_bootstrap_needs_trajectory_nums(self):
+        scorer = KSScorer(self.reference_data, self.score_weights)
+        scorer.update(self.target_data)
+        self.assertRaises(ValueError, scorer.bootstrap_interval)
+
+
+class _SequentialFit(FitBaselineModel):
+    """FitBaselineModel that doesn't start optimizing, scored against a small simulated reference ensemble"""
+    def _load_reference_ensemble(self):
+        experiment = experiments.start_simulation(10, baseline_agent_kwargs(GUESS),
+                                                  dict(BASELINE_SIMULATION_CONDITIONS), vectorized=True, seed=0)
+        return experiment.observations.get_kinematic_dict(trim_endzones=False)
+
+    def run_optimization(self):
+        return None
+
+
+class TestSequentialEarlyStopping(unittest.TestCase):
+    def setUp(self):
+        self.model = _SequentialFit(GUESS, n_trajectories=20, sequential=True, batch_size=4, journal_path=None)
+
+    def test_stops_once_interval_is_above_best_score(self):
+        self.model.best_score = 0.  # nothing beats this, so the guess is dropped as soon as the bootstrap may judge
+        self.model.simulation_wrapper(GUESS)
+        self.assertEqual(self.model.n_simulated, self.model.min_batches * self.model.batch_size)
+
+    def test_runs_every_batch_while_it_could_be_best(self):
+        self.model.simulation_wrapper(GUESS)
+        self.assertEqual(self.model.n_simulated, self.model.n_trajectories)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,8 +13,29 @@ from roboskeeter.io import i_o
 
 
 class Observations(object):
-    def __init__(self):
-        self.kinematics = pd.DataFrame()
+    def __init__(self, trajectory_store=None):
+        """
+        Parameters
+        ----------
+        trajectory_store
+            (TrajectoryStore, optional) simulated ensemble. The kinematics DataFrame is only built from it when it is
+            first used, and the store is dropped then so that the ensemble isn't held twice
+        """
+        self._kinematics = pd.DataFrame() if trajectory_store is None else None
+        self.trajectory_store = trajectory_store
+        self.wall_crashes = None  # number of collisions with each wall, for simulations
+
+    @property
+    def kinematics(self):
+        if self._kinematics is None:
+            self._kinematics = self.trajectory_store.to_dataframe()
+            self.trajectory_store = None
+        return self._kinematics
+
+    @kinematics.setter
+    def kinematics(self, dataframe):
+        self._kinematics = dataframe
+        self.trajectory_store = None
 
     def concat_df_list(self, dataframe_list):
         """
@@ -95,6 +116,14 @@ class Observations(object):
 
         return dict
 
+    def get_trajectory_num_array(self, trim_endzones=False):
+        """trajectory number of every row, aligned with the arrays of get_kinematic_dict()"""
+        if trim_endzones:
+            kinematics = self._trim_df_endzones()
+        else:
+            kinematics = self.kinematics
+        return kinematics['trajectory_num'].values
+
     def get_starting_positions(self):
         positions_at_timestep_0 = self.kinematics.loc[(self.kinematics.tsi == 0), ['position_x', 'position_y', 'position_z']]
         return positions_at_timestep_0
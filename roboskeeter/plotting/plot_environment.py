@@ -148,28 +148,41 @@ def plot_plume_recordings_scatter(plume_data, ax, temp_thresh):
     ax.scatter(plume_data.x, plume_data.y, plume_data.z, c=plume_data.avg_temp, cmap='Oranges', lw=0)
 
 
-def plot_plume_gradient(plume, ax, thresh, skipevery = 6):  # TODO: plot inside windtunnel as in draw_bool_plume
+# TODO: plot inside windtunnel as in draw_bool_plume
+def plot_plume_gradient(plume, ax, thresh, skipevery = 6, resolution=(50, 15, 15), time=0.):
     """
     Plot a quiverplot of the gradient
     Parameters
     ----------
     plume
-        (gradient plume object)
+        (plume object)
     thresh
         (float)
         filters out plotting of gradient arrows smaller than this threshold
+    resolution
+        number of x, y, z points to sample the gradient at
+    time
+        simulation time (s) of the gradient, for time-resolved plumes
     """
-
-    filtered = plume.data[plume.data.gradient_norm > thresh]
+    downwind, upwind, left, right, floor, ceiling = plume.bounds
+    grid = np.meshgrid(np.linspace(downwind, upwind, resolution[0]),
+                       np.linspace(left, right, resolution[1]),
+                       np.linspace(floor, ceiling, resolution[2]), indexing='ij')
+    positions = np.column_stack([axis.ravel() for axis in grid])
+    gradients = plume.gradients(positions, time)
+
+    keep = np.sqrt(np.sum(gradients * gradients, axis=1)) > thresh
+    positions, gradients = positions[keep], gradients[keep]
     if skipevery != 0:
-        filtered = filtered[::skipevery]
+        positions, gradients = positions[::skipevery], gradients[::skipevery]
 
-    ax.quiver(filtered.x, filtered.y, filtered.z, filtered.gradient_x, filtered.gradient_y, filtered.gradient_z, length=0.01)
+    ax.quiver(positions[:, 0], positions[:, 1], positions[:, 2], gradients[:, 0], gradients[:, 1], gradients[:, 2],
+              length=0.01)
     # ax.set_xlim3d(0, 1)
     # ax.set_ylim3d(-0.127, 0.127)
     # ax.set_zlim3d(0, 0.254)
 
-    plt.title("Temperature gradient of interpolated time-averaged thermocouple recordings")
+    plt.title("Temperature gradient of the {} plume".format(plume.plume_model))
     plt.xlabel("Upwind/downwind")
     plt.ylabel("Crosswind")
     plt.clabel("Elevation")
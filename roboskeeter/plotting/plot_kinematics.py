@@ -14,7 +14,6 @@ from math import ceil
 
 from custom_color import colormaps  # custom color maps
 from roboskeeter.io import i_o
-from roboskeeter.math import math_toolbox
 
 # plotting stuff
 import matplotlib.gridspec as gridspec
@@ -914,10 +913,7 @@ def plot_all_force_clouds(experiment):
         ax = fig.add_subplot(111, projection='3d')
 
         Npoints = 1000
-        data = np.zeros((Npoints, 3))
-
-        for point in range(Npoints):
-            data[point] = math_toolbox.gen_symm_vecs(3)
+        data = experiment.agent.flight.unit_vectors.draw(Npoints)  # the directions the agent draws from
 
         x = data[:, 0]
         y = data[:, 1]
@@ -1022,18 +1018,8 @@ def plot_score_comparison(experiment, reference_vals=None, show_score=False):
 
     if reference_vals is None:
         # get reference data if None is given to func. if anything string is passed instead, we won't plot reference data
-        def load_reference_vals(condition):
-            from roboskeeter import experiments
-            reference_experiment = experiments.load_experiment(experiment_conditions = {'condition': condition,
-                                     'plume_model': "None",  # "Boolean" "None, "Timeavg", "Unaveraged"
-                                     'time_max': "N/A (experiment)",
-                                     'bounded': True,
-                                     'optimizing': True
-                                     })
-            return reference_experiment.observations.get_kinematic_dict(trim_endzones=True)
-
-
-        reference_vals = load_reference_vals(experiment.experiment_conditions['condition'])
+        from roboskeeter.math.scoring.scoring import get_reference_data
+        reference_vals = get_reference_data(experiment.experiment_conditions['condition'])
     target_vals = experiment.observations.get_kinematic_dict(trim_endzones=True)
 
     titleappend, _, _ = get_agent_info(experiment)
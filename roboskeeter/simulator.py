@@ -9,12 +9,28 @@ TODO: implemement unit tests with nose
 
 import sys
 import numpy as np
-import pandas as pd
+from collisions import WallCollider
 from flight import Flight
-from decisions import Decisions
+from integrators import make_integrator
+from decisions import Decisions, DECISION_CODES, plume_signal_code
 from observations import Observations
-from random import choice as choose
-from roboskeeter.math.math_toolbox import gen_symm_vecs
+from simulator_pool import fly_parallel
+from trajectory_store import TrajectoryStore, simulation_columns
+from roboskeeter.math.math_toolbox import UnitVectorSampler, gen_symm_vecs
+
+
+# agent kwargs that may be left out, and their defaults
+AGENT_KWARG_DEFAULTS = {'dt': 0.01,  # timestep (s)
+                        'wall_collision': 'teleport',  # 'teleport' or 'reflect', see collisions.WallCollider
+                        'integrator': 'euler',  # 'euler', 'exact' or 'heun', see integrators
+                        'kinematics_dtype': 'float64'  # precision the trajectories are stored at, e.g. 'float32'
+                        }
+
+
+def trajectory_random_state(seed, trajectory_num):
+    """the random stream of one trajectory: same seed and trajectory number, same noise"""
+    return np.random.RandomState([seed, trajectory_num])
+
 
 class Simulator:
     """Our simulated mosquito.
@@ -24,6 +40,9 @@ class Simulator:
         """ Load params
         """
         # dump kwarg dictionary into the agent object
+        self.agent_kwargs = agent_kwargs
+        for key, value in AGENT_KWARG_DEFAULTS.iteritems():
+            setattr(self, key, value)
         for key, value in agent_kwargs.iteritems():
             setattr(self, key, value)
 
@@ -36,7 +55,6 @@ class Simulator:
         # defaults
         self.mass = 2.88e-6  # avg. mass of our colony (kg) =2.88 mg,
         self.time_max = 15.
-        self.dt = 0.01
         self.max_bins = int(np.ceil(self.time_max / self.dt))  # N bins
 
         # from gassian fit to experimental control data
@@ -60,6 +78,11 @@ class Simulator:
                              self.stim_f_strength,
                              self.damping_coeff)
 
+        self.stepper = make_integrator(self.integrator, self.mass, self.damping_coeff, self.dt)
+
+        self.collider = WallCollider(self.windtunnel.walls, self.collision_type, self.restitution_coeff,
+                                     mode=self.wall_collision)
+
         # turn thresh, in units deg s-1.
         # From Sharri:
         # it is the stdev of the broader of two Gaussians that fit the distribution of angular velocity
@@ -67,10 +90,45 @@ class Simulator:
         # # create repulsion landscape
         # self._repulsion_funcs = repulsion_landscape3D.landscape(boundary=self.boundary)
 
-    def fly(self, n_trajectories=1):
+    def fly(self, n_trajectories=1, vectorized=False, workers=None, seed=None, first_trajectory_num=0,
+            pregenerate_random=False):
         """ runs _generate_flight n_trajectories times
+
+        Parameters
+        ----------
+        n_trajectories
+            (int) number of flights to simulate
+        vectorized
+            (bool) if True, step all n_trajectories at once with _generate_ensemble instead of looping over
+            _generate_flight. Gives the same results in distribution, but is much faster for big ensembles.
+        workers
+            (int or None) if > 1, spread the trajectories across a pool of this many processes
+        seed
+            (int or None) if given, every trajectory draws its initial position, initial velocity and random forces
+            from its own stream, seeded with (seed, trajectory number). A trajectory then comes out the same whether
+            it is flown alone, vectorized or on a worker, and agents flown with the same seed see the same noise
+            (common random numbers). If None, everything is drawn from the global numpy RNG.
+        first_trajectory_num
+            (int) trajectory number of the first flight, which picks the random streams. used by fly_parallel()
+        pregenerate_random
+            (bool) vectorized only. draw the random force directions of the whole ensemble as one block before
+            integrating, instead of once per timestep. always done when seed is given
         """
-        df_list = []
+        if workers is not None and workers > 1:
+            return fly_parallel(self, n_trajectories, workers, vectorized=vectorized, seed=seed)
+
+        self.collider.reset_diagnostics()
+
+        if seed is None:
+            random_states = None
+        else:
+            random_states = [trajectory_random_state(seed, first_trajectory_num + i) for i in range(n_trajectories)]
+
+        if vectorized:
+            return self._fly_ensemble(n_trajectories, random_states=random_states,
+                                      pregenerate_random=pregenerate_random)
+
+        store = TrajectoryStore(columns=self.store_columns(), capacity=n_trajectories * self.max_bins)
         traj_i = 0
         try:
             if self.verbose:
@@ -85,20 +143,13 @@ class Simulator:
                     sys.stdout.write("\rTrajectory {}/{}".format(traj_i + 1, n_trajectories))
                     sys.stdout.flush()
 
-                array_dict = self._generate_flight()
+                vector_dict = self._generate_flight(random_state=None if seed is None else random_states[traj_i])
 
                 # if len(array_dict['velocity_x']) < 5:  # hack to catch when optimizer makes trajectories explode
                 #     print "catching explosion"
                 #     break
 
-                # add label column to enumerate the trajectories
-                array_len = len(array_dict['tsi'])
-                array_dict['trajectory_num'] = [traj_i] * array_len
-
-                # mk df, add to list of dfs
-                df = pd.DataFrame(array_dict)
-                # df = df.set_index(['trajectory_num'])
-                df_list.append(df)
+                store.append(traj_i, vector_dict)
 
                 traj_i += 1
 
@@ -111,17 +162,45 @@ class Simulator:
             print "\n Simulations interrupted at iteration {}. Moving along...".format(traj_i)
             pass
 
-        observations = Observations()
-        observations.kinematics = pd.concat(df_list)  # concatenate all the data frames at once for performance boost.
+        return self._store_to_observations(store)
+
+    def _fly_ensemble(self, n_trajectories, random_states=None, pregenerate_random=False):
+        """ runs _generate_ensemble once for all n_trajectories, then splits the ensemble into trajectories
+        """
+        if self.verbose:
+            print """Starting vectorized simulation of {} trajectories with {} plume model and {} decision
+            policy.""".format(n_trajectories, self.plume.plume_model, self.decision_policy)
+
+        vector_dict, n_bins = self._generate_ensemble(n_trajectories, random_states=random_states,
+                                                      pregenerate_random=pregenerate_random)
+
+        store = TrajectoryStore(columns=self.store_columns(), capacity=n_bins.sum())
+        for traj_i in range(n_trajectories):
+            store.append(traj_i, {k: array[:n_bins[traj_i], traj_i] for k, array in vector_dict.iteritems()})
+
+        if self.verbose:
+            sys.stdout.write("\rSimulations finished. Performing deep magic.")
+            sys.stdout.flush()
+
+        return self._store_to_observations(store)
+
+    def store_columns(self):
+        """columns of the TrajectoryStore the flights are saved in"""
+        return simulation_columns(np.dtype(self.kinematics_dtype))
+
+    def _store_to_observations(self, store):
+        observations = Observations(trajectory_store=store)
+        observations.wall_crashes = self.collider.crash_count_dict()
 
         return observations
 
-    def _generate_flight(self):
+    def _generate_flight(self, random_state=None):
         """Generate a single trajectory using our model.
     
         First put everything into np arrays stored inside of a dictionary
+
+        random_state is the np.random.RandomState of this trajectory, or None to use the global numpy RNG
         """
-        dt = self.dt
         m = self.mass
         vector_dict = self._initialize_vector_dict()
 
@@ -139,18 +218,31 @@ class Simulator:
         total_f = vector_dict['total_f']
         decision = vector_dict['decision']
 
-        position[0] = self._set_init_position()
-        velocity[0] = self._set_init_velocity()
+        position[0] = self._set_init_position(random_state)
+        velocity[0] = self._set_init_velocity(random_state)
+
+        # decision state (e.g. when we last saw the plume) must not carry over from the previous flight
+        decisions = Decisions(self.decision_policy, self.stimulus_memory_n_timesteps)
+
+        if random_state is None:
+            random_directions = None  # the flight's own sampler
+        else:  # the same block of directions _generate_ensemble() draws from this random state
+            random_directions = UnitVectorSampler(3, block_size=self.max_bins, random_state=random_state)
 
         for tsi in vector_dict['tsi']:
-            in_plume[tsi] = self.plume.check_in_plume_bounds(position[tsi])  # returns False for non-Bool plume
+            time = tsi * self.dt
+            in_plume[tsi] = self.plume.check_in_plume_bounds(position[tsi], time)
+
+            current_decision, current_signal = decisions.make_decision(in_plume[tsi], velocity[tsi][1])
 
-            decision[tsi], plume_signal[tsi] = self.decisions.make_decision(in_plume[tsi], velocity[tsi][1])
+            if decisions.needs_gradient:
+                current_signal = self.plume.get_nearest_gradient(position[tsi], time)
 
-            if plume_signal[tsi] == 'X':  # this is an awful hack telling us to look up the gradient
-                plume_signal[tsi] = self.plume.get_nearest_gradient(position[tsi])
+            stim_f[tsi], random_f[tsi], total_f[tsi] = self.flight.calc_forces(velocity[tsi], current_decision, current_signal,
+                                                                                sampler=random_directions)
 
-            stim_f[tsi], random_f[tsi], total_f[tsi] = self.flight.calc_forces(velocity[tsi], decision[tsi], plume_signal[tsi])
+            decision[tsi] = DECISION_CODES[current_decision]
+            plume_signal[tsi] = plume_signal_code(current_signal)
 
             # calculate current acceleration
             acceleration[tsi] = total_f[tsi] / m
@@ -163,28 +255,123 @@ class Simulator:
             ################################################
             # Calculate candidate velocity and positions
             ################################################
-            candidate_velo = velocity[tsi] + acceleration[tsi] * dt
-
-            # make sure velocity doesn't diverge to infinity if system is unstable
-            # this stops the optimizer from crashing
-            candidate_velo = self._velocity_ceiling(candidate_velo)
-
-            candidate_pos = position[tsi] + candidate_velo * dt
+            candidate_pos, candidate_velo = self.stepper.step(position[tsi], velocity[tsi], acceleration[tsi])
 
             ################################################
             # test candidates
             ################################################
             if self.bounded:
-                candidate_pos, candidate_velo = self._collide_with_wall(candidate_pos, candidate_velo)
+                candidate_pos, candidate_velo = self.collider.collide(candidate_pos, candidate_velo)
 
             position[tsi + 1] = candidate_pos
             velocity[tsi + 1] = candidate_velo
 
-        # once flight is finished, make dictionary ready to be loaded into DF
-        vector_dict = self._fix_vector_dict(vector_dict)
-
         return vector_dict
 
+    def _generate_ensemble(self, n_trajectories, random_states=None, pregenerate_random=False):
+        """Generate n_trajectories at once using our model.
+
+        Same model as _generate_flight, but every timestep is solved for the whole ensemble at once: vectors are
+        stored as (max_bins, N, 3) arrays, and there is one random force draw and one wall collision pass per
+        timestep. Agents that have landed are masked out of the update instead of being removed from the arrays.
+
+        Parameters
+        ----------
+        n_trajectories
+            (int) ensemble size
+        random_states
+            None to draw from the global numpy RNG, or one np.random.RandomState per trajectory. Each trajectory
+            then gets the same draws, in the same order, as _generate_flight() with its random state
+        pregenerate_random
+            (bool) draw all random force directions as one block up front. always done with random_states
+
+        Returns
+        -------
+        vector_dict
+            dictionary of (max_bins, N, ...) arrays
+        n_bins
+            (N,) array with the number of valid timebins in each trajectory, trimmed the same way as _land()
+        """
+        m = self.mass
+        N = n_trajectories
+        vector_dict = self._initialize_ensemble_dict(N)
+
+        in_plume = vector_dict['in_plume']
+        plume_signal = vector_dict['plume_signal']
+        position = vector_dict['position']
+        velocity = vector_dict['velocity']
+        acceleration = vector_dict['acceleration']
+        random_f = vector_dict['random_f']
+        stim_f = vector_dict['stim_f']
+        total_f = vector_dict['total_f']
+        decision = vector_dict['decision']
+
+        # every agent keeps its own decision state
+        decisions = Decisions(self.decision_policy, self.stimulus_memory_n_timesteps)
+        decisions.reset(N)
+
+        active = np.ones(N, dtype=bool)  # agents still flying
+        landed_tsi = np.full(N, self.max_bins - 1, dtype=int)
+
+        for i in range(N):
+            random_state = None if random_states is None else random_states[i]
+            position[0, i] = self._set_init_position(random_state)
+            velocity[0, i] = self._set_init_velocity(random_state)
+
+        if random_states is not None:
+            random_directions = np.empty((self.max_bins, N, 3))
+            for i, random_state in enumerate(random_states):
+                random_directions[:, i] = gen_symm_vecs(3, n_vecs=self.max_bins, random_state=random_state)
+        elif pregenerate_random:
+            random_directions = gen_symm_vecs(3, n_vecs=self.max_bins * N).reshape(self.max_bins, N, 3)
+        else:
+            random_directions = None
+
+        for tsi in range(self.max_bins):
+            agents = np.flatnonzero(active)
+            if agents.size == 0:
+                break
+
+            time = tsi * self.dt
+            in_plume[tsi, agents] = self.plume.in_plume_mask(position[tsi, agents], time)
+
+            decision[tsi, agents], plume_signal[tsi, agents] = decisions.update(in_plume[tsi, agents],
+                                                                                velocity[tsi, agents, 1], agents)
+            if decisions.needs_gradient:
+                gradients = self.plume.gradients(position[tsi, agents], time)
+            else:
+                gradients = None
+            stim_f[tsi, agents] = self.flight.stimulus_codes(decision[tsi, agents], gradients)
+
+            if random_directions is None:
+                random_f[tsi, agents] = self.flight.random(n_agents=agents.size)
+            else:
+                random_f[tsi, agents] = self.flight.random(directions=random_directions[tsi, agents])
+            total_f[tsi, agents] = -self.flight.damping_coeff * velocity[tsi, agents] + random_f[tsi, agents] + \
+                stim_f[tsi, agents]
+            acceleration[tsi, agents] = total_f[tsi, agents] / m
+
+            # land agents whose time is out before we solve for future velo, position
+            landing = tsi == landed_tsi[agents]
+            active[agents[landing]] = False
+            agents = agents[~landing]
+            if agents.size == 0:
+                continue
+
+            candidate_pos, candidate_velo = self.stepper.step(position[tsi, agents], velocity[tsi, agents],
+                                                              acceleration[tsi, agents])
+
+            if self.bounded:
+                candidate_pos, candidate_velo = self.collider.collide(candidate_pos, candidate_velo)
+
+            position[tsi + 1, agents] = candidate_pos
+            velocity[tsi + 1, agents] = candidate_velo
+
+        # trim the same way _land() does
+        n_bins = np.where(landed_tsi == 0, 1, landed_tsi - 1)
+
+        return vector_dict, n_bins
+
     def _land(self, tsi, V):
         ''' trim excess timebins in arrays
         '''
@@ -198,87 +385,6 @@ class Simulator:
         
         return V
 
-    def _collide_with_wall(self, candidate_pos, candidate_velo):
-        walls = self.windtunnel.walls
-        xpos, ypos, zpos = candidate_pos
-        xvelo, yvelo, zvelo = candidate_velo
-        teleport_distance = 0.005  # this is arbitrary
-        crash = False
-
-        # print "test", candidate_velo
-
-        # x dim
-        if xpos < walls.downwind:  # too far behind
-            crash = True
-            xpos = walls.downwind + teleport_distance  # teleport back inside
-            if self.collision_type == 'elastic':
-                xvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                xvelo *= -self.restitution_coeff
-            elif self.collision_type == 'crash':
-                xvelo = 0.
-            else:
-                raise ValueError("unknown collision type {}".format(self.collision_type))
-        if xpos > walls.upwind:  # reached far (upwind) wall (end)
-            crash = True
-            xpos = walls.upwind - teleport_distance  # teleport back inside
-            if self.collision_type == 'elastic':
-                xvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                xvelo *= -self.restitution_coeff
-            elif self.collision_type == 'crash':
-                xvelo = 0.
-
-
-        # y dim
-        if ypos < walls.left:  # too left
-            crash = True
-            ypos = walls.left + teleport_distance
-            if self.collision_type == 'elastic':
-                yvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                yvelo *= -self.restitution_coeff
-            elif self.collision_type == "crash":
-                yvelo = 0.
-
-        if ypos > walls.right:  # too far right
-            crash = True
-            ypos = walls.right - teleport_distance
-            if self.collision_type == 'elastic':
-                yvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                yvelo *= -self.restitution_coeff
-            elif self.collision_type == 'crash':
-                yvelo = 0.
-
-        # z dim
-        if zpos > walls.ceiling:  # too far above
-            crash = True
-            zpos = walls.ceiling - teleport_distance
-            if self.collision_type == 'elastic':
-                zvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                zvelo *= -self.restitution_coeff
-            elif self.collision_type == "crash":
-                zvelo = 0.
-        if zpos < walls.floor:  # too far below
-            crash = True
-            zpos = walls.floor + teleport_distance
-            if self.collision_type == 'elastic':
-                zvelo *= -1.
-            elif self.collision_type == 'part_elastic':
-                zvelo *= -self.restitution_coeff
-            elif self.collision_type == 'crash':
-                zvelo = 0.
-
-        try:
-            candidate_pos, candidate_velo = np.array([xpos, ypos, zpos]), np.array([xvelo, yvelo, zvelo])
-        except:
-            print " cand velo", [xvelo, yvelo, zvelo], "before", candidate_velo
-
-
-        return candidate_pos, candidate_velo
-
     def _initialize_vector_dict(self):
         """
         initialize np arrays, store in dictionary
@@ -291,27 +397,52 @@ class Simulator:
         V['tsi'] = np.arange(self.max_bins)
         V['times'] = np.linspace(0, self.time_max, self.max_bins)
         V['in_plume'] = np.zeros(self.max_bins, dtype=bool)
-        V['plume_signal'] = np.array([None] * self.max_bins)
-        V['decision'] = np.array([None] * self.max_bins)
+        V['plume_signal'] = np.zeros(self.max_bins, dtype=np.int8)
+        V['decision'] = np.zeros(self.max_bins, dtype=np.int8)
+
+        return V
+
+    def _initialize_ensemble_dict(self, n_trajectories):
+        """
+        initialize (max_bins, N, ...) np arrays for _generate_ensemble(), store in dictionary
+        """
+        V = {}
+
+        for name in self.kinematics_list + self.forces_list:
+            V[name] = np.full((self.max_bins, n_trajectories, 3), np.nan)
+
+        # tsi and times are shared by all trajectories
+        V['tsi'] = np.repeat(np.arange(self.max_bins)[:, np.newaxis], n_trajectories, axis=1)
+        V['times'] = np.repeat(np.linspace(0, self.time_max, self.max_bins)[:, np.newaxis], n_trajectories, axis=1)
+        V['in_plume'] = np.zeros((self.max_bins, n_trajectories), dtype=bool)
+        V['plume_signal'] = np.zeros((self.max_bins, n_trajectories), dtype=np.int8)
+        V['decision'] = np.zeros((self.max_bins, n_trajectories), dtype=np.int8)
 
         return V
 
-    def _set_init_velocity(self):
-        initial_velocity_norm = np.random.normal(self.initial_velocity_mu, self.initial_velocity_stdev, 1)
+    def _set_init_velocity(self, random_state=None):
+        if random_state is None:
+            random_state = np.random
+        initial_velocity_norm = random_state.normal(self.initial_velocity_mu, self.initial_velocity_stdev, 1)
 
-        unit_vector = gen_symm_vecs(3)
+        unit_vector = gen_symm_vecs(3, random_state=random_state)
         velocity_vec = initial_velocity_norm * unit_vector
 
         return velocity_vec
 
-    def _set_init_position(self):
+    def _set_init_position(self, random_state=None):
         ''' puts the agent in an initial position, usually within the bounds of the
         cage
 
         Options: [the cage] door, or anywhere in the plane at x=.1 meters
 
         set initial velocity from fitted distribution
+
+        random_state is the np.random.RandomState to draw from, the global numpy RNG by default
         '''
+        if random_state is None:
+            random_state = np.random
+        choose = lambda options: options[random_state.randint(len(options))]
 
         # generate random intial velocity condition using normal distribution fitted to experimental data
         if self.initial_position_selection == 'realistic':
@@ -329,48 +460,16 @@ class Simulator:
             initial_position = np.array([x,y,z])
         elif self.initial_position_selection == 'downwind_high':
             initial_position = np.array(
-                [0.05, np.random.uniform(-0.127, 0.127), 0.2373])  # 0.2373 is mode of z pos distribution
+                [0.05, random_state.uniform(-0.127, 0.127), 0.2373])  # 0.2373 is mode of z pos distribution
         elif type(self.initial_position_selection) is list:
             initial_position = np.array(self.initial_position_selection)
         elif self.initial_position_selection == "door":  # start trajectories as they exit the front door
-            initial_position = np.array([0.1909, np.random.uniform(-0.0381, 0.0381), np.random.uniform(0., 0.1016)])
+            initial_position = np.array([0.1909, random_state.uniform(-0.0381, 0.0381),
+                                         random_state.uniform(0., 0.1016)])
             # FIXME cage is actually suspending above floor
         elif self.initial_position_selection == 'downwind_plane':
-            initial_position = np.array([0.1, np.random.uniform(-0.127, 0.127), np.random.uniform(0., 0.254)])
+            initial_position = np.array([0.1, random_state.uniform(-0.127, 0.127), random_state.uniform(0., 0.254)])
         else:
             raise Exception('invalid agent position specified: {}'.format(self.initial_position_selection))
 
         return initial_position
-
-    def _velocity_ceiling(self, candidate_velo):
-        """check if we're seeing enormous velocities, which sometimes happens when running the optimization
-         algoirithm. if so, cap the velocity instead of landing. this allows the optimizer to keep running.
-        """
-        for i, velo in enumerate(candidate_velo):
-            if velo > 20:
-                candidate_velo[i] = 20.
-            elif velo < -20:
-                candidate_velo[i] = -20.
-
-        return candidate_velo
-
-    def _fix_vector_dict(self, dct):
-        # prepare dict for loading into pandas (dataframe only accepts 1D vectors)
-        # split xyz dicts into separate x, y, z vectors for dataframe
-
-        fixed_dct = {}
-        for kinematic in self.kinematics_list + self.forces_list:
-            fixed_dct[kinematic + '_x'], fixed_dct[kinematic + '_y'], fixed_dct[kinematic + '_z'] = np.split(
-                dct[kinematic], 3, axis=1)
-
-        # migrate rest of dict
-        for v in self.other_list:
-            fixed_dct[v] = dct[v]
-
-        # fix pandas bug when trying to load (R,1) arrays when it expects (R,) arrays
-        for key, dct in fixed_dct.iteritems():
-            fixed_dct[key] = fixed_dct[key].reshape(len(dct))
-            if fixed_dct[key].size == 0:
-                fixed_dct[key] = np.array([0.])  # hack so that kde calculation doesn't freeze on empty arrays
-
-        return fixed_dct
\ No newline at end of file
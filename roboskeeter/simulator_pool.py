@@ -0,0 +1,108 @@
+"""
+Spread trajectory generation across a pool of worker processes.
+
+Every worker builds its own Experiment (and therefore its own windtunnel and plume) once when the process starts,
+then reuses it for every chunk of trajectories it is handed. Trajectories draw from per-trajectory random streams (see
+Simulator.fly()), so a run with a given seed is the same no matter how it is chunked or how many workers there are.
+"""
+__author__ = 'richard'
+
+import multiprocessing
+from collections import Counter
+
+import numpy as np
+
+from roboskeeter.observations import Observations
+from roboskeeter.trajectory_store import TrajectoryStore
+
+# the Experiment living in each worker process, built by _init_worker()
+_worker_experiment = None
+
+
+def fly_parallel(simulator, n_trajectories, workers, vectorized=False, seed=None, chunk_size=None):
+    """
+    Generate n_trajectories on a pool of worker processes and merge them into one Observations object.
+
+    Parameters
+    ----------
+    simulator
+        (Simulator) the agent whose parameters the workers copy
+    n_trajectories
+        (int) total number of flights
+    workers
+        (int) number of processes
+    vectorized
+        (bool) whether each worker uses the vectorized ensemble integrator
+    seed
+        (int or None) seed of the per-trajectory random streams. if None, one is drawn from the global numpy RNG
+    chunk_size
+        (int or None) trajectories per task. Defaults to one chunk per worker for the vectorized integrator, and
+        four chunks per worker otherwise so that slow chunks don't leave cores idle.
+
+    Returns
+    -------
+    observations
+        kinematics of all chunks, with trajectory_num running from 0 to n_trajectories - 1
+    """
+    if chunk_size is None:
+        chunks_per_worker = 1 if vectorized else 4
+        chunk_size = int(np.ceil(float(n_trajectories) / (workers * chunks_per_worker)))
+    chunk_size = max(chunk_size, 1)
+
+    first_trajectory_nums = range(0, n_trajectories, chunk_size)
+    chunk_sizes = [min(chunk_size, n_trajectories - first) for first in first_trajectory_nums]
+
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 31 - 1)
+
+    tasks = [(first, size, seed, vectorized) for first, size in zip(first_trajectory_nums, chunk_sizes)]
+
+    if simulator.verbose:
+        print "Simulating {} trajectories in {} chunks on {} worker processes.".format(n_trajectories, len(tasks),
+                                                                                        workers)
+
+    pool = multiprocessing.Pool(processes=workers,
+                                initializer=_init_worker,
+                                initargs=(simulator.agent_kwargs, simulator.experiment.experiment_conditions))
+    try:
+        chunks = pool.map(_fly_chunk, tasks)
+        pool.close()
+    except KeyboardInterrupt:
+        print "\n Simulations interrupted. Shutting down workers..."
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    store = TrajectoryStore(columns=simulator.store_columns(),
+                            capacity=sum(len(chunk_store) for chunk_store, _ in chunks))
+    wall_crashes = Counter()
+    for first_trajectory_num, (chunk_store, chunk_wall_crashes) in zip(first_trajectory_nums, chunks):
+        store.extend(chunk_store, trajectory_num_offset=first_trajectory_num)
+        wall_crashes.update(chunk_wall_crashes)
+
+    observations = Observations(trajectory_store=store)
+    observations.wall_crashes = dict(wall_crashes)
+
+    return observations
+
+
+def _init_worker(agent_kwargs, experiment_conditions):
+    """build this process' Experiment once, so the plume isn't rebuilt for every task"""
+    global _worker_experiment
+    from roboskeeter.experiments import Experiment  # imported here to avoid a circular import
+
+    agent_kwargs = dict(agent_kwargs)
+    agent_kwargs['verbose'] = False  # don't let workers fight over the terminal
+    _worker_experiment = Experiment(agent_kwargs, experiment_conditions)
+
+
+def _fly_chunk(task):
+    first_trajectory_num, n_trajectories, seed, vectorized = task
+
+    observations = _worker_experiment.agent.fly(n_trajectories, vectorized=vectorized, seed=seed,
+                                                first_trajectory_num=first_trajectory_num)
+    store = observations.trajectory_store
+    store.trim()  # don't send empty preallocated rows back through the pipe
+
+    return store, observations.wall_crashes
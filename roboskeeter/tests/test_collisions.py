@@ -0,0 +1,113 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+
+from roboskeeter.collisions import MAX_REFLECTIONS, WallCollider
+from roboskeeter.environment import Walls
+
+COLLISION_TYPES = ['elastic', 'part_elastic', 'crash']
+RESTITUTION_COEFF = 0.1
+
+
+def inline_collide(walls, collision_type, position, velocity):
+    """the wall handling Simulator._generate_flight had before WallCollider, one agent at a time"""
+    position, velocity = list(position), list(velocity)
+    teleport_distance = 0.005
+    for dim, lower, upper in [(0, walls.downwind, walls.upwind),
+                              (1, walls.left, walls.right),
+                              (2, walls.floor, walls.ceiling)]:
+        for past_wall, wall in [(position[dim] < lower, lower + teleport_distance),
+                                (position[dim] > upper, upper - teleport_distance)]:
+            if past_wall:
+                position[dim] = wall
+                if collision_type == 'elastic':
+                    velocity[dim] *= -1.
+                elif collision_type == 'part_elastic':
+                    velocity[dim] *= -RESTITUTION_COEFF
+                elif collision_type == 'crash':
+                    velocity[dim] = 0.
+
+    return np.array(position), np.array(velocity)
+
+
+class TestWallCollider(unittest.TestCase):
+    def setUp(self):
+        self.walls = Walls()
+        self.lower = np.array([self.walls.downwind, self.walls.left, self.walls.floor])
+        self.upper = np.array([self.walls.upwind, self.walls.right, self.walls.ceiling])
+
+        # a third of the agents inside, the rest up to half a tunnel past some wall
+        random_state = np.random.RandomState(0)
+        width = self.upper - self.lower
+        self.positions = self.lower + width * random_state.uniform(-0.5, 1.5, (300, 3))
+        self.positions[:100] = self.lower + width * random_state.rand(100, 3)
+        self.velocities = random_state.randn(300, 3)
+
+    def test_teleport_matches_inline_handling(self):
+        for collision_type in COLLISION_TYPES:
+            collider = WallCollider(self.walls, collision_type, RESTITUTION_COEFF)
+            positions, velocities = collider.collide(self.positions, self.velocities)
+
+            for i in range(len(self.positions)):
+                position, velocity = inline_collide(self.walls, collision_type, self.positions[i],
+                                                    self.velocities[i])
+                np.testing.assert_array_equal(positions[i], position)
+                np.testing.assert_array_equal(velocities[i], velocity)
+
+                single_position, single_velocity = collider.collide(self.positions[i], self.velocities[i])
+                np.testing.assert_array_equal(single_position, position)
+                np.testing.assert_array_equal(single_velocity, velocity)
+
+    def test_inputs_untouched(self):
+        positions, velocities = self.positions.copy(), self.velocities.copy()
+        for mode in ['teleport', 'reflect']:
+            WallCollider(self.walls, 'elastic', mode=mode).collide(self.positions, self.velocities)
+            np.testing.assert_array_equal(self.positions, positions)
+            np.testing.assert_array_equal(self.velocities, velocities)
+
+    def test_reflect_single_bounce(self):
+        for collision_type, restitution in [('elastic', 1.), ('part_elastic', RESTITUTION_COEFF), ('crash', 0.)]:
+            collider = WallCollider(self.walls, collision_type, RESTITUTION_COEFF, mode='reflect')
+            positions, velocities = collider.collide(self.positions, self.velocities)
+
+            expected = np.where(self.positions < self.lower, self.lower + restitution * (self.lower - self.positions),
+                                self.positions)
+            expected = np.where(self.positions > self.upper, self.upper - restitution * (self.positions - self.upper),
+                                expected)
+            hit = (self.positions < self.lower) | (self.positions > self.upper)
+            np.testing.assert_allclose(positions, expected, rtol=0, atol=1e-15)
+            np.testing.assert_array_equal(velocities, np.where(hit, -restitution * self.velocities, self.velocities))
+
+    def test_elastic_reflect_folds_long_steps(self):
+        """an elastic step many tunnel widths long ends where the path folded back and forth between the walls does"""
+        width = self.upper - self.lower
+        overshoot = np.random.RandomState(1).uniform(-20, 20, (200, 3)) * width
+        positions = self.lower + overshoot
+        collider = WallCollider(self.walls, 'elastic', mode='reflect')
+        reflected, _ = collider.collide(positions, np.ones_like(positions))
+
+        folded = np.mod(overshoot, 2 * width)
+        folded = self.lower + np.where(folded > width, 2 * width - folded, folded)
+        np.testing.assert_allclose(reflected, folded, rtol=0, atol=1e-12)
+
+    def test_reflect_terminates(self):
+        positions = np.array([[1e6, 0., 0.1],  # would need millions of passes
+                              [0.5, -1e300, 0.1],
+                              [np.inf, 0., -np.inf]])
+        for collision_type in COLLISION_TYPES:
+            collider = WallCollider(self.walls, collision_type, RESTITUTION_COEFF, mode='reflect')
+            reflected, _ = collider.collide(positions, np.ones_like(positions))
+            self.assertTrue(np.all((reflected >= self.lower) & (reflected <= self.upper)))
+
+        # steps that need fewer passes than the cap are still reflected exactly, not stopped at the wall
+        width = self.upper[0] - self.lower[0]
+        overshoot = (MAX_REFLECTIONS - 1.5) * width
+        reflected, _ = WallCollider(self.walls, 'elastic', mode='reflect').collide(
+            np.array([self.upper[0] + overshoot, 0., 0.1]), np.ones(3))
+        self.assertAlmostEqual(reflected[0], self.lower[0] + width / 2., places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+__author__ = 'richard'
+
+import itertools
+import unittest
+
+import numpy as np
+
+from roboskeeter.decisions import DECISION_CODES, Decisions, plume_signal_code
+
+POLICIES = ['surge_only', 'cast_only', 'cast+surge', 'gradient', 'ignore']
+MEMORY = 5  # stimulus_memory_n_timesteps
+
+
+def step_agents(policy, in_plume, crosswind_velocity, sighted_ago, last_exit_left):
+    """
+    One timestep of make_decision() for every agent, each with its own Decisions object put in the given state
+
+    Returns
+    -------
+    decision and plume signal codes
+    """
+    decisions, plume_signals = [], []
+    for agent in range(len(in_plume)):
+        agent_decisions = Decisions(policy, MEMORY)
+        agent_decisions.plume_sighted_ago = sighted_ago[agent]
+        agent_decisions.last_plume_side_exited = 'l' if last_exit_left[agent] else 'r'
+
+        decision, plume_signal = agent_decisions.make_decision(in_plume[agent], crosswind_velocity[agent])
+        decisions.append(DECISION_CODES[decision])
+        plume_signals.append(plume_signal_code(plume_signal))
+
+    return np.array(decisions), np.array(plume_signals)
+
+
+class TestDecisionEngine(unittest.TestCase):
+    def test_update_matches_make_decision_table(self):
+        """every (previous state, plume signal) combination: time since the plume was seen, side it was last exited on,
+        whether the agent is in the plume now and which way it is flying crosswind"""
+        table = list(itertools.product([0, 1, 2, MEMORY - 1, MEMORY, MEMORY + 1, Decisions('ignore', 1).never_sighted],
+                                       [True, False],
+                                       [True, False],
+                                       [-0.1, 0.1]))
+        sighted_ago, last_exit_left, in_plume, crosswind_velocity = [np.array(column) for column in zip(*table)]
+
+        for policy in POLICIES:
+            engine = Decisions(policy, MEMORY)
+            engine.reset(len(table))
+            engine.agent_sighted_ago[:] = sighted_ago
+            engine.agent_last_exit_left[:] = last_exit_left
+
+            decisions, plume_signals = engine.update(in_plume, crosswind_velocity)
+            expected_decisions, expected_plume_signals = step_agents(policy, in_plume, crosswind_velocity,
+                                                                     sighted_ago, last_exit_left)
+            np.testing.assert_array_equal(decisions, expected_decisions, err_msg=policy)
+            np.testing.assert_array_equal(plume_signals, expected_plume_signals, err_msg=policy)
+
+    def test_update_and_scan_match_make_decision_over_flights(self):
+        random_state = np.random.RandomState(0)
+        n_agents, n_timesteps = 20, 60
+        # plume encounters come in runs, so agents exit, cast and forget the plume again
+        in_plume = np.cumsum(random_state.rand(n_timesteps, n_agents) < 0.15, axis=0) % 2 == 1
+        crosswind_velocity = random_state.randn(n_timesteps, n_agents)
+
+        for policy in POLICIES:
+            engine = Decisions(policy, MEMORY)
+            engine.reset(n_agents)
+            agent_decisions = [Decisions(policy, MEMORY) for _ in range(n_agents)]
+
+            expected_decisions = np.empty((n_timesteps, n_agents), dtype=int)
+            expected_plume_signals = np.empty((n_timesteps, n_agents), dtype=int)
+            for tsi in range(n_timesteps):
+                for agent in range(n_agents):
+                    decision, plume_signal = agent_decisions[agent].make_decision(in_plume[tsi, agent],
+                                                                                  crosswind_velocity[tsi, agent])
+                    expected_decisions[tsi, agent] = DECISION_CODES[decision]
+                    expected_plume_signals[tsi, agent] = plume_signal_code(plume_signal)
+
+                # half the ensemble at a time, like the ensemble integrator does once agents start landing
+                for agents in [np.arange(0, n_agents, 2), np.arange(1, n_agents, 2)]:
+                    decisions, plume_signals = engine.update(in_plume[tsi, agents], crosswind_velocity[tsi, agents],
+                                                             agents)
+                    np.testing.assert_array_equal(decisions, expected_decisions[tsi, agents], err_msg=policy)
+                    np.testing.assert_array_equal(plume_signals, expected_plume_signals[tsi, agents], err_msg=policy)
+
+            # rows of a trajectory contiguous and in time order
+            decisions, plume_signals = engine.scan(in_plume.T.ravel(), crosswind_velocity.T.ravel(),
+                                                   np.repeat(np.arange(n_agents), n_timesteps))
+            np.testing.assert_array_equal(decisions, expected_decisions.T.ravel(), err_msg=policy)
+            np.testing.assert_array_equal(plume_signals, expected_plume_signals.T.ravel(), err_msg=policy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+
+from roboskeeter.integrators import VELOCITY_CEILING, EulerIntegrator, ExactIntegrator, HeunIntegrator, \
+    make_integrator
+
+MASS = 2.88e-6
+DT = 0.01
+
+
+def inline_euler(position, velocity, acceleration, dt):
+    """the update Simulator._generate_flight did inline before the integrators, with _velocity_ceiling()"""
+    candidate_velo = velocity + acceleration * dt
+
+    for i, velo in enumerate(candidate_velo):
+        if velo > 20:
+            candidate_velo[i] = 20.
+        elif velo < -20:
+            candidate_velo[i] = -20.
+
+    candidate_pos = position + candidate_velo * dt
+
+    return candidate_pos, candidate_velo
+
+
+def held_force_solution(position, velocity, force, damping_coeff, dt):
+    """closed form solution of m dv/dt = -damping_coeff v + force over dt"""
+    k = damping_coeff / MASS
+    terminal_velocity = force / (MASS * k)
+    decay = np.exp(-k * dt)
+    velocity_end = velocity * decay + terminal_velocity * (1 - decay)
+    position_end = position + terminal_velocity * dt + (velocity - terminal_velocity) * (1 - decay) / k
+
+    return position_end, velocity_end
+
+
+def phi_series(z):
+    """phi1 and phi2 of ExactIntegrator to third order"""
+    return 1. - z / 2. + z ** 2 / 6. - z ** 3 / 24., 0.5 - z / 6. + z ** 2 / 24. - z ** 3 / 120.
+
+
+class TestIntegrators(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.positions = random_state.rand(50, 3)
+        self.velocities = random_state.randn(50, 3)
+        self.forces = random_state.randn(50, 3) * 1e-5
+
+    def acceleration(self, damping_coeff):
+        return (-damping_coeff * self.velocities + self.forces) / MASS
+
+    def test_exact_matches_closed_form(self):
+        # from barely damped to far past where euler goes unstable (z = 2)
+        for damping_coeff in [3.63417031e-07, 1e-5, 1e-4, 1e-3]:
+            integrator = ExactIntegrator(MASS, damping_coeff, DT)
+            positions, velocities = integrator.step(self.positions, self.velocities, self.acceleration(damping_coeff))
+            expected_positions, expected_velocities = held_force_solution(self.positions, self.velocities, self.forces,
+                                                                          damping_coeff, DT)
+            np.testing.assert_allclose(velocities, expected_velocities, rtol=1e-9, atol=1e-12)
+            np.testing.assert_allclose(positions, expected_positions, rtol=1e-9, atol=1e-12)
+
+            # one agent at a time gives the same
+            position, velocity = integrator.step(self.positions[0], self.velocities[0],
+                                                 self.acceleration(damping_coeff)[0])
+            np.testing.assert_array_equal(position, positions[0])
+            np.testing.assert_array_equal(velocity, velocities[0])
+
+    def test_exact_small_damping(self):
+        """the series branch below z = 1e-6 and the expm1 branch above it both match the Taylor series"""
+        for z in [0., 1e-9, 5e-7, 9.9e-7, 1.01e-6, 1e-5, 1e-4]:
+            integrator = ExactIntegrator(MASS, z * MASS / DT, DT)
+            phi1, phi2 = phi_series(z)
+            self.assertAlmostEqual(integrator.velocity_gain / DT, phi1, delta=1e-10)
+            self.assertAlmostEqual(integrator.position_gain / DT ** 2, phi2, delta=1e-10)
+
+        # and the two branches meet at the threshold
+        below, above = ExactIntegrator(MASS, 0.999e-6 * MASS / DT, DT), ExactIntegrator(MASS, 1.001e-6 * MASS / DT, DT)
+        self.assertAlmostEqual(below.velocity_gain / DT, above.velocity_gain / DT, delta=1e-9)
+        self.assertAlmostEqual(below.position_gain / DT ** 2, above.position_gain / DT ** 2, delta=1e-9)
+
+    def test_euler_matches_inline_update(self):
+        damping_coeff = 3.63417031e-07
+        integrator = EulerIntegrator(MASS, damping_coeff, DT)
+        velocities = self.velocities * np.array([1., 15., 1.])  # some past the ceiling after the step
+        accelerations = (-damping_coeff * velocities + self.forces * 50) / MASS
+
+        positions, candidate_velocities = integrator.step(self.positions, velocities, accelerations)
+        self.assertTrue(np.any(np.abs(candidate_velocities) == VELOCITY_CEILING))
+        for i in range(len(self.positions)):
+            expected_position, expected_velocity = inline_euler(self.positions[i], velocities[i].copy(),
+                                                                accelerations[i], DT)
+            np.testing.assert_array_equal(positions[i], expected_position)
+            np.testing.assert_array_equal(candidate_velocities[i], expected_velocity)
+
+    def test_heun_second_order(self):
+        """the velocity error of one heun step against the closed form shrinks 8-fold when dt halves"""
+        damping_coeff = 1e-5
+        errors = []
+        for dt in [DT, DT / 2.]:
+            _, velocities = HeunIntegrator(MASS, damping_coeff, dt).step(self.positions, self.velocities,
+                                                                         self.acceleration(damping_coeff))
+            _, expected = held_force_solution(self.positions, self.velocities, self.forces, damping_coeff, dt)
+            errors.append(np.abs(velocities - expected).max())
+        self.assertAlmostEqual(errors[0] / errors[1], 8., delta=0.5)
+
+    def test_make_integrator(self):
+        for name, integrator_class in [('euler', EulerIntegrator), ('exact', ExactIntegrator),
+                                       ('heun', HeunIntegrator)]:
+            self.assertIsInstance(make_integrator(name, MASS, 1e-6, DT), integrator_class)
+        self.assertRaises(ValueError, make_integrator, 'bogus', MASS, 1e-6, DT)
+
+
+if __name__ == '__main__':
+    unittest.main()
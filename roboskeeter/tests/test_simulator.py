@@ -0,0 +1,61 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+
+from roboskeeter.experiments import Experiment
+
+AGENT_KWARGS = {'is_simulation': True,
+                'random_f_strength': 6.64725529e-06,
+                'stim_f_strength': 5.0e-06,
+                'damping_coeff': 3.63417031e-07,
+                'collision_type': 'part_elastic',
+                'restitution_coeff': 0.1,
+                'stimulus_memory_n_timesteps': 100,
+                'decision_policy': 'ignore',
+                'initial_position_selection': 'realistic',
+                'verbose': False,
+                'optimizing': False}
+
+SIMULATION_CONDITIONS = {'condition': 'Control',
+                         'time_max': 6.,
+                         'bounded': True,
+                         'optimizing': False,
+                         'plume_model': 'None'}
+
+
+class TestSeededFlight(unittest.TestCase):
+    """with a seed, a trajectory comes out the same whether it's flown alone, vectorized or on a worker"""
+    n_trajectories = 5
+    seed = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.experiment = Experiment(dict(AGENT_KWARGS), dict(SIMULATION_CONDITIONS))
+
+    def fly(self, **kwargs):
+        return self.experiment.agent.fly(self.n_trajectories, seed=self.seed, **kwargs).trajectory_store
+
+    def assertStoresEqual(self, store, other):
+        np.testing.assert_array_equal(store.offsets, other.offsets)
+        np.testing.assert_array_equal(store.trajectory_nums, other.trajectory_nums)
+        for column in store.columns:
+            np.testing.assert_array_equal(store.column(column.name), other.column(column.name),
+                                          err_msg="column {} differs".format(column.name))
+
+    def test_vectorized_matches_serial(self):
+        self.assertStoresEqual(self.fly(), self.fly(vectorized=True))
+
+    def test_pool_matches_serial(self):
+        self.assertStoresEqual(self.fly(), self.fly(workers=2))
+
+    def test_vectorized_pool_matches_serial(self):
+        self.assertStoresEqual(self.fly(), self.fly(vectorized=True, workers=2))
+
+    def test_seed_repeats(self):
+        self.assertStoresEqual(self.fly(vectorized=True), self.fly(vectorized=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+__author__ = 'richard'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from roboskeeter import environment
+from roboskeeter.environment import Environment, Walls
+from roboskeeter.math.rbf_evaluation import evaluate_rbf_gradient
+
+GRID_SHAPE = (12, 5, 4)
+
+
+class _Conditions(object):
+    """Environment only needs the experiment conditions"""
+    def __init__(self, experiment_conditions):
+        self.experiment_conditions = experiment_conditions
+
+
+def make_environment(plume_model, condition='Right', **conditions):
+    experiment_conditions = {'condition': condition, 'bounded': True, 'plume_model': plume_model}
+    experiment_conditions.update(conditions)
+    return Environment(_Conditions(experiment_conditions))
+
+
+class FakeDataDirectories(object):
+    """points environment.get_directory at files in a temporary directory, for the duration of a test"""
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __enter__(self):
+        self._get_directory = environment.get_directory
+        environment.get_directory = lambda selection=None: self.paths.get(selection, '/nonexistent/' + selection)
+        return self
+
+    def __exit__(self, *exc_info):
+        environment.get_directory = self._get_directory
+
+
+class TestPrecomputedTimeAvgPlume(unittest.TestCase):
+    """the TimeAvg plume loaded from the precomputed padded and interpolated csvs"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        walls = Walls()
+        self.lower = np.array([walls.downwind, walls.left, walls.floor])
+        self.upper = np.array([walls.upwind, walls.right, walls.ceiling])
+
+        # a warm blob measured at scattered points, padded with room temperature around it
+        raw = self.lower + (self.upper - self.lower) * random_state.rand(60, 3)
+        raw_temps = 19. + 5. * np.exp(-np.sum(((raw - [0.5, 0., 0.1]) / [0.3, 0.08, 0.08]) ** 2, axis=1))
+        padding = self.lower + (self.upper - self.lower) * random_state.rand(40, 3)
+        padded = pd.DataFrame({'x': np.concatenate([raw[:, 0], padding[:, 0]]),
+                               'y': np.concatenate([raw[:, 1], padding[:, 1]]),
+                               'z': np.concatenate([raw[:, 2], padding[:, 2]]),
+                               'avg_temp': np.concatenate([raw_temps, np.full(40, 19.)])})
+
+        # interpolated data on a regular grid, rows shuffled, with some stand-in finite difference gradients
+        self.axes = [np.linspace(lower, upper, n) for lower, upper, n in zip(self.lower, self.upper, GRID_SHAPE)]
+        grid = np.meshgrid(*self.axes, indexing='ij')
+        interpolated = pd.DataFrame({'x': grid[0].ravel(), 'y': grid[1].ravel(), 'z': grid[2].ravel(),
+                                     'avg_temp': 19. + random_state.rand(grid[0].size),
+                                     'gradient_x': random_state.randn(grid[0].size),
+                                     'gradient_y': random_state.randn(grid[0].size),
+                                     'gradient_z': random_state.randn(grid[0].size)})
+        interpolated['gradient_norm'] = np.linalg.norm(interpolated[['gradient_x', 'gradient_y', 'gradient_z']],
+                                                       axis=1)
+        self.interpolated = interpolated.iloc[random_state.permutation(len(interpolated))]
+
+        self.paths = {'THERMOCOUPLE_TIMEAVG_RIGHT_CSV': os.path.join(self.directory, 'raw.csv'),
+                      'THERMOCOUPLE_TIMEAVG_RIGHT_PADDED_CSV': os.path.join(self.directory, 'padded.csv'),
+                      'THERMOCOUPLE_TIMEAVG_RIGHT_INTERPOLATED_CSV': os.path.join(self.directory, 'interpolated.csv')}
+        np.savetxt(self.paths['THERMOCOUPLE_TIMEAVG_RIGHT_CSV'], np.column_stack([raw, raw_temps]), delimiter=',')
+        padded.to_csv(self.paths['THERMOCOUPLE_TIMEAVG_RIGHT_PADDED_CSV'], index=False)
+        self.interpolated.to_csv(self.paths['THERMOCOUPLE_TIMEAVG_RIGHT_INTERPOLATED_CSV'], index=False)
+
+        grid = np.meshgrid(*self.axes, indexing='ij')
+        self.nodes = np.column_stack([axis.ravel() for axis in grid])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_plume(self, **conditions):
+        with FakeDataDirectories(self.paths):
+            return make_environment('Timeavg', **conditions).plume
+
+    def csv_values(self, names):
+        """the interpolated csv at self.nodes"""
+        indexed = self.interpolated.set_index(['x', 'y', 'z'])
+        return np.array([indexed.loc[tuple(node), names].values for node in self.nodes], dtype=float)
+
+    def test_finite_difference_serves_csv(self):
+        plume = self.make_plume()
+        self.assertEqual(plume.resolution, GRID_SHAPE)
+        np.testing.assert_allclose(plume.temperatures(self.nodes), self.csv_values(['avg_temp'])[:, 0], rtol=1e-12)
+        np.testing.assert_allclose(plume.gradients(self.nodes),
+                                   self.csv_values(['gradient_x', 'gradient_y', 'gradient_z']), rtol=1e-12)
+
+    def test_analytic_gradient(self):
+        plume = self.make_plume(plume_gradient='analytic')
+        gradients = plume.gradients(self.nodes)
+
+        np.testing.assert_allclose(gradients, evaluate_rbf_gradient(plume.rbfi, self.nodes), rtol=1e-9, atol=1e-9)
+        self.assertFalse(np.allclose(gradients, self.csv_values(['gradient_x', 'gradient_y', 'gradient_z'])))
+        # the temperatures are still the csv's
+        np.testing.assert_allclose(plume.temperatures(self.nodes), self.csv_values(['avg_temp'])[:, 0], rtol=1e-12)
+
+    def test_resolution(self):
+        self.assertEqual(self.make_plume(plume_resolution=GRID_SHAPE).resolution, GRID_SHAPE)
+        self.assertRaises(ValueError, self.make_plume, plume_resolution=(20, 6, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+__author__ = 'richard'
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from roboskeeter.decisions import DECISIONS, PLUME_SIGNALS
+from roboskeeter.experiments import Experiment
+from roboskeeter.simulator import trajectory_random_state
+from roboskeeter.tests.test_simulator import AGENT_KWARGS, SIMULATION_CONDITIONS
+from roboskeeter.trajectory_store import Column, TrajectoryStore, simulation_columns
+
+COLUMNS = [Column('position', np.float64, 3, None),
+           Column('tsi', np.int32, 1, None),
+           Column('decision', np.int8, 1, DECISIONS)]
+
+
+def make_trajectory(n, random_state):
+    return {'position': random_state.randn(n, 3),
+            'tsi': np.arange(n),
+            'decision': random_state.randint(0, len(DECISIONS), n)}
+
+
+def old_style_dataframe(trajectory_num, vector_dict):
+    """how Simulator.fly built the DataFrame of a trajectory before TrajectoryStore"""
+    array_dict = {}
+    for name, array in vector_dict.iteritems():
+        if array.ndim == 2:
+            array_dict[name + '_x'], array_dict[name + '_y'], array_dict[name + '_z'] = array.T
+        else:
+            array_dict[name] = array
+    array_dict['trajectory_num'] = [trajectory_num] * len(vector_dict['tsi'])
+
+    return pd.DataFrame(array_dict)
+
+
+class TestTrajectoryStore(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.trajectories = [make_trajectory(n, self.random_state) for n in [5, 1, 12]]
+
+    def fill(self, capacity=2):
+        store = TrajectoryStore(columns=COLUMNS, capacity=capacity)  # small, so appending has to grow it
+        for trajectory_num, arrays in enumerate(self.trajectories):
+            store.append(trajectory_num, arrays)
+        return store
+
+    def test_append(self):
+        store = self.fill()
+        self.assertEqual(len(store), 18)
+        self.assertEqual(store.n_trajectories, 3)
+        np.testing.assert_array_equal(store.offsets, [0, 5, 6, 18])
+        for i, arrays in enumerate(self.trajectories):
+            for name, array in store.trajectory(i).iteritems():
+                np.testing.assert_array_equal(array, arrays[name])
+
+    def test_extend(self):
+        store = self.fill()
+        other = self.fill()
+        store.extend(other, trajectory_num_offset=3)
+
+        np.testing.assert_array_equal(store.offsets, [0, 5, 6, 18, 23, 24, 36])
+        np.testing.assert_array_equal(store.trajectory_nums, range(6))
+        np.testing.assert_array_equal(store.column('position')[18:], other.column('position'))
+
+        dataframe = store.to_dataframe()
+        np.testing.assert_array_equal(dataframe.trajectory_num.values, np.repeat(range(6), [5, 1, 12] * 2))
+
+    def test_from_arrays_and_trim(self):
+        store = self.fill(capacity=100)
+        arrays = {column.name: store.column(column.name) for column in COLUMNS}
+        wrapped = TrajectoryStore.from_arrays(COLUMNS, arrays, store.offsets, store.trajectory_nums)
+        self.assertTrue(np.shares_memory(wrapped.column('position'), arrays['position']))  # no copy
+        self.assertRaises(ValueError, TrajectoryStore.from_arrays, COLUMNS, arrays, [0, 5, 6, 17], [0, 1, 2])
+
+        before = store.to_dataframe()
+        store.trim()
+        self.assertEqual(len(store._data['position']), len(store))
+        pd.testing.assert_frame_equal(store.to_dataframe(), before)
+        pd.testing.assert_frame_equal(wrapped.to_dataframe(), before)
+
+    def test_categorical_round_trip(self):
+        store = self.fill()
+        decision = store.to_dataframe().decision
+
+        self.assertEqual(decision.dtype.name, 'category')
+        self.assertEqual(tuple(decision.cat.categories), DECISIONS)
+        codes = np.concatenate([arrays['decision'] for arrays in self.trajectories])
+        np.testing.assert_array_equal(decision.cat.codes.values, codes)
+        np.testing.assert_array_equal(decision.astype(str).values, np.array(DECISIONS)[codes])
+
+
+class TestStoreMatchesConcat(unittest.TestCase):
+    def test_seeded_flight(self):
+        n_trajectories, seed = 4, 5
+        experiment = Experiment(dict(AGENT_KWARGS), dict(SIMULATION_CONDITIONS))
+        agent = experiment.agent
+
+        dataframe = agent.fly(n_trajectories, seed=seed).kinematics
+
+        old = pd.concat([old_style_dataframe(i, agent._generate_flight(trajectory_random_state(seed, i)))
+                         for i in range(n_trajectories)])
+        for name in ['decision', 'plume_signal']:
+            categories = DECISIONS if name == 'decision' else PLUME_SIGNALS
+            old[name] = pd.Categorical.from_codes(old[name].values, categories=categories)
+
+        self.assertEqual(sorted(dataframe.columns), sorted(old.columns))
+        self.assertEqual(len(dataframe.columns), sum(column.width for column in simulation_columns()) + 1)
+        pd.testing.assert_frame_equal(dataframe.reset_index(drop=True),
+                                      old[dataframe.columns].reset_index(drop=True), check_dtype=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+__author__ = 'richard'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from roboskeeter.io import raw_plume_cache
+from roboskeeter.tests.test_timeavg_plume import make_environment
+
+# six thermocouples, fewer than UnaveragedPlume.n_neighbors, recorded for 5 samples. the values are exact in float32
+POSITIONS = np.array([[0.2, -0.05, 0.05],
+                      [0.2, 0.05, 0.05],
+                      [0.5, 0., 0.1],
+                      [0.5, 0., 0.2],
+                      [0.8, -0.05, 0.15],
+                      [0.8, 0.05, 0.15]])
+FRAMES = np.array([[19.875, 19., 20., 19., 21., 19.],
+                   [20.125, 19., 20.5, 19., 21., 19.25],
+                   [21.5, 19., 21., 19., 19., 19.5],
+                   [20.125, 19., 21.5, 19., 19., 19.75],
+                   [19.875, 19., 22., 19., 21., 20.]])
+
+
+class TestUnaveragedPlume(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sampling_rate = raw_plume_cache.SAMPLING_RATE
+
+        # the raw csv is one row per thermocouple: x, y, z, then its samples. add a row without a position, which is
+        # dropped, and a dropped sample, which is filled with the mean of its thermocouple
+        rows = np.column_stack([POSITIONS, FRAMES.T])
+        rows = np.vstack([rows, np.concatenate([[np.nan, 0., 0.], np.full(len(FRAMES), 30.)])])
+        rows = np.vstack([rows, np.concatenate([[0.9, 0., 0.05], [19., 19., np.nan, 19., 19.]])])
+        self.positions = np.vstack([POSITIONS, [0.9, 0., 0.05]])
+        self.frames = np.column_stack([FRAMES, np.full(len(FRAMES), 19.)])
+
+        csv_path = os.path.join(self.directory, 'raw_right.csv')
+        np.savetxt(csv_path, rows, delimiter=',', fmt='%.6g')
+        directories = {'THERMOCOUPLE_RAW_RIGHT': csv_path, 'RAW_PLUME_CACHE': os.path.join(self.directory, 'cache')}
+        self._get_directory = raw_plume_cache.get_directory
+        raw_plume_cache.get_directory = lambda selection=None: directories[selection]
+
+        self.plume = make_environment('Unaveraged').plume
+
+    def tearDown(self):
+        raw_plume_cache.get_directory = self._get_directory
+        shutil.rmtree(self.directory)
+
+    def test_loaded_recording(self):
+        np.testing.assert_array_equal(self.plume.positions, self.positions)
+        np.testing.assert_array_equal(self.plume.frames, self.frames)
+        self.assertIsInstance(self.plume.frames, np.memmap)
+
+    def test_frames(self):
+        for sample in range(len(self.frames)):
+            np.testing.assert_allclose(self.plume.temperatures(self.positions, sample / self.sampling_rate),
+                                       self.frames[sample], rtol=1e-12)
+
+    def test_interpolates_between_frames(self):
+        for sample, weight in [(0, 0.25), (1, 0.5), (3, 0.9)]:
+            expected = (1 - weight) * self.frames[sample] + weight * self.frames[sample + 1]
+            np.testing.assert_allclose(self.plume.temperatures(self.positions, (sample + weight) / self.sampling_rate),
+                                       expected, rtol=1e-12)
+
+    def test_loops_past_last_frame(self):
+        n_samples = len(self.frames)
+        # between the last frame and the first
+        np.testing.assert_allclose(self.plume.temperatures(self.positions, (n_samples - 0.5) / self.sampling_rate),
+                                   0.5 * (self.frames[-1] + self.frames[0]), rtol=1e-12)
+
+        for sample in [0.25, 2.5, 4.75]:
+            for loops in [1, 3]:
+                np.testing.assert_allclose(
+                    self.plume.temperatures(self.positions, (sample + loops * n_samples) / self.sampling_rate),
+                    self.plume.temperatures(self.positions, sample / self.sampling_rate), rtol=1e-9)
+
+    def test_in_plume_mask(self):
+        """more than 1 degree above room temperature"""
+        for sample in range(len(self.frames)):
+            np.testing.assert_array_equal(self.plume.in_plume_mask(self.positions, sample / self.sampling_rate),
+                                          self.frames[sample] > self.plume.room_temperature + 1.)
+
+        # thermocouple 0 reads 19.875, 20.125 and 21.5 at samples 0, 1 and 2; exactly 20 halfway between 0 and 1
+        in_plume = [self.plume.in_plume_mask(self.positions[:1], time)[0]
+                    for time in np.array([0., 0.5, 0.75, 2.]) / self.sampling_rate]
+        self.assertEqual(in_plume, [False, False, True, True])
+
+    def test_between_thermocouples(self):
+        """inverse distance weighted, so bounded by the thermocouple temperatures, with gradients pointing uphill"""
+        positions = np.random.RandomState(0).uniform([0.1, -0.1, 0.02], [0.9, 0.1, 0.2], (50, 3))
+        temperatures = self.plume.temperatures(positions, 2. / self.sampling_rate)
+        self.assertTrue(np.all(temperatures >= self.frames[2].min() - 1e-12))
+        self.assertTrue(np.all(temperatures <= self.frames[2].max() + 1e-12))
+
+        # next to thermocouple 2 at sample 4 (22 degrees, the warmest), the gradient points at it
+        gradient = self.plume.gradients(np.array([[0.55, 0., 0.1]]), 4. / self.sampling_rate)[0]
+        self.assertLess(gradient[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
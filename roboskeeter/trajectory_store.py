@@ -0,0 +1,215 @@
+"""
+Struct-of-arrays storage for ensembles of trajectories.
+
+Instead of building a DataFrame per trajectory and concatenating them at the end, every column of the ensemble lives
+in one preallocated, typed numpy array. Trajectories are appended back to back and located through an offsets index:
+the rows of trajectory i are offsets[i]:offsets[i + 1]. The arrays grow by doubling, so appending is amortized O(1),
+and a DataFrame is only built when somebody asks for one.
+"""
+__author__ = 'richard'
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from roboskeeter.decisions import DECISIONS, PLUME_SIGNALS
+
+Column = namedtuple('Column', ['name', 'dtype', 'width', 'categories'])
+"""
+name
+    column name. vector columns (width 3) are expanded to name_x, name_y, name_z in the DataFrame
+dtype
+    numpy dtype of the column
+width
+    1 for scalars, 3 for xyz vectors
+categories
+    None, or a tuple of labels if the column holds integer codes into it
+"""
+
+
+def simulation_columns(kinematics_dtype=np.float64):
+    """columns stored for every timestep of a simulated flight"""
+    vectors = [Column(name, kinematics_dtype, 3, None)
+               for name in ['position', 'velocity', 'acceleration', 'total_f', 'random_f', 'stim_f']]
+    others = [Column('tsi', np.int32, 1, None),
+              Column('times', kinematics_dtype, 1, None),
+              Column('in_plume', np.bool_, 1, None),
+              Column('decision', np.int8, 1, DECISIONS),
+              Column('plume_signal', np.int8, 1, PLUME_SIGNALS)]
+
+    return vectors + others
+
+
+def experiment_columns():
+    """columns of the experimental trajectory csvs, see i_o.EXPERIMENT_COLUMNS"""
+    vectors = [Column(name, np.float32, 3, None) for name in ['position', 'velocity', 'acceleration']]
+    scalars = [Column(name, np.float32, 1, None)
+               for name in ['heading_angleS', 'angular_velo_xyS', 'angular_velo_yzS', 'curvatureS']]
+    others = [Column('tsi', np.int32, 1, None)]
+
+    return vectors + scalars + others
+
+
+class TrajectoryStore(object):
+    def __init__(self, columns=None, capacity=4096):
+        """
+        Parameters
+        ----------
+        columns
+            list of Column tuples. Defaults to simulation_columns()
+        capacity
+            number of rows to preallocate
+        """
+        if columns is None:
+            columns = simulation_columns()
+        self.columns = columns
+
+        self._capacity = max(int(capacity), 1)
+        self._data = OrderedDict()
+        for column in self.columns:
+            self._data[column.name] = np.empty(self._shape(column, self._capacity), dtype=column.dtype)
+
+        self.n_rows = 0
+        self._offsets = [0]
+        self._trajectory_nums = []
+
+    @classmethod
+    def from_arrays(cls, columns, arrays, offsets, trajectory_nums):
+        """
+        Wrap already filled arrays, e.g. memory-mapped ones, without copying them.
+
+        Parameters
+        ----------
+        columns
+            list of Column tuples
+        arrays
+            dict with an array for every column, all with the same number of rows
+        offsets
+            (n_trajectories + 1,) rows of trajectory i are offsets[i]:offsets[i + 1]
+        trajectory_nums
+            (n_trajectories,) labels of the trajectories
+        """
+        store = cls(columns=columns, capacity=1)
+        store.n_rows = int(offsets[-1])
+        store._capacity = store.n_rows
+        for column in columns:
+            if len(arrays[column.name]) != store.n_rows:
+                raise ValueError("column {} has {} rows, offsets say {}".format(column.name, len(arrays[column.name]),
+                                                                               store.n_rows))
+            store._data[column.name] = arrays[column.name]
+        store._offsets = [int(offset) for offset in offsets]
+        store._trajectory_nums = [int(num) for num in trajectory_nums]
+
+        return store
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def n_trajectories(self):
+        return len(self._trajectory_nums)
+
+    @property
+    def offsets(self):
+        """(n_trajectories + 1,) array. Rows of trajectory i are offsets[i]:offsets[i + 1]"""
+        return np.array(self._offsets, dtype=np.int64)
+
+    @property
+    def trajectory_nums(self):
+        return np.array(self._trajectory_nums, dtype=np.int64)
+
+    def append(self, trajectory_num, arrays):
+        """
+        Copy one trajectory into the store.
+
+        Parameters
+        ----------
+        trajectory_num
+            (int) label of the trajectory
+        arrays
+            dict with an array for every column. scalar columns are (T,), vector columns (T, 3)
+        """
+        n = len(arrays[self.columns[0].name])
+        self._reserve(self.n_rows + n)
+
+        for column in self.columns:
+            self._data[column.name][self.n_rows:self.n_rows + n] = arrays[column.name]
+
+        self.n_rows += n
+        self._offsets.append(self.n_rows)
+        self._trajectory_nums.append(int(trajectory_num))
+
+    def extend(self, other, trajectory_num_offset=0):
+        """
+        Append every trajectory of another store with the same columns.
+
+        Parameters
+        ----------
+        other
+            (TrajectoryStore)
+        trajectory_num_offset
+            (int) added to the trajectory numbers of other
+        """
+        n = other.n_rows
+        self._reserve(self.n_rows + n)
+
+        for column in self.columns:
+            self._data[column.name][self.n_rows:self.n_rows + n] = other.column(column.name)
+
+        self._offsets.extend([self.n_rows + offset for offset in other._offsets[1:]])
+        self._trajectory_nums.extend([num + trajectory_num_offset for num in other._trajectory_nums])
+        self.n_rows += n
+
+    def column(self, name):
+        """view of the filled rows of a column"""
+        return self._data[name][:self.n_rows]
+
+    def trajectory(self, i):
+        """dict of views of the rows belonging to the i-th stored trajectory"""
+        start, stop = self._offsets[i], self._offsets[i + 1]
+        return {name: array[start:stop] for name, array in self._data.iteritems()}
+
+    def trim(self):
+        """shrink the preallocated arrays to the filled rows, e.g. before pickling"""
+        self._resize(self.n_rows)
+
+    def to_dataframe(self):
+        """
+        Build a DataFrame of the store. Vector columns are split into _x, _y, _z columns, coded columns become
+        pandas Categoricals (which keep the integer codes), and a trajectory_num column is added.
+        """
+        df_dict = OrderedDict()
+        for column in self.columns:
+            array = self.column(column.name)
+            if column.width == 3:
+                for i, axis in enumerate('xyz'):
+                    df_dict[column.name + '_' + axis] = array[:, i]
+            elif column.categories is not None:
+                df_dict[column.name] = pd.Categorical.from_codes(array, categories=column.categories)
+            else:
+                df_dict[column.name] = array
+
+        lengths = np.diff(self._offsets)
+        df_dict['trajectory_num'] = np.repeat(self.trajectory_nums, lengths)
+
+        return pd.DataFrame(df_dict)
+
+    def _reserve(self, n_rows):
+        if n_rows > self._capacity:
+            self._resize(max(n_rows, 2 * self._capacity))
+
+    def _resize(self, capacity):
+        capacity = max(capacity, 1)
+        for column in self.columns:
+            new_array = np.empty(self._shape(column, capacity), dtype=column.dtype)
+            new_array[:self.n_rows] = self._data[column.name][:self.n_rows]
+            self._data[column.name] = new_array
+        self._capacity = capacity
+
+    @staticmethod
+    def _shape(column, n_rows):
+        if column.width == 1:
+            return (n_rows,)
+        else:
+            return (n_rows, column.width)